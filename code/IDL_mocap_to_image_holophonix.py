@@ -1,20 +1,33 @@
-import asyncio
 import os
-import random
 import threading
 import time
 
 import idl_helper as idl
+from comfyui_client import ComfyUIClient, load_workflow
+import numpy as np
 import pygame
+from cafe_keyframes import STATES_V2
+from frame_ring import FrameRing
+from latency_stats import STAGE_FLIP, STAGE_OSC, STAGE_POSES, LatencyStats
 from highrise_funcs import (
     draw_overlay,
+    close_screenshots,
     draw_scene,
     generate_grid_structure,
-    load_texture,
-    save_screenshot,
+    grab_screenshot_async,
+    invalidate_scene,
+    poll_screenshots,
     setup_projection_and_lighting,
+    texture_from_pixels,
 )
+from keyframe_timeline import Timeline
 from NatNetClient import NatNetClient
+from output_watcher import OutputWatcher
+from pose_filters import make_pose_filter
+from projection_surfaces import load_projection_surfaces
+from render_cache import CachedGenerator, RenderCache, TextureCache, file_hash, make_key
+from render_jobs import CANCELLED, READY, ComfyUIGenerator, FolderGenerator, MockGenerator, RenderJobManager, decode_image
+from speculative_renders import SpeculativeRenders
 from OpenGL.GL import *
 from pygame.locals import *
 from pynput.mouse import Listener
@@ -26,7 +39,62 @@ from pythonosc import udp_client
 USE_MOCK_POS_DATA = False
 USE_MOCK_IMAGE = False
 COMFYUI_OUTPUT_FOLDER = "C:\\Demos\\Wen\\ComfyUI_windows_portable\\ComfyUI\\output"
+# ComfyUI server the screenshot is sent to directly, e.g. "http://127.0.0.1:8188"
+# (fake_comfyui.py for testing). None = hand it over through the screenshot
+# and COMFYUI_OUTPUT_FOLDER folders ("Queue on change")
+COMFYUI_URL = None
+COMFYUI_WORKFLOW = "../image_gen/comfyui_worklfows/workflow_highrise.png"
+# seconds to wait for ComfyUI's image after the screenshot
+RENDERED_IMG_TIMEOUT = 30.0
+# seconds until the dummy image shows with USE_MOCK_IMAGE
+MOCK_IMAGE_DELAY = 1.0
+# rendered images by café configuration and screenshot, see render_cache
+# (None = off). Positions and size are rounded to RENDER_CACHE_QUANTUM,
+# screenshots match within RENDER_CACHE_MAX_DISTANCE of 64 hash bits, the
+# last RENDER_CACHE_TEXTURES images stay on the GPU. Only built with
+# COMFYUI_URL or USE_MOCK_IMAGE, the folder hand-off can't tell whose image
+# arrives
+RENDER_CACHE_FOLDER = "render_cache"
+RENDER_CACHE_MAX_BYTES = 2 * 1024 ** 3
+RENDER_CACHE_QUANTUM = 0.5
+RENDER_CACHE_MAX_DISTANCE = 6
+RENDER_CACHE_TEXTURES = 8
+# styling image of the workflow, part of the cache key
+STYLING_REFERENCE = "../image_gen/comfyui_worklfows/styling_reference_01.png"
+# pre-generate the image once the café stayed within SPECULATIVE_DWELL_RADIUS
+# for SPECULATIVE_DWELL_TIME seconds, at most SPECULATIVE_MAX_PENDING at a
+# time (see speculative_renders). Needs the render cache and COMFYUI_URL or
+# USE_MOCK_IMAGE, the folder hand-off can't tell whose image arrives
+SPECULATIVE_RENDERS = True
+SPECULATIVE_DWELL_TIME = 0.8
+SPECULATIVE_DWELL_RADIUS = 0.5
+SPECULATIVE_MAX_PENDING = 2
 SET_FULLSCREEN = False
+# SO_RCVBUF of the NatNet sockets in bytes, None = OS default
+NATNET_RECEIVE_BUFFER_SIZE = None
+# per-stage latency, served as JSON on localhost (None = off) and
+# written as CSV on exit
+LATENCY_HTTP_PORT = 8765
+LATENCY_CSV_PATH = "latency.csv"
+# screen and dome the pointers are cast against, None = idl_helper defaults
+PROJECTION_SURFACES_CONFIG = "projection_surfaces.json"
+# rigid body smoothing on the NatNet thread: "one_euro", "kalman" or None
+POSE_FILTER = "one_euro"
+POSE_FILTER_PARAMS = {}
+# extrapolate the filtered poses by the measured receive -> flip latency
+# (median, refreshed every PREDICTION_UPDATE_INTERVAL seconds)
+PREDICT_RENDER_LATENCY = True
+PREDICTION_UPDATE_INTERVAL = 1.0
+# seed of the random building grid
+GRID_SEED = 42
+# milliseconds to wait instead of flipping when the scene did not change
+IDLE_WAIT_MS = 2
+# without a pointer for ATTRACT_AFTER seconds the café tours the keyframes
+# of the animation export, ATTRACT_SEGMENT_SECONDS from one to the next
+# (None = off, e.g. 30.0)
+ATTRACT_AFTER = None
+ATTRACT_KEYFRAMES = STATES_V2
+ATTRACT_SEGMENT_SECONDS = 5.0
 
 # ----------------------
 # Modes
@@ -41,6 +109,8 @@ current_mode = MODE_INTERACTION
 mocap_x = 1280
 mocap_y = 800
 mocap_dist = 10
+# time.time() of the last pointer update, for the attract mode
+last_pointer_time = time.time()
 
 # Café position in the world
 pos_x, pos_y = 0, 20
@@ -54,6 +124,16 @@ overlay_texture_data = None
 
 # This flag lets us know we need to screenshot & load an image
 save_screenshot_flag = False
+# New images in COMFYUI_OUTPUT_FOLDER, started in main()
+output_watcher = None
+# Screenshot -> rendered image jobs, started in main()
+render_jobs = None
+# Rendered images of earlier visitors and the hashes of the workflow and
+# styling reference in their keys, started in main()
+render_cache = None
+render_cache_hashes = None
+# Renders started while the café dwells, started in main()
+speculative_renders = None
 
 # For reverb or other logic
 left_button_held = False
@@ -61,6 +141,12 @@ left_button_held = False
 # Create an event to signal threads to stop
 stop_event = threading.Event()
 
+# Projection surfaces, loaded in main()
+projection_surfaces = None
+
+# Latency per pipeline stage, see latency_stats
+latency_stats = LatencyStats()
+
 # holophonix client
 holophonix_client = udp_client.SimpleUDPClient("10.255.255.60", 4003)
 
@@ -110,38 +196,59 @@ holophonix_client = udp_client.SimpleUDPClient("10.255.255.60", 4003)
 
 
 
-def receive_new_pos(rigid_body_list):
-    if len(rigid_body_list) != 2:
-        return
+def receive_new_pos(ids, positions, receive_time=None):
+    if len(ids) == 2 and projection_surfaces is None:
+        # one visitor, the common case: the scalar path is cheaper than a
+        # batch of one (see pointer_bench.py)
+        start, end = positions.tolist()
+        if ids[0] > ids[1]:
+            start, end = end, start
 
-    start, end = rigid_body_list
-    if start.id_num > end.id_num:
-        start, end = end, start
+        #broadcast_rigid_body([start])
 
-    #broadcast_rigid_body([start])
-
-    pt_on_screen, pt_on_dome, rigidbody_dist = idl.process_tracked_poses(start, end)
-    if (pt_on_screen is None) or (pt_on_dome is None) or (rigidbody_dist is None):
-        return
+        pt_on_screen, pt_on_dome, rigidbody_dist = idl.process_tracked_positions(start, end)
+        latency_stats.record_since(STAGE_POSES, receive_time)
+        if (pt_on_screen is None) or (pt_on_dome is None):
+            return
+    else:
+        # one pointer per pair of rigid bodies, sorted by id
+        poses = idl.pair_tracked_poses(ids, positions)
+        if len(poses) == 0:
+            return
+
+        pts_on_screen, screen_hit, pts_on_dome, dome_hit, distances = idl.process_tracked_pose_pairs(poses, projection_surfaces)
+        latency_stats.record_since(STAGE_POSES, receive_time)
+
+        # the cafe follows the first pointer that hits both screen and dome
+        hits = np.flatnonzero(screen_hit & dome_hit)
+        if len(hits) == 0:
+            return
+        pt_on_screen = pts_on_screen[hits[0]]
+        pt_on_dome = pts_on_dome[hits[0]]
+        rigidbody_dist = distances[hits[0]]
 
     #old sound effect
     # send_2_holophonix(pt_on_dome[0], pt_on_dome[1], pt_on_dome[2], rigidbody_dist)
      
     # new sound effect
     send_2_holophonix_new(rigidbody_dist) 
+    latency_stats.record_since(STAGE_OSC, receive_time)
     send_2_pygame(pt_on_screen[0], pt_on_screen[1], rigidbody_dist)
 
 
 def receive_mock():
     """Mock thread to continuously set mocap_x, mocap_y from pygame's mouse."""
-    global mocap_x, mocap_y, mocap_dist
+    global mocap_x, mocap_y, mocap_dist, last_pointer_time
     while not stop_event.is_set():
         time.sleep(0.1)
+        previous = (mocap_x, mocap_y)
         try:
             mocap_x, mocap_y = pygame.mouse.get_pos()
         except:
             mocap_x, mocap_y = 640, 400
         mocap_dist = mocap_y / 50
+        if (mocap_x, mocap_y) != previous:
+            last_pointer_time = time.time()
 
 
 def broadcast_rigid_body(rigid_body_list):
@@ -178,49 +285,105 @@ def send_2_holophonix_new(reverb):
 
 def send_2_pygame(w, h, room_size):
     """Updates global mocap_x/mocap_y from w,h. Adjusts distance."""
-    global mocap_x, mocap_y, mocap_dist
+    global mocap_x, mocap_y, mocap_dist, last_pointer_time
     mocap_x, mocap_y = idl.map_point_2_pygame_window(w, h)
     mocap_dist = room_size * 20
+    last_pointer_time = time.time()
 
 
 # ----------------------
-# Async image loading
+# Rendered images
 # ----------------------
-async def load_rendered_img_async(img_folder):
-    """Wait for a new .png in img_folder, then load it into overlay_texture_data."""
-    global overlay_texture_data
+def start_render_jobs(screenshot_folder):
+    """Background jobs waiting for (or faking) the image of each screenshot."""
+    global output_watcher, render_jobs, render_cache, render_cache_hashes, speculative_renders
     if USE_MOCK_IMAGE:
-        print("Loading the dummy rendered image asynchronously...")
-        await asyncio.sleep(1)
-        overlay_texture_data = load_texture(
-            "../image_gen/comfyui_worklfows/workflow_highrise.png"
+        generator = MockGenerator(
+            "../image_gen/comfyui_worklfows/workflow_highrise.png", MOCK_IMAGE_DELAY
+        )
+    elif COMFYUI_URL is not None:
+        generator = ComfyUIGenerator(ComfyUIClient(COMFYUI_URL), load_workflow(COMFYUI_WORKFLOW))
+    else:
+        output_watcher = OutputWatcher(COMFYUI_OUTPUT_FOLDER)
+        try:
+            output_watcher.start()
+        except OSError as e:
+            print(f"WARNING: not watching for rendered images: {e}")
+            output_watcher = None
+            return
+        generator = FolderGenerator(
+            output_watcher, os.path.join(screenshot_folder, "screenshot.png")
         )
-        print("Dummy Rendered image loaded!")
-        return
-
-    print("Loading the rendered image asynchronously...")
-    start_time = time.time()
-    time_elapsed = 0
-    # Wait until a new PNG file is found in the folder with a modification time after start_time
-    while time_elapsed < 30:
-        await asyncio.sleep(0.1)
-        for file_name in os.listdir(img_folder):
-            file_path = os.path.join(img_folder, file_name)
-            if os.path.isfile(file_path) and file_name.endswith(".png"):
-                file_mod_time = os.path.getmtime(file_path)
-                if file_mod_time > start_time:
-                    retries = 5
-                    for attempt in range(retries):
-                        try:
-                            overlay_texture_data = load_texture(file_path)
-                            print("Rendered image loaded!")
-                            return
-                        except FileNotFoundError as e:
-                            print(f"Attempt {attempt + 1} failed: {e}. Retrying...")
-                            await asyncio.sleep(0.5)
-        time_elapsed = time.time() - start_time
-        print(time_elapsed)
-    print("loading image failed")
+    if RENDER_CACHE_FOLDER is not None and not generator.cacheable:
+        print("WARNING: no render cache with the folder hand-off, set COMFYUI_URL")
+    elif RENDER_CACHE_FOLDER is not None:
+        textures = TextureCache(
+            lambda texture: glDeleteTextures([texture[0]]), RENDER_CACHE_TEXTURES
+        )
+        render_cache = RenderCache(
+            RENDER_CACHE_FOLDER, RENDER_CACHE_MAX_BYTES, RENDER_CACHE_MAX_DISTANCE, textures
+        )
+        render_cache_hashes = (file_hash(COMFYUI_WORKFLOW), file_hash(STYLING_REFERENCE))
+        print(f"Render cache: {len(render_cache.files)} images in {RENDER_CACHE_FOLDER}")
+        generator = CachedGenerator(generator, render_cache)
+    render_jobs = RenderJobManager(generator, timeout=RENDERED_IMG_TIMEOUT)
+    render_jobs.start()
+    if SPECULATIVE_RENDERS and render_cache is not None:
+        speculative_renders = SpeculativeRenders(
+            render_jobs, render_cache, rendered_img_key,
+            SPECULATIVE_DWELL_TIME, SPECULATIVE_DWELL_RADIUS, SPECULATIVE_MAX_PENDING,
+        )
+
+
+def rendered_img_key(x, y, size):
+    """Cache key of a frozen café configuration, None without the cache."""
+    if render_cache is None:
+        return None
+    return make_key(x, y, size, GRID_SEED, *render_cache_hashes, RENDER_CACHE_QUANTUM)
+
+
+def request_rendered_img(screenshot, size=None, cache_key=None):
+    """The screenshot (file or pixels) is ready, called from the screenshot threads."""
+    if render_jobs is not None:
+        render_jobs.submit(screenshot, cache_key)
+        print("Waiting for the rendered image...")
+
+
+def poll_rendered_img():
+    """Upload the image of a finished job into overlay_texture_data, never blocks.
+    Returns True if it did."""
+    global overlay_texture_data
+    if render_jobs is None:
+        return False
+    loaded = False
+    for job in render_jobs.poll():
+        if job.speculative:
+            if job.state == READY and job.pixels is not None and job.cache_path is not None \
+               and job.cache_path not in render_cache.textures:
+                # upload now, a click on it then skips decoding and upload
+                render_cache.textures.put(job.cache_path, texture_from_pixels(job.pixels, *job.size))
+                print(f"Pre-generated image ready after {job.elapsed():.2f} s")
+            elif job.state not in (READY, CANCELLED):
+                print(f"pre-generating failed: job {job.job_id} {job.state} {job.error or ''}")
+            continue
+        if job.state != READY:
+            print(f"loading image failed: job {job.job_id} {job.state} {job.error or ''}")
+        elif current_mode == MODE_RENDER:
+            texture = None
+            if render_cache is not None and job.cache_path is not None:
+                texture = render_cache.textures.get(job.cache_path)
+            if texture is None:
+                if job.pixels is None:
+                    # the texture was evicted after the job was answered
+                    job.pixels, job.size = decode_image(job.cache_path)
+                texture = texture_from_pixels(job.pixels, *job.size)
+                if render_cache is not None and job.cache_path is not None:
+                    render_cache.textures.put(job.cache_path, texture)
+            overlay_texture_data = texture
+            source = "from the cache " if job.cache_hit else ""
+            print(f"Rendered image loaded {source}after {job.elapsed():.2f} s!")
+            loaded = True
+    return loaded
 
 
 # ----------------------
@@ -231,10 +394,29 @@ def main():
     global pos_x, pos_y, cafe_size
     global frozen_x, frozen_y, frozen_size
     global overlay_texture_data, save_screenshot_flag
+    global projection_surfaces
 
-    random.seed(42)
+    if PROJECTION_SURFACES_CONFIG is not None:
+        projection_surfaces = load_projection_surfaces(PROJECTION_SURFACES_CONFIG)
+        if idl.uses_fixed_surfaces(projection_surfaces):
+            # the closed form plane and dome hit the same, for less
+            projection_surfaces = None
     streaming_client = None
     receive_thread = None
+    frame_ring = None
+    pose_filter = None
+    last_prediction_update = time.time()
+    last_frame_number = None
+    # receive time of the frame shown by the next flip
+    flip_receive_time = None
+    attract_timeline = None
+    if ATTRACT_AFTER is not None:
+        attract_timeline = Timeline(
+            ATTRACT_KEYFRAMES,
+            durations=[ATTRACT_SEGMENT_SECONDS] * len(ATTRACT_KEYFRAMES),
+        )
+    # time.time() the current attract tour started, None = not touring
+    attract_start = None
 
     # Start up either a mock or real streaming client
     if USE_MOCK_POS_DATA:
@@ -243,7 +425,24 @@ def main():
     else:
         streaming_client = NatNetClient()
         streaming_client.set_use_multicast(False)
-        streaming_client.pos_listener = receive_new_pos
+        streaming_client.set_decoder("arrays")
+        # only rigid bodies and timestamps are used, skip everything else
+        streaming_client.set_sections(["rigid_bodies", "suffix"])
+        # after a stall only decode the newest queued frame
+        streaming_client.set_drain_socket(True)
+        streaming_client.set_receive_buffer_size(NATNET_RECEIVE_BUFFER_SIZE)
+        # the data thread fills the ring, the render loop reads the latest
+        frame_ring = FrameRing()
+        streaming_client.set_frame_ring(frame_ring)
+        streaming_client.set_latency_stats(latency_stats)
+        if POSE_FILTER is not None:
+            pose_filter = make_pose_filter(POSE_FILTER, **POSE_FILTER_PARAMS)
+            streaming_client.set_pose_filter(pose_filter)
+        if LATENCY_HTTP_PORT is not None:
+            try:
+                latency_stats.serve_http(LATENCY_HTTP_PORT)
+            except OSError as e:
+                print(f"WARNING: not serving latency stats on port {LATENCY_HTTP_PORT}: {e}")
         # Calls RB handler on emulator for data transmission.
         # streaming_client.new_frame_listener = receive_new_frame
         # streaming_client.new_frame_with_data_listener = receive_new_frame_with_data  # type ignore # noqa E501
@@ -272,11 +471,13 @@ def main():
     axes_width = 4.0
     max_axes = 30
     grid = generate_grid_structure(
-        floors=floors, max_axes_x=max_axes, max_axes_z=max_axes, porosity=0.5
+        floors=floors, max_axes_x=max_axes, max_axes_z=max_axes, porosity=0.5,
+        seed=GRID_SEED,
     )
 
     screenshot_folder = "screenshot"
     os.makedirs(screenshot_folder, exist_ok=True)
+    start_render_jobs(screenshot_folder)
 
     running = True
 
@@ -286,6 +487,9 @@ def main():
                 running = False
             elif event.type == KEYDOWN and event.key == K_ESCAPE:
                 running = False
+            elif event.type == VIDEOEXPOSE:
+                # window uncovered, the last frame may be gone
+                invalidate_scene()
 
             elif event.type == MOUSEBUTTONDOWN and event.button == 1:
                 # Toggle between modes on each click
@@ -293,6 +497,9 @@ def main():
                     # Switch to render mode: freeze the last known café position
                     current_mode = MODE_RENDER
                     frozen_x, frozen_y, frozen_size = pos_x, pos_y, cafe_size
+                    # only the pre-generation of this configuration may go on
+                    if speculative_renders is not None:
+                        speculative_renders.cancel(rendered_img_key(frozen_x, frozen_y, frozen_size))
 
                     # Clear any old overlay
                     overlay_texture_data = None
@@ -304,7 +511,28 @@ def main():
                     # Switch back to interaction mode
                     current_mode = MODE_INTERACTION
                     overlay_texture_data = None
+                    if render_jobs is not None:
+                        render_jobs.cancel_all()
                     print("interact")
+                # the screenshot needs a fresh frame, the overlay drew over it
+                invalidate_scene()
+
+        # Screenshots the GPU finished copying go to the writer thread
+        poll_screenshots()
+        # ComfyUI's image, generated and decoded in the background
+        poll_rendered_img()
+
+        # Latest tracked frame, once per new frame
+        if frame_ring is not None:
+            snapshot = frame_ring.latest()
+            if snapshot is not None and snapshot.frame_number != last_frame_number:
+                last_frame_number = snapshot.frame_number
+                flip_receive_time = snapshot.receive_time
+                receive_new_pos(
+                    snapshot.ids[:snapshot.count],
+                    snapshot.pos[:snapshot.count],
+                    flip_receive_time,
+                )
 
         # Update / Draw based on the current mode
         if current_mode == MODE_INTERACTION:
@@ -313,51 +541,108 @@ def main():
             world_width = 96
             world_height = 50
 
-            # Convert from screen coords to world coords
-            pos_x = ((display[0] - mouse_x) / display[0]) * world_width - (
-                world_width / 2
-            )
+            # Nobody pointing for a while: tour the keyframes
+            if attract_timeline is not None and time.time() - last_pointer_time > ATTRACT_AFTER:
+                if attract_start is None:
+                    attract_start = time.time()
+                # axes_width stays, a new one would rebuild the building every frame
+                pos_x, pos_y, cafe_size = attract_timeline.sample(time.time() - attract_start)[:3].tolist()
+                # the keyframes give the lower-left corner, the live scene the center
+                pos_x += cafe_size / 2
+                pos_y += cafe_size / 2
+            else:
+                attract_start = None
+
+                # Convert from screen coords to world coords
+                pos_x = ((display[0] - mouse_x) / display[0]) * world_width - (
+                    world_width / 2
+                )
+                pos_y = ((display[1] - mouse_y) / display[1]) * world_height
+
+                cafe_size = max(axes_width,mocap_dist)
 
             screen_edge_distance = 40
             pos_x = max(
                 screen_edge_distance - world_width / 2,
                 min(-screen_edge_distance + world_width / 2, pos_x),
             )
-
-            pos_y = ((display[1] - mouse_y) / display[1]) * world_height
             pos_y = max(0, min(pos_y, building_height-floor_height))
 
-
-            cafe_size = max(axes_width,mocap_dist)
+            # The café dwells somewhere new: pre-generate its image
+            speculative_key = None
+            if speculative_renders is not None:
+                speculative_key = speculative_renders.update(pos_x, pos_y, cafe_size)
+                if speculative_key is not None:
+                    # the frame grabbed below must show this configuration
+                    invalidate_scene()
             # Draw the scene with the live café position
-            draw_scene(pos_x, pos_y, cafe_size, axes_width, grid, floors, floor_height=floor_height)
+            drawn = draw_scene(pos_x, pos_y, cafe_size, axes_width, grid, floors, floor_height=floor_height)
+            if speculative_key is not None:
+                grab_screenshot_async(
+                    display,
+                    lambda pixels, size, key=speculative_key: speculative_renders.submit(pixels, key),
+                )
         else:
             # If an overlay texture is available, draw it now
             if overlay_texture_data is not None:
                 texture_id, tex_width, tex_height = overlay_texture_data
                 draw_overlay(texture_id, tex_width, tex_height, display)
+                drawn = True
             else:
                 # RENDER mode: freeze at (frozen_x, frozen_y, frozen_size)
-                draw_scene(
+                drawn = draw_scene(
                     frozen_x, frozen_y, frozen_size, axes_width, grid, floors, floor_height=floor_height
                 )
 
         # If user requested a screenshot, do so and load the new image
         if save_screenshot_flag:
             save_screenshot_flag = False
-            save_screenshot(display, os.path.join(screenshot_folder, "screenshot.png"))
-            asyncio.run(load_rendered_img_async(COMFYUI_OUTPUT_FOLDER))
+            # the readback runs on the GPU; the job sends the pixels to
+            # ComfyUI or writes them to screenshot_folder, unless the cache
+            # already has the image
+            cache_key = rendered_img_key(frozen_x, frozen_y, frozen_size)
+            grab_screenshot_async(
+                display,
+                lambda pixels, size, key=cache_key: request_rendered_img(pixels, size, key),
+            )
 
         
 
-        pygame.display.flip()
+        # Nothing moved: keep showing the last frame
+        if drawn:
+            pygame.display.flip()
+            latency_stats.record_since(STAGE_FLIP, flip_receive_time)
+            flip_receive_time = None
+        else:
+            pygame.time.wait(IDLE_WAIT_MS)
+
+        # Predict the poses as far ahead as they are old when shown
+        if pose_filter is not None and PREDICT_RENDER_LATENCY and \
+           time.time() - last_prediction_update > PREDICTION_UPDATE_INTERVAL:
+            last_prediction_update = time.time()
+            render_latency = latency_stats.get_percentile(STAGE_FLIP, 50)
+            if render_latency is not None:
+                pose_filter.set_prediction(render_latency)
 
     # Cleanup
+    close_screenshots()
+    if speculative_renders is not None:
+        print(
+            f"Speculative renders: {speculative_renders.submitted_count} queued, "
+            f"{speculative_renders.cancelled_count} cancelled; render cache: "
+            f"{render_cache.hit_count} hits, {render_cache.miss_count} misses"
+        )
+    if render_jobs is not None:
+        render_jobs.stop()
+    if output_watcher is not None:
+        output_watcher.stop()
     stop_event.set()
     if receive_thread:
         receive_thread.join()
     if streaming_client:
         streaming_client.shutdown()
+        latency_stats.dump_csv(LATENCY_CSV_PATH)
+        latency_stats.shutdown()
 
 
 if __name__ == "__main__":
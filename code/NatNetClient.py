@@ -28,6 +28,8 @@ import copy
 import time
 import DataDescriptions
 import MoCapData
+import mocap_arrays
+import natnet_decoder
 
 
 def trace(*args):
@@ -90,6 +92,12 @@ class NatNetClient:
         self.data_port = 1511
 
         self.pos_listener = None
+        # Optional frame_ring.FrameRing, every decoded frame is pushed to it
+        # from the data thread
+        self.frame_ring = None
+        # Optional pose_filters.PoseFilter, smooths (and predicts) the rigid
+        # body positions of every decoded frame on the data thread
+        self.pose_filter = None
     
 
         self.use_multicast = None
@@ -100,6 +108,34 @@ class NatNetClient:
         self.new_frame_listener = None
         self.new_frame_with_data_listener = None
 
+        # Frame of data decoder.
+        # "legacy" = reference decoder, slices the packet per field
+        # "fast"   = natnet_decoder, precompiled layouts read in place
+        # "arrays" = "fast", rigid bodies go into the NumPy arrays of a
+        #            mocap_arrays.MoCapFrame that is reused for every frame
+        #            (NatNet 3.0 and later, older streams use "legacy")
+        self.decoder = "legacy"
+        self.frame = None
+
+        # Receive path.
+        # drain_socket: after each blocking receive, read everything else
+        # already queued on the socket (up to drain_limit datagrams) and only
+        # decode the newest frame of data, the others are counted as dropped
+        # receive_buffer_size: SO_RCVBUF in bytes, None = OS default
+        self.drain_socket = False
+        self.drain_limit = 256
+        self.dropped_frame_count = 0
+        self.receive_buffer_size = None
+
+        # Optional latency_stats.LatencyStats, fed with the decode stage of
+        # every frame and the Motive stage once the server clock is known
+        self.latency_stats = None
+        self.high_resolution_clock_frequency = 0
+
+        # Frame sections to decode, None = all of them.
+        # See natnet_decoder.SECTION_NAMES, honored by "fast" and "arrays".
+        self.sections = None
+
         # Set Application Name
         self.__application_name = "Not Set"
 
@@ -216,6 +252,68 @@ class NatNetClient:
     def get_print_level(self):
         return self.print_level
 
+    def set_decoder(self, decoder="legacy"):
+        if decoder in ("legacy", "fast", "arrays"):
+            self.decoder = decoder
+        if self.decoder == "arrays" and self.frame is None:
+            self.frame = mocap_arrays.MoCapFrame()
+        return self.decoder
+
+    def get_decoder(self):
+        return self.decoder
+
+    def set_drain_socket(self, drain_socket=True):
+        self.drain_socket = drain_socket
+
+    def get_drain_socket(self):
+        return self.drain_socket
+
+    def get_dropped_frame_count(self):
+        return self.dropped_frame_count
+
+    def set_receive_buffer_size(self, receive_buffer_size=None):
+        """SO_RCVBUF for sockets created after this call"""
+        self.receive_buffer_size = receive_buffer_size
+
+    def get_receive_buffer_size(self):
+        return self.receive_buffer_size
+
+    def set_latency_stats(self, latency_stats):
+        self.latency_stats = latency_stats
+
+    def get_latency_stats(self):
+        return self.latency_stats
+
+    def get_high_resolution_clock_frequency(self):
+        return self.high_resolution_clock_frequency
+
+    def set_frame_ring(self, frame_ring):
+        self.frame_ring = frame_ring
+
+    def get_frame_ring(self):
+        return self.frame_ring
+
+    def set_pose_filter(self, pose_filter):
+        self.pose_filter = pose_filter
+
+    def get_pose_filter(self):
+        return self.pose_filter
+
+    def set_sections(self, sections=None):
+        """Restricts frame decoding to the given section names,
+        None decodes every section"""
+        if sections is None:
+            self.sections = None
+        else:
+            self.sections = frozenset(sections)
+            for name in self.sections - set(natnet_decoder.SECTION_NAMES):
+                print("WARNING: unknown frame section '%s' ignored" % name)
+            self.sections &= set(natnet_decoder.SECTION_NAMES)
+        return self.sections
+
+    def get_sections(self):
+        return self.sections
+
     def connected(self):
         ret_value = True
         # check sockets
@@ -233,6 +331,15 @@ class NatNetClient:
             ret_value = False
         return ret_value
 
+    def __set_receive_buffer_size(self, in_socket):
+        if in_socket is None or self.receive_buffer_size is None:
+            return
+        try:
+            in_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF,
+                                 self.receive_buffer_size)
+        except socket.error as e:
+            print(f'Socket error: {e}')
+
     # Create a command socket to attach to the NatNet stream
     def __create_command_socket(self):
         result = None
@@ -259,6 +366,7 @@ class NatNetClient:
                 result.bind((self.local_ip_address, 0))
             except socket.error as e:
                 print(f'Socket error: {e}')
+        self.__set_receive_buffer_size(result)
         return result
 
     # Create a data socket to attach to the NatNet stream
@@ -291,6 +399,7 @@ class NatNetClient:
             except socket.error as e:
                 print(f'Unicast Socket Error: {e}')
                 sys.exit(1)
+        self.__set_receive_buffer_size(result)
         return result
 
     def __unpack_rigid_body_3_and_above(self, data, rb_num):
@@ -1017,47 +1126,37 @@ class NatNetClient:
         rel_offset, frame_prefix_data = self.__unpack_frame_prefix_data(data[offset:]) #type: ignore  # noqa E501
         offset += rel_offset
         mocap_data.set_prefix_data(frame_prefix_data)
-        frame_number = frame_prefix_data.frame_number
 
         # Markerset Data
         rel_offset, marker_set_data = self.__unpack_marker_set_data(data[offset:], (packet_size - offset), major, minor) #type: ignore  # noqa E501
         offset += rel_offset
         mocap_data.set_marker_set_data(marker_set_data)
-        marker_set_count = marker_set_data.get_marker_set_count()
-        unlabeled_markers_count = marker_set_data.get_unlabeled_marker_count()
 
         # Legacy Other Markers
         rel_offset, legacy_other_markers = self.__unpack_legacy_other_markers(data[offset:], (packet_size - offset),major, minor) #type: ignore  # noqa E501
         offset += rel_offset
         mocap_data.set_legacy_other_markers(legacy_other_markers)
-        marker_set_count = legacy_other_markers.get_marker_count()
-        legacy_other_markers_count = marker_set_data.get_unlabeled_marker_count() #type: ignore  # noqa F401
 
         # Rigid Body Data
         rel_offset, rigid_body_data = self.__unpack_rigid_body_data(data[offset:], (packet_size - offset), major, minor) #type: ignore  # noqa E501
         offset += rel_offset
         mocap_data.set_rigid_body_data(rigid_body_data)
-        rigid_body_count = rigid_body_data.get_rigid_body_count()
 
         # Skeleton Data
         rel_offset, skeleton_data = self.__unpack_skeleton_data(data[offset:], (packet_size - offset), major, minor) #type: ignore  # noqa E501
         offset += rel_offset
         mocap_data.set_skeleton_data(skeleton_data)
-        skeleton_count = skeleton_data.get_skeleton_count()
 
         # Assets (Motive 3.1/NatNet 4.1 and greater)
-        asset_count = 0
         if (((major >= 4) and (minor >= 1)) or (major > 4)):
             rel_offset, asset_data = self.__unpack_asset_data(data[offset:], (packet_size - offset), major, minor) #type: ignore  # noqa E501
             offset += rel_offset
             mocap_data.set_asset_data(asset_data)
-            asset_count = asset_data.get_asset_count()
 
         # Labeled Marker Data
         rel_offset, labeled_marker_data = self.__unpack_labeled_marker_data(data[offset:], (packet_size - offset), major, minor) #type: ignore  # noqa E501
         offset += rel_offset
         mocap_data.set_labeled_marker_data(labeled_marker_data)
-        labeled_marker_count = labeled_marker_data.get_labeled_marker_count()
 
         # Force Plate Data
         rel_offset, force_plate_data = self.__unpack_force_plate_data(data[offset:], (packet_size - offset), major, minor) #type: ignore  # noqa E501
@@ -1075,49 +1174,58 @@ class NatNetClient:
         offset += rel_offset
         mocap_data.set_suffix_data(frame_suffix_data)
 
-        timecode = frame_suffix_data.timecode
-        timecode_sub = frame_suffix_data.timecode_sub
-        timestamp = frame_suffix_data.timestamp
-        is_recording = frame_suffix_data.is_recording
-        tracked_models_changed = frame_suffix_data.tracked_models_changed
+        self.__send_frame_listeners(mocap_data, offset)
+
+        return offset, mocap_data
+
+    def __send_frame_listeners(self, mocap_data, offset):
+        """Sends the frame summary to new_frame(_with_data)_listener"""
+        if self.new_frame_listener is None and \
+           self.new_frame_with_data_listener is None:
+            return
+
+        def count(section_data, get_count):
+            # sections skipped by the decoder are None
+            if section_data is None:
+                return 0
+            return get_count(section_data)
+
+        suffix_data = mocap_data.suffix_data
+        if suffix_data is None:
+            suffix_data = MoCapData.FrameSuffixData()
+        data_dict = {}
+        data_dict["frame_number"] = mocap_data.prefix_data.frame_number
+        data_dict["marker_set_count"] = count(mocap_data.marker_set_data, MoCapData.MarkerSetData.get_marker_set_count) #type: ignore  # noqa E501
+        data_dict["unlabeled_markers_count"] = count(mocap_data.marker_set_data, MoCapData.MarkerSetData.get_unlabeled_marker_count) #type: ignore  # noqa E501
+        data_dict["rigid_body_count"] = count(mocap_data.rigid_body_data, MoCapData.RigidBodyData.get_rigid_body_count) #type: ignore  # noqa E501
+        data_dict["skeleton_count"] = count(mocap_data.skeleton_data, MoCapData.SkeletonData.get_skeleton_count) #type: ignore  # noqa E501
+        data_dict["asset_count"] = count(mocap_data.asset_data, MoCapData.AssetData.get_asset_count) #type: ignore  # noqa E501
+        data_dict["labeled_marker_count"] = count(mocap_data.labeled_marker_data, MoCapData.LabeledMarkerData.get_labeled_marker_count) #type: ignore  # noqa E501
+        data_dict["timecode"] = suffix_data.timecode
+        data_dict["timecode_sub"] = suffix_data.timecode_sub
+        data_dict["timestamp"] = suffix_data.timestamp
+        data_dict["is_recording"] = suffix_data.is_recording
+        data_dict["tracked_models_changed"] = suffix_data.tracked_models_changed #type: ignore  # noqa E501
 
         # Send information to any listener.
         if self.new_frame_listener is not None:
-            data_dict = {}
-            data_dict["frame_number"] = frame_number
-            data_dict["marker_set_count"] = marker_set_count
-            data_dict["unlabeled_markers_count"] = unlabeled_markers_count
-            data_dict["rigid_body_count"] = rigid_body_count
-            data_dict["skeleton_count"] = skeleton_count
-            data_dict["asset_count"] = asset_count
-            data_dict["labeled_marker_count"] = labeled_marker_count
-            data_dict["timecode"] = timecode
-            data_dict["timecode_sub"] = timecode_sub
-            data_dict["timestamp"] = timestamp
-            data_dict["is_recording"] = is_recording
-            data_dict["tracked_models_changed"] = tracked_models_changed
-
-            self.new_frame_listener(data_dict)
+            self.new_frame_listener(dict(data_dict))
 
         if self.new_frame_with_data_listener is not None:
-            data_dict = {}
-            data_dict["frame_number"] = frame_number
-            data_dict["marker_set_count"] = marker_set_count
-            data_dict["unlabeled_markers_count"] = unlabeled_markers_count
-            data_dict["rigid_body_count"] = rigid_body_count
-            data_dict["skeleton_count"] = skeleton_count
-            data_dict["asset_count"] = asset_count
-            data_dict["labeled_marker_count"] = labeled_marker_count
-            data_dict["timecode"] = timecode
-            data_dict["timecode_sub"] = timecode_sub
-            data_dict["timestamp"] = timestamp
-            data_dict["is_recording"] = is_recording
-            data_dict["tracked_models_changed"] = tracked_models_changed
             data_dict["offset"] = offset
             data_dict["mocap_data"] = mocap_data
             self.new_frame_with_data_listener(data_dict)
 
-        return offset, mocap_data
+    def unpack_frame_of_data(self, data, offset, packet_size, major, minor):
+        """Decodes the NAT_FRAMEOFDATA payload starting at offset in data
+        with the selected decoder. Returns bytes consumed and the frame"""
+        if self.decoder in ("fast", "arrays") and major >= 3:
+            frame = self.frame if self.decoder == "arrays" else None
+            rel_offset, mocap_data = natnet_decoder.unpack_mocap_data(data, offset, packet_size, major, minor, self.rigid_body_listener, self.sections, frame) #type: ignore  # noqa E501
+            self.__send_frame_listeners(mocap_data, rel_offset)
+        else:
+            rel_offset, mocap_data = self.__unpack_mocap_data(data[offset:], packet_size, major, minor) #type: ignore  # noqa E501
+        return rel_offset, mocap_data
 
     def __unpack_marker_set_description(self, data, major, minor):
         """Unpack marker description packet"""
@@ -1912,6 +2020,11 @@ class NatNetClient:
         self.__nat_net_stream_version_server[1] = nnsvs[1]
         self.__nat_net_stream_version_server[2] = nnsvs[2]
         self.__nat_net_stream_version_server[3] = nnsvs[3]
+
+        # High resolution clock frequency of the frame suffix stamps
+        if len(data) >= offset + 8:
+            self.high_resolution_clock_frequency = int.from_bytes(data[offset:offset+8], byteorder='little') #type: ignore  # noqa E501
+            offset += 8
         if (self.__nat_net_requested_version[0] == 0) and\
            (self.__nat_net_requested_version[1] == 0):
             print("resetting requested version to %d %d %d %d from %d %d %d %d" % ( #type: ignore  # noqa E501
@@ -1991,20 +2104,12 @@ class NatNetClient:
                     # return 4
 
             if len(buffer_list[buffer_list_in_use_index]) > 0:
-                # peek ahead at message_id
-                message_id = get_message_id(buffer_list[buffer_list_in_use_index]) #type: ignore  # noqa E501
-                tmp_str = "mi_%1.1d" % message_id
-                if tmp_str not in message_id_dict:
-                    message_id_dict[tmp_str] = 0
-                message_id_dict[tmp_str] += 1
-                print_level = gprint_level()
-                if message_id == self.NAT_FRAMEOFDATA:
-                    if print_level > 0:
-                        if (message_id_dict[tmp_str] % print_level) == 0:
-                            print_level = 1
-                        else:
-                            print_level = 0
-                message_id = self.__process_message(buffer_list[buffer_list_in_use_index], print_level) #type: ignore  # noqa E501
+                packets = [buffer_list[buffer_list_in_use_index]]
+                if self.drain_socket:
+                    packets = self.__drain_socket(in_socket, recv_buffer_size, packets[0]) #type: ignore  # noqa E501
+                receive_time = time.perf_counter()
+                for packet in packets:
+                    message_id = self.__dispatch_message(packet, message_id_dict, gprint_level(), receive_time) #type: ignore  # noqa E501
                 buffer_list[buffer_list_in_use_index] = bytearray(0)
 
             if not self.use_multicast:
@@ -2024,6 +2129,7 @@ class NatNetClient:
             # Block for input
             try:
                 data, addr = in_socket.recvfrom(recv_buffer_size)
+                receive_time = time.perf_counter()
             except socket.error as msg:
                 if not stop():
                     print("ERROR: data socket access error occurred:\n  %s" % msg) #type: ignore  # noqa E501
@@ -2039,25 +2145,59 @@ class NatNetClient:
                 print("ERROR: data socket access timeout occurred. Server not responding") #type: ignore  # noqa E501
                 # return 4
             if len(data) > 0:
-                # peek ahead at message_id
-                message_id = get_message_id(data)
-                tmp_str = "mi_%1.1d" % message_id
-                if tmp_str not in message_id_dict:
-                    message_id_dict[tmp_str] = 0
-                message_id_dict[tmp_str] += 1
-                print_level = gprint_level()
-                if message_id == self.NAT_FRAMEOFDATA:
-                    if print_level > 0:
-                        if (message_id_dict[tmp_str] % print_level) == 0:
-                            print_level = 1
-                        else:
-                            print_level = 0
-                message_id = self.__process_message(data, print_level)
+                packets = [data]
+                if self.drain_socket:
+                    packets = self.__drain_socket(in_socket, recv_buffer_size, data) #type: ignore  # noqa E501
+                    receive_time = time.perf_counter()
+                for packet in packets:
+                    message_id = self.__dispatch_message(packet, message_id_dict, gprint_level(), receive_time) #type: ignore  # noqa E501
                 data = bytearray(0)
 
         return 0
 
-    def __process_message(self, data: bytes, print_level=0):
+    def __dispatch_message(self, data, message_id_dict, print_level, receive_time=None): #type: ignore  # noqa E501
+        # peek ahead at message_id
+        message_id = get_message_id(data)
+        tmp_str = "mi_%1.1d" % message_id
+        if tmp_str not in message_id_dict:
+            message_id_dict[tmp_str] = 0
+        message_id_dict[tmp_str] += 1
+        if message_id == self.NAT_FRAMEOFDATA:
+            if print_level > 0:
+                if (message_id_dict[tmp_str] % print_level) == 0:
+                    print_level = 1
+                else:
+                    print_level = 0
+        return self.__process_message(data, print_level, receive_time)
+
+    def __drain_socket(self, in_socket, recv_buffer_size, data):
+        """Reads the datagrams already queued behind data without blocking.
+        Returns them in order with every frame of data but the newest one
+        dropped (counted in dropped_frame_count)."""
+        packets = [data]
+        timeout = in_socket.gettimeout()
+        try:
+            in_socket.settimeout(0.0)
+            while len(packets) < self.drain_limit:
+                packets.append(in_socket.recvfrom(recv_buffer_size)[0])
+        except OSError:
+            # BlockingIOError, nothing queued anymore (or socket closed)
+            pass
+        finally:
+            try:
+                in_socket.settimeout(timeout)
+            except OSError:
+                pass
+
+        frame_indices = [i for i, packet in enumerate(packets)
+                         if get_message_id(packet) == self.NAT_FRAMEOFDATA]
+        if len(frame_indices) < 2:
+            return packets
+        self.dropped_frame_count += len(frame_indices) - 1
+        stale = set(frame_indices[:-1])
+        return [packet for i, packet in enumerate(packets) if i not in stale]
+
+    def __process_message(self, data: bytes, print_level=0, receive_time=None): #type: ignore  # noqa E501
         # return message ID
         major = self.get_major()
         minor = self.get_minor()
@@ -2080,14 +2220,22 @@ class NatNetClient:
             trace("Message ID : %3.1d NAT_FRAMEOFDATA" % message_id)
             trace("Packet Size: ", packet_size)
 
-            offset_tmp, mocap_data = self.__unpack_mocap_data(data[offset:], packet_size, major, minor) #type: ignore  # noqa E501
+            offset_tmp, mocap_data = self.unpack_frame_of_data(data, offset, packet_size, major, minor) #type: ignore  # noqa E501
             offset += offset_tmp
+            if self.pose_filter is not None:
+                self.pose_filter.apply(mocap_data, receive_time)
+            if self.latency_stats is not None:
+                self.latency_stats.record_frame(mocap_data, receive_time, self.high_resolution_clock_frequency) #type: ignore  # noqa E501
+            if self.frame_ring is not None:
+                self.frame_ring.push(mocap_data, receive_time)
             # print("MoCap Frame: %d\n" % (mocap_data.prefix_data.frame_number))
             # get a string version of the data for output
             if print_level >= 1:
                 # mocap_data_str = mocap_data.get_as_string()
                 # print(" %s\n" % mocap_data_str)
-                self.pos_listener(mocap_data.rigid_body_data.rigid_body_list)
+                if self.pos_listener is not None and \
+                   mocap_data.rigid_body_data is not None:
+                    self.pos_listener(mocap_data.rigid_body_data.rigid_body_list) #type: ignore  # noqa E501
 
 
         elif message_id == self.NAT_MODELDEF:
@@ -2249,6 +2397,17 @@ class NatNetClient:
     def get_server_version(self):
         return self.__server_version
 
+    # Entry points for clients that drive the sockets themselves,
+    # see async_natnet_client.AsyncNatNetClient
+    def create_command_socket(self):
+        return self.__create_command_socket()
+
+    def create_data_socket(self):
+        return self.__create_data_socket()
+
+    def process_message(self, data, print_level=0, receive_time=None):
+        return self.__process_message(data, print_level, receive_time)
+
     def run(self, thread_option):
         # Create the data socket
         self.data_socket = self.__create_data_socket()
@@ -0,0 +1,190 @@
+"""
+asyncio version of NatNetClient.
+
+NatNetClient.run() starts a command and a data thread that block in
+recvfrom() with timeouts. AsyncNatNetClient attaches the same sockets to the
+running event loop with loop.create_datagram_endpoint(), sends keep-alives
+from a timer task and hands decoded frames to
+
+    async with AsyncNatNetClient() as client:
+        async for mocap_data in client.frames():
+            ...
+
+Decoding, listeners, the pose filter and the frame ring work exactly as with NatNetClient.
+close() (or leaving the async with block) cancels the keep-alive task,
+closes both transports and ends every frames() iteration; closing again
+does nothing.
+
+It is a standalone client for asyncio programs. The main app keeps the
+threaded NatNetClient, its render loop and background jobs run on
+threads rather than an event loop.
+
+    python async_natnet_client.py
+"""
+
+import asyncio
+import time
+
+from NatNetClient import NatNetClient, get_message_id
+
+# ----------------------
+# Configuration
+# ----------------------
+KEEP_ALIVE_INTERVAL = 1.0
+# decoded frames waiting for frames(), the oldest is dropped when full
+FRAME_QUEUE_SIZE = 1
+
+
+class NatNetProtocol(asyncio.DatagramProtocol):
+    """Forwards the datagrams of one socket to an AsyncNatNetClient"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+
+    def datagram_received(self, data, addr):
+        self.client.datagram_received(data, addr)
+
+    def error_received(self, exc):
+        print("ERROR: %s socket error occurred:\n  %s" % (self.name, exc))
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            print("ERROR: %s socket closed:\n  %s" % (self.name, exc))
+
+
+class AsyncNatNetClient(NatNetClient):
+    def __init__(self, frame_queue_size=FRAME_QUEUE_SIZE,
+                 keep_alive_interval=KEEP_ALIVE_INTERVAL):
+        super().__init__()
+        self.frame_queue_size = frame_queue_size
+        self.keep_alive_interval = keep_alive_interval
+        # frames dropped because frames() did not keep up
+        self.dropped_frame_count = 0
+        self.frame_count = 0
+
+        self.command_transport = None
+        self.data_transport = None
+        self.keep_alive_task = None
+        self.frame_queue = None
+        self.closed = False
+
+    async def __aenter__(self):
+        if not await self.start():
+            raise ConnectionError("Could not open NatNet sockets")
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.close()
+
+    async def start(self):
+        """Opens the sockets on the running loop and connects to Motive"""
+        loop = asyncio.get_running_loop()
+        self.frame_queue = asyncio.Queue()
+        self.closed = False
+
+        data_socket = self.create_data_socket()
+        if data_socket is None:
+            print("Could not open data channel")
+            return False
+        command_socket = self.create_command_socket()
+        if command_socket is None:
+            print("Could not open command channel")
+            data_socket.close()
+            return False
+
+        self.data_transport, _ = await loop.create_datagram_endpoint(
+            lambda: NatNetProtocol(self, "data"), sock=data_socket)
+        self.command_transport, _ = await loop.create_datagram_endpoint(
+            lambda: NatNetProtocol(self, "command"), sock=command_socket)
+        # send_request() and send_command() only need sendto()
+        self.data_socket = self.data_transport
+        self.command_socket = self.command_transport
+
+        self.send_request(self.command_socket, self.NAT_CONNECT, "",
+                          (self.server_ip_address, self.command_port))
+        if not self.use_multicast:
+            self.keep_alive_task = asyncio.create_task(self.__keep_alive())
+        return True
+
+    async def __keep_alive(self):
+        while True:
+            await asyncio.sleep(self.keep_alive_interval)
+            self.send_keep_alive(self.command_socket, self.server_ip_address,
+                                 self.command_port)
+
+    def datagram_received(self, data, addr):
+        receive_time = time.perf_counter()
+        if get_message_id(data) != self.NAT_FRAMEOFDATA:
+            print_level = 1 if self.print_level > 0 else 0
+            self.process_message(data, print_level, receive_time)
+            return
+
+        packet_size = int.from_bytes(data[2:4], byteorder='little', signed=True) #type: ignore  # noqa E501
+        _, mocap_data = self.unpack_frame_of_data(
+            data, 4, packet_size, self.get_major(), self.get_minor())
+        self.frame_count += 1
+        if self.pose_filter is not None:
+            self.pose_filter.apply(mocap_data, receive_time)
+        if self.latency_stats is not None:
+            self.latency_stats.record_frame(
+                mocap_data, receive_time, self.high_resolution_clock_frequency)
+        if self.frame_ring is not None:
+            self.frame_ring.push(mocap_data, receive_time)
+
+        # latest frame wins
+        while self.frame_queue.qsize() >= self.frame_queue_size:
+            self.frame_queue.get_nowait()
+            self.dropped_frame_count += 1
+        self.frame_queue.put_nowait(mocap_data)
+
+    async def frames(self):
+        """Yields decoded frames until close() is called.
+        With the "arrays" decoder every frame is the same reused object."""
+        while True:
+            mocap_data = await self.frame_queue.get()
+            if mocap_data is None:
+                # closed, leave the marker for other iterations
+                self.frame_queue.put_nowait(None)
+                return
+            yield mocap_data
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if self.keep_alive_task is not None:
+            self.keep_alive_task.cancel()
+            self.keep_alive_task = None
+        for transport in (self.command_transport, self.data_transport):
+            if transport is not None:
+                transport.close()
+        self.command_transport = None
+        self.data_transport = None
+        if self.frame_queue is not None:
+            # ends frames(), pending frames are dropped
+            while not self.frame_queue.empty():
+                self.frame_queue.get_nowait()
+            self.frame_queue.put_nowait(None)
+
+    def shutdown(self):
+        self.close()
+
+
+# ----------------------
+# Example
+# ----------------------
+async def print_frame_rate(duration=10.0):
+    client = AsyncNatNetClient()
+    client.set_use_multicast(False)
+    client.set_decoder("arrays")
+    async with client:
+        asyncio.get_running_loop().call_later(duration, client.close)
+        async for mocap_data in client.frames():
+            pass
+    print("%d frames in %.1f s, %d dropped" % (
+        client.frame_count, duration, client.dropped_frame_count))
+
+
+if __name__ == "__main__":
+    asyncio.run(print_frame_rate())
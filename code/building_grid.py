@@ -0,0 +1,88 @@
+"""
+Occupancy grid of the building.
+
+A grid is a (floors, axes_x, axes_z) NumPy bool array, grid[floor][x][z] is
+True where a cell is built, so the nested list indexing of the old grids
+keeps working. generate_grid() fills it from a seeded numpy Generator in one
+call; occupied_cells() gives the indices of the built cells for the
+renderers.
+
+PackedGrid keeps the same grid with np.packbits, one bit per cell, for very
+tall design studies or for storing grids next to rendered images. It
+converts back with np.asarray() and can be passed wherever a grid is
+expected.
+"""
+
+import numpy as np
+
+
+def generate_grid(floors, axes_x, axes_z, porosity=0.5, seed=None):
+    """Random grid, each cell built with probability porosity.
+    seed is anything np.random.default_rng() accepts, or a Generator."""
+    rng = np.random.default_rng(seed)
+    return rng.random((floors, axes_x, axes_z), dtype=np.float32) < porosity
+
+
+def occupied_cells(grid, floors=None, axes_x=None, axes_z=None):
+    """(floor_i, x_i, z_i) index arrays of the built cells, optionally
+    limited to the first floors / axes"""
+    if isinstance(grid, PackedGrid):
+        return grid.occupied_cells(floors, axes_x, axes_z)
+    occupied = np.asarray(grid, dtype=bool)[:floors, :axes_x, :axes_z]
+    return np.nonzero(occupied)
+
+
+class PackedGrid:
+    """Bit packed grid, 8 cells per byte along z"""
+
+    def __init__(self, packed, shape):
+        self.packed = packed
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_grid(cls, grid):
+        grid = np.asarray(grid, dtype=bool)
+        return cls(np.packbits(grid, axis=-1), grid.shape)
+
+    @classmethod
+    def generate(cls, floors, axes_x, axes_z, porosity=0.5, seed=None,
+                 chunk_floors=1024):
+        """Like generate_grid(), without ever holding the whole unpacked
+        grid in memory"""
+        rng = np.random.default_rng(seed)
+        packed = np.empty((floors, axes_x, (axes_z + 7) // 8), dtype=np.uint8)
+        for start in range(0, floors, chunk_floors):
+            stop = min(start + chunk_floors, floors)
+            chunk = rng.random((stop - start, axes_x, axes_z),
+                               dtype=np.float32) < porosity
+            packed[start:stop] = np.packbits(chunk, axis=-1)
+        return cls(packed, (floors, axes_x, axes_z))
+
+    def to_grid(self):
+        return np.unpackbits(self.packed, axis=-1,
+                             count=self.shape[-1]).view(bool)
+
+    def __array__(self, dtype=None, copy=None):
+        grid = self.to_grid()
+        if dtype is not None:
+            grid = grid.astype(dtype, copy=False)
+        return grid
+
+    def __getitem__(self, index):
+        # grid[floor] only unpacks that floor
+        if isinstance(index, (int, np.integer)):
+            return np.unpackbits(self.packed[index], axis=-1,
+                                 count=self.shape[-1]).view(bool)
+        return self.to_grid()[index]
+
+    def __len__(self):
+        return self.shape[0]
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def occupied_cells(self, floors=None, axes_x=None, axes_z=None):
+        packed = self.packed[:floors, :axes_x]
+        occupied = np.unpackbits(packed, axis=-1, count=self.shape[-1])
+        return np.nonzero(occupied[:, :, :axes_z])
@@ -0,0 +1,466 @@
+"""
+Retained-mode geometry for highrise_funcs.draw_scene.
+
+Every cell, column, beam and café part is a scaled unit cube. BoxInstances
+keeps one cube mesh plus a per-instance buffer (center, size, color) built
+with NumPy and draws all of them with a single glDrawArraysInstanced call
+and a small shader that reproduces the fixed function lighting of
+GL_LIGHT0. On contexts without instancing (before OpenGL 3.3) the boxes
+are expanded into one merged VBO with per-vertex colors instead. The
+ground plane is a plain VBO.
+
+BuildingMesh.update() only rebuilds the buffers when grid, axes_width,
+floors or floor_height change. The grid is compared by identity, call
+invalidate() after editing it in place.
+"""
+
+import ctypes
+
+import numpy as np
+from OpenGL.GL import *
+
+from building_grid import occupied_cells
+
+CELL_COLOR = (1.0, 1.0, 1.0, 1.0)
+FRAME_COLOR = (1.0, 0.8, 0.0, 1.0)
+GROUND_COLOR = (0.95, 0.95, 0.95, 1.0)
+FRAME_THICKNESS = 0.5
+GROUND_SIZE = 1000.0
+GROUND_LEVEL = -1.0
+# building footprint, see highrise_funcs.draw_scene
+TARGET_WIDTH = 21.0
+
+# x, y, z, nx, ny, nz
+VERTEX_SIZE = 6
+VERTEX_STRIDE = VERTEX_SIZE * 4
+# cx, cy, cz, sx, sy, sz, r, g, b, a
+INSTANCE_SIZE = 10
+INSTANCE_STRIDE = INSTANCE_SIZE * 4
+# merged fallback: VERTEX_SIZE + r, g, b, a
+COLORED_VERTEX_SIZE = VERTEX_SIZE + 4
+COLORED_VERTEX_STRIDE = COLORED_VERTEX_SIZE * 4
+# None = use instancing when the context supports it
+USE_INSTANCING = None
+
+# ----------------------
+# Unit cube, centered at the origin, two triangles per face
+# ----------------------
+CUBE_CORNERS = np.array([
+    (-0.5, -0.5, 0.5), (0.5, -0.5, 0.5), (0.5, 0.5, 0.5), (-0.5, 0.5, 0.5),
+    (-0.5, -0.5, -0.5), (0.5, -0.5, -0.5), (0.5, 0.5, -0.5),
+    (-0.5, 0.5, -0.5),
+])
+# same faces and winding as draw_box of the animation export (image_gen)
+CUBE_FACES = np.array([
+    (0, 1, 2, 3),  # front
+    (5, 4, 7, 6),  # back
+    (4, 0, 3, 7),  # left
+    (1, 5, 6, 2),  # right
+    (3, 2, 6, 7),  # top
+    (4, 5, 1, 0),  # bottom
+])
+CUBE_FACE_NORMALS = np.array([
+    (0, 0, 1), (0, 0, -1), (-1, 0, 0), (1, 0, 0), (0, 1, 0), (0, -1, 0),
+], dtype=float)
+CUBE_POSITIONS = CUBE_CORNERS[CUBE_FACES[:, [0, 1, 2, 0, 2, 3]]].reshape(-1, 3)
+CUBE_NORMALS = np.repeat(CUBE_FACE_NORMALS, 6, axis=0)
+
+
+def building_axes(axes_width):
+    """Number of axes in x and z for a building about TARGET_WIDTH wide"""
+    axes_x = max(1, round(TARGET_WIDTH / axes_width))
+    return axes_x, axes_x
+
+
+def cell_boxes(grid, axes_width, floors, axes_x, axes_z, floor_height=4.0):
+    """(centers, sizes) of the occupied cells, each (N, 3)"""
+    floor_i, x_i, z_i = occupied_cells(grid, floors, axes_x, axes_z)
+    centers = np.empty((len(floor_i), 3))
+    centers[:, 0] = (x_i + 0.5) * axes_width - axes_x * axes_width / 2.0
+    centers[:, 1] = (floor_i + 0.5) * floor_height
+    centers[:, 2] = (z_i + 0.5) * axes_width - axes_z * axes_width / 2.0
+    sizes = np.empty_like(centers)
+    sizes[:] = (axes_width, floor_height, axes_width)
+    return centers, sizes
+
+
+def frame_boxes(axes_width, floors, axes_x, axes_z, floor_height=4.0,
+                frame_thickness=FRAME_THICKNESS):
+    """(centers, sizes) of the columns and of the beams of every floor"""
+    half_w_x = axes_x * axes_width / 2.0
+    half_w_z = axes_z * axes_width / 2.0
+    building_height = floors * floor_height
+    line_x = np.arange(axes_x + 1) * axes_width - half_w_x
+    line_z = np.arange(axes_z + 1) * axes_width - half_w_z
+    levels = np.arange(1, floors + 1) * floor_height
+
+    # columns at each grid intersection
+    col_x, col_z = np.meshgrid(line_x, line_z, indexing="ij")
+    columns = np.stack([col_x.ravel(), np.full(col_x.size,
+                                               building_height * 0.5),
+                        col_z.ravel()], axis=1)
+    column_size = (frame_thickness, building_height, frame_thickness)
+
+    # beams along x at every z line, along z at every x line
+    beam_y, beam_z = np.meshgrid(levels, line_z, indexing="ij")
+    beams_x = np.stack([np.zeros(beam_y.size), beam_y.ravel(),
+                        beam_z.ravel()], axis=1)
+    beam_x_size = (axes_x * axes_width + frame_thickness, frame_thickness,
+                   frame_thickness)
+    beam_y, beam_x = np.meshgrid(levels, line_x, indexing="ij")
+    beams_z = np.stack([beam_x.ravel(), beam_y.ravel(),
+                        np.zeros(beam_y.size)], axis=1)
+    beam_z_size = (frame_thickness, frame_thickness,
+                   axes_z * axes_width + frame_thickness)
+
+    centers = np.concatenate([columns, beams_x, beams_z])
+    sizes = np.concatenate([
+        np.broadcast_to(column_size, columns.shape),
+        np.broadcast_to(beam_x_size, beams_x.shape),
+        np.broadcast_to(beam_z_size, beams_z.shape),
+    ])
+    return centers, sizes
+
+
+def box_vertices(centers, sizes):
+    """Interleaved (N * 36, VERTEX_SIZE) float32 triangles of N boxes"""
+    count = len(centers)
+    vertices = np.empty((count, len(CUBE_POSITIONS), VERTEX_SIZE),
+                        dtype=np.float32)
+    vertices[:, :, :3] = CUBE_POSITIONS * np.asarray(sizes)[:, None, :] + \
+        np.asarray(centers)[:, None, :]
+    # glScalef without GL_NORMALIZE scales the normals by 1 / size, keep
+    # that so the boxes are lit exactly like the export's immediate mode ones
+    vertices[:, :, 3:] = CUBE_NORMALS / np.asarray(sizes)[:, None, :]
+    return vertices.reshape(-1, VERTEX_SIZE)
+
+
+def box_instances(centers, sizes, colors):
+    """(N, INSTANCE_SIZE) float32 instance data, colors broadcast to N"""
+    instances = np.empty((len(centers), INSTANCE_SIZE), dtype=np.float32)
+    instances[:, 0:3] = centers
+    instances[:, 3:6] = sizes
+    instances[:, 6:10] = colors
+    return instances
+
+
+def building_instances(grid, axes_width, floors, floor_height=4.0):
+    """Instances of the occupied cells and of the frame, in building
+    coordinates (centered at x=0, z=0)"""
+    axes_x, axes_z = building_axes(axes_width)
+    return np.concatenate([
+        box_instances(*cell_boxes(grid, axes_width, floors, axes_x, axes_z,
+                                  floor_height), CELL_COLOR),
+        box_instances(*frame_boxes(axes_width, floors, axes_x, axes_z,
+                                   floor_height), FRAME_COLOR),
+    ])
+
+
+def box_with_frame_instances(cx, cy, cz, sx, sy, sz,
+                             body_color=(1.0, 1.0, 1.0, 1.0),
+                             frame_color=(1.0, 1.0, 1.0, 1.0),
+                             frame_thickness=FRAME_THICKNESS):
+    """Instances of a box with a frame around its edges: body, 4 columns,
+    4 beams along x and 4 along z, in that order"""
+    t = frame_thickness
+    instances = np.empty((13, INSTANCE_SIZE), dtype=np.float32)
+    instances[0] = (cx, cy, cz, sx, sy, sz) + tuple(body_color)
+    instances[1:, 6:] = frame_color
+    corner_x = (cx - sx / 2, cx + sx / 2)
+    corner_y = (cy - sy / 2, cy + sy / 2)
+    corner_z = (cz - sz / 2, cz + sz / 2)
+    i = 1
+    for x in corner_x:
+        for z in corner_z:
+            instances[i, :6] = (x, cy, z, t, sy, t)
+            i += 1
+    for y in corner_y:
+        for z in corner_z:
+            instances[i, :6] = (cx, y, z, sx + t, t, t)
+            i += 1
+    for y in corner_y:
+        for x in corner_x:
+            instances[i, :6] = (x, y, cz, t, t, sz + t)
+            i += 1
+    return instances
+
+
+def ground_vertices(size=GROUND_SIZE, level=GROUND_LEVEL):
+    """Two upward facing triangles"""
+    corners = np.array([(-size, level, -size), (-size, level, size),
+                        (size, level, size), (size, level, -size)])
+    vertices = np.empty((6, VERTEX_SIZE), dtype=np.float32)
+    vertices[:, :3] = corners[[0, 1, 2, 0, 2, 3]]
+    vertices[:, 3:] = (0, 1, 0)
+    return vertices
+
+
+class VertexBatch:
+    """One VBO of interleaved triangles drawn with a single material"""
+
+    def __init__(self, color):
+        self.color = color
+        self.buffer_id = None
+        self.vertex_count = 0
+
+    def upload(self, vertices):
+        if self.buffer_id is None:
+            self.buffer_id = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer_id)
+        glBufferData(GL_ARRAY_BUFFER, vertices.nbytes, vertices,
+                     GL_STATIC_DRAW)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.vertex_count = len(vertices)
+
+    def draw(self):
+        if self.vertex_count == 0:
+            return
+        glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, self.color)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer_id)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, VERTEX_STRIDE, ctypes.c_void_p(12))
+        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def delete(self):
+        if self.buffer_id is not None:
+            glDeleteBuffers(1, [self.buffer_id])
+            self.buffer_id = None
+        self.vertex_count = 0
+
+
+# ----------------------
+# Instanced boxes
+# ----------------------
+BOX_VERTEX_SHADER = """
+#version 120
+attribute vec3 position;
+attribute vec3 normal;
+attribute vec3 center;
+attribute vec3 size;
+attribute vec4 color;
+varying vec4 lit_color;
+
+void main()
+{
+    vec4 eye = gl_ModelViewMatrix * vec4(center + position * size, 1.0);
+    // glScalef without GL_NORMALIZE, see box_vertices
+    vec3 n = gl_NormalMatrix * (normal / size);
+    vec4 light = gl_LightSource[0].position;
+    vec3 l = normalize(light.xyz - eye.xyz * light.w);
+    vec3 rgb = (gl_LightModel.ambient.rgb + gl_LightSource[0].ambient.rgb +
+                max(dot(n, l), 0.0) * gl_LightSource[0].diffuse.rgb) *
+               color.rgb;
+    lit_color = vec4(clamp(rgb, 0.0, 1.0), color.a);
+    gl_Position = gl_ProjectionMatrix * eye;
+}
+"""
+BOX_FRAGMENT_SHADER = """
+#version 120
+varying vec4 lit_color;
+
+void main()
+{
+    gl_FragColor = lit_color;
+}
+"""
+# attribute name -> (location, components, offset, per instance)
+BOX_ATTRIBUTES = {
+    "position": (0, 3, 0, False),
+    "normal": (1, 3, 12, False),
+    "center": (2, 3, 0, True),
+    "size": (3, 3, 12, True),
+    "color": (4, 4, 24, True),
+}
+
+
+def compile_program(vertex_source, fragment_source, attribute_locations):
+    """Linked shader program, raises RuntimeError with the GL log"""
+    program = glCreateProgram()
+    for shader_type, source in ((GL_VERTEX_SHADER, vertex_source),
+                                (GL_FRAGMENT_SHADER, fragment_source)):
+        shader = glCreateShader(shader_type)
+        glShaderSource(shader, source)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            raise RuntimeError(glGetShaderInfoLog(shader))
+        glAttachShader(program, shader)
+        glDeleteShader(shader)
+    for name, location in attribute_locations.items():
+        glBindAttribLocation(program, location, name)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        raise RuntimeError(glGetProgramInfoLog(program))
+    return program
+
+
+def instancing_supported():
+    """True if the current context has glDrawArraysInstanced and
+    glVertexAttribDivisor (OpenGL 3.3 or the ARB extensions)"""
+    return bool(glDrawArraysInstanced) and bool(glVertexAttribDivisor)
+
+
+class BoxInstances:
+    """Unit cube drawn once per instance (center, size, color).
+    Needs a current GL context for set_instances(), draw() and delete()."""
+
+    def __init__(self, instanced=USE_INSTANCING):
+        self.instanced = instanced
+        self.program = None
+        self.cube_buffer_id = None
+        self.buffer_id = None
+        self.instance_count = 0
+        self.vertex_count = 0
+
+    def setup(self):
+        if self.instanced is None:
+            self.instanced = instancing_supported()
+        if self.instanced:
+            try:
+                self.program = compile_program(
+                    BOX_VERTEX_SHADER, BOX_FRAGMENT_SHADER,
+                    {name: attribute[0]
+                     for name, attribute in BOX_ATTRIBUTES.items()})
+            except Exception as e:
+                print("WARNING: box shader unavailable, merging boxes "
+                      "into one VBO instead:\n  %s" % e)
+                self.instanced = False
+        if self.instanced:
+            cube = np.empty((len(CUBE_POSITIONS), VERTEX_SIZE),
+                            dtype=np.float32)
+            cube[:, :3] = CUBE_POSITIONS
+            cube[:, 3:] = CUBE_NORMALS
+            self.cube_buffer_id = glGenBuffers(1)
+            glBindBuffer(GL_ARRAY_BUFFER, self.cube_buffer_id)
+            glBufferData(GL_ARRAY_BUFFER, cube.nbytes, cube, GL_STATIC_DRAW)
+        self.buffer_id = glGenBuffers(1)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+
+    def set_instances(self, instances, usage=GL_STATIC_DRAW):
+        """(N, INSTANCE_SIZE) float32 array, see box_instances()"""
+        if self.buffer_id is None:
+            self.setup()
+        count = len(instances)
+        if not self.instanced:
+            # expand every box, per-vertex colors for GL_COLOR_MATERIAL
+            vertices = np.empty((count, len(CUBE_POSITIONS),
+                                 COLORED_VERTEX_SIZE), dtype=np.float32)
+            vertices[:, :, :VERTEX_SIZE] = box_vertices(
+                instances[:, 0:3], instances[:, 3:6]).reshape(
+                    count, -1, VERTEX_SIZE)
+            vertices[:, :, VERTEX_SIZE:] = instances[:, None, 6:10]
+            instances = vertices
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer_id)
+        glBufferData(GL_ARRAY_BUFFER, instances.nbytes, instances, usage)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        self.instance_count = count
+        self.vertex_count = count * len(CUBE_POSITIONS)
+
+    def draw(self):
+        if self.instance_count == 0:
+            return
+        if self.instanced:
+            self.draw_instanced()
+        else:
+            self.draw_merged()
+
+    def draw_instanced(self):
+        glUseProgram(self.program)
+        for location, components, offset, per_instance in \
+                BOX_ATTRIBUTES.values():
+            if per_instance:
+                glBindBuffer(GL_ARRAY_BUFFER, self.buffer_id)
+                stride = INSTANCE_STRIDE
+            else:
+                glBindBuffer(GL_ARRAY_BUFFER, self.cube_buffer_id)
+                stride = VERTEX_STRIDE
+            glEnableVertexAttribArray(location)
+            glVertexAttribPointer(location, components, GL_FLOAT, GL_FALSE,
+                                  stride, ctypes.c_void_p(offset))
+            glVertexAttribDivisor(location, 1 if per_instance else 0)
+        glDrawArraysInstanced(GL_TRIANGLES, 0, len(CUBE_POSITIONS),
+                              self.instance_count)
+        for location, _, _, per_instance in BOX_ATTRIBUTES.values():
+            if per_instance:
+                glVertexAttribDivisor(location, 0)
+            glDisableVertexAttribArray(location)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glUseProgram(0)
+
+    def draw_merged(self):
+        glEnable(GL_COLOR_MATERIAL)
+        glColorMaterial(GL_FRONT, GL_AMBIENT_AND_DIFFUSE)
+        glBindBuffer(GL_ARRAY_BUFFER, self.buffer_id)
+        glEnableClientState(GL_VERTEX_ARRAY)
+        glEnableClientState(GL_NORMAL_ARRAY)
+        glEnableClientState(GL_COLOR_ARRAY)
+        glVertexPointer(3, GL_FLOAT, COLORED_VERTEX_STRIDE,
+                        ctypes.c_void_p(0))
+        glNormalPointer(GL_FLOAT, COLORED_VERTEX_STRIDE, ctypes.c_void_p(12))
+        glColorPointer(4, GL_FLOAT, COLORED_VERTEX_STRIDE,
+                       ctypes.c_void_p(24))
+        glDrawArrays(GL_TRIANGLES, 0, self.vertex_count)
+        glDisableClientState(GL_COLOR_ARRAY)
+        glDisableClientState(GL_NORMAL_ARRAY)
+        glDisableClientState(GL_VERTEX_ARRAY)
+        glBindBuffer(GL_ARRAY_BUFFER, 0)
+        glDisable(GL_COLOR_MATERIAL)
+
+    def delete(self):
+        buffers = [buffer_id for buffer_id in (self.cube_buffer_id,
+                                               self.buffer_id)
+                   if buffer_id is not None]
+        if buffers:
+            glDeleteBuffers(len(buffers), buffers)
+        if self.program is not None:
+            glDeleteProgram(self.program)
+        self.program = None
+        self.cube_buffer_id = None
+        self.buffer_id = None
+        self.instance_count = 0
+
+
+class BuildingMesh:
+    """Ground plane VBO plus the cells and frame as BoxInstances.
+    Needs a current GL context for update(), draw() and delete()."""
+
+    def __init__(self, instanced=USE_INSTANCING):
+        self.ground = VertexBatch(GROUND_COLOR)
+        self.boxes = BoxInstances(instanced)
+        self.grid = None
+        self.key = None
+        self.build_count = 0
+
+    def invalidate(self):
+        self.key = None
+
+    def update(self, grid, axes_width, floors, floor_height=4.0):
+        """Rebuilds the buffers if anything changed, returns True if so"""
+        key = (axes_width, floors, floor_height)
+        if grid is self.grid and key == self.key:
+            return False
+        if self.ground.vertex_count == 0:
+            self.ground.upload(ground_vertices())
+        self.boxes.set_instances(building_instances(
+            grid, axes_width, floors, floor_height))
+        self.grid = grid
+        self.key = key
+        self.build_count += 1
+        return True
+
+    def draw_ground(self):
+        self.ground.draw()
+
+    def draw_building(self):
+        """Cells and frame, in building coordinates (centered at x=0, z=0)"""
+        self.boxes.draw()
+
+    def delete(self):
+        self.ground.delete()
+        self.boxes.delete()
+        self.grid = None
+        self.key = None
@@ -0,0 +1,27 @@
+"""
+Keyframe states of the café, shared by the animation export and the live
+demo's attract mode. Each state is [x, y, size, axes_width].
+"""
+
+PARAMETERS = ("x", "y", "size", "axes_width")
+
+STATES_V1 = [
+    # near left, small cafe, building axes=3
+    [-13.0, 0.0, 5.0, 3.0],
+    # further right, bigger cafe, same axes_width=3
+    [2.0, 22.0, 12.0, 10.0],
+    # center, medium cafe, building axes_width=1.5 => ~30 wide
+    [-10, 30.0, 20.0, 2],
+    # left, small cafe, building axes_width=5
+    [-5.0, 20.0, 5.0, 5.0],
+]
+STATES_V2 = [
+    # left, small cafe, building axes_width=5
+    [0.0, 8.0, 5.0, 5.0],
+    # further right, bigger cafe, same axes_width=3
+    [-13.0, 22.0, 12.0, 10.0],
+    # center, medium cafe, building axes_width=1.5 => ~30 wide
+    [-10, 30.0, 20.0, 2],
+    # near left, small cafe, building axes=3
+    [8.0, 0.0, 4.0, 3.0],
+]
@@ -0,0 +1,392 @@
+"""
+Direct client for the ComfyUI server API.
+
+Instead of handing the screenshot over through folders, generate() uploads
+the PNG bytes (POST /upload/image), queues the workflow with the
+screenshot as its input image (POST /prompt), waits for the prompt on the
+progress WebSocket (/ws) and downloads the result (GET /history, /view).
+Nothing touches the disk on our side. A prompt given up on is removed
+from the queue or interrupted (GET/POST /queue, POST /interrupt).
+
+    client = ComfyUIClient("http://127.0.0.1:8188")
+    workflow = load_workflow("../image_gen/comfyui_worklfows/workflow_highrise.png")
+    image_bytes = client.generate(workflow, encode_png(pixels), timeout=30)
+
+Workflows are in ComfyUI's API format, either a .json file ("Export
+(API)") or read from the "prompt" text chunk ComfyUI stores in its PNGs.
+The node that loads the screenshot (LoadImagesFromPath in our workflow,
+or input_node) is replaced by a LoadImage of the upload.
+
+The WebSocket is a minimal stdlib implementation (text frames in, close
+and pong out), fake_comfyui uses its frame helpers as well. Without a
+WebSocket, wait() polls /history.
+"""
+
+import base64
+import copy
+import hashlib
+import json
+import os
+import socket
+import struct
+import time
+import uuid
+from urllib.parse import urlsplit
+
+import numpy as np
+import requests
+
+DEFAULT_URL = "http://127.0.0.1:8188"
+DEFAULT_TIMEOUT = 30.0
+# seconds for a single HTTP request
+REQUEST_TIMEOUT = 10.0
+# how often wait() checks for cancellation / polls without WebSocket
+CHECK_INTERVAL = 0.1
+# node types whose image input is replaced by the screenshot
+INPUT_NODE_TYPES = ("LoadImagesFromPath",)
+OUTPUT_NODE_TYPES = ("SaveImage",)
+
+WS_GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WS_TEXT = 0x1
+WS_BINARY = 0x2
+WS_CLOSE = 0x8
+WS_PING = 0x9
+WS_PONG = 0xA
+
+
+class ComfyUIError(Exception):
+    pass
+
+
+# ----------------------
+# Workflows
+# ----------------------
+def png_text_chunks(data):
+    """tEXt chunks of a PNG as a dict"""
+    chunks = {}
+    offset = 8
+    while offset + 8 <= len(data):
+        length, chunk_type = struct.unpack(">I4s", data[offset:offset + 8])
+        if chunk_type == b"tEXt":
+            key, _, value = data[offset + 8:offset + 8 + length].partition(
+                b"\0")
+            chunks[key.decode("latin-1")] = value.decode("utf-8")
+        elif chunk_type == b"IEND":
+            break
+        offset += 12 + length
+    return chunks
+
+
+def load_workflow(path):
+    """API format workflow from a .json file or a ComfyUI PNG"""
+    if path.lower().endswith(".png"):
+        with open(path, "rb") as png_file:
+            chunks = png_text_chunks(png_file.read())
+        if "prompt" not in chunks:
+            raise ComfyUIError("%s has no embedded ComfyUI prompt" % path)
+        return json.loads(chunks["prompt"])
+    with open(path) as json_file:
+        return json.load(json_file)
+
+
+def prepare_workflow(workflow, image_name, input_node=None):
+    """Copy of workflow that loads image_name (an uploaded input image)
+    where the screenshot used to come in"""
+    workflow = copy.deepcopy(workflow)
+    if input_node is None:
+        input_nodes = [node_id for node_id, node in workflow.items()
+                       if node.get("class_type") in INPUT_NODE_TYPES]
+        if not input_nodes:
+            raise ComfyUIError("workflow has no %s node, pass input_node"
+                               % " / ".join(INPUT_NODE_TYPES))
+        input_node = input_nodes[0]
+    workflow[input_node] = {
+        "class_type": "LoadImage",
+        "inputs": {"image": image_name, "upload": "image"},
+    }
+    return workflow
+
+
+def output_nodes(workflow):
+    return [node_id for node_id, node in workflow.items()
+            if node.get("class_type") in OUTPUT_NODE_TYPES]
+
+
+# ----------------------
+# WebSocket
+# ----------------------
+def ws_accept_key(key):
+    return base64.b64encode(hashlib.sha1(key + WS_GUID).digest())
+
+
+def ws_encode_frame(opcode, payload, mask=False):
+    """One final frame, clients have to mask"""
+    header = bytearray([0x80 | opcode])
+    mask_bit = 0x80 if mask else 0
+    length = len(payload)
+    if length < 126:
+        header.append(mask_bit | length)
+    elif length < 1 << 16:
+        header.append(mask_bit | 126)
+        header += struct.pack(">H", length)
+    else:
+        header.append(mask_bit | 127)
+        header += struct.pack(">Q", length)
+    if not mask:
+        return bytes(header) + payload
+    key = os.urandom(4)
+    masked = np.frombuffer(payload, dtype=np.uint8) ^ \
+        np.resize(np.frombuffer(key, dtype=np.uint8), length)
+    return bytes(header) + key + masked.tobytes()
+
+
+def ws_decode_frame(buffer):
+    """(fin, opcode, payload, frame length) of the first frame in buffer,
+    None while it is incomplete"""
+    if len(buffer) < 2:
+        return None
+    fin = buffer[0] & 0x80
+    opcode = buffer[0] & 0x0F
+    masked = buffer[1] & 0x80
+    length = buffer[1] & 0x7F
+    offset = 2
+    if length == 126:
+        if len(buffer) < 4:
+            return None
+        length, = struct.unpack(">H", buffer[2:4])
+        offset = 4
+    elif length == 127:
+        if len(buffer) < 10:
+            return None
+        length, = struct.unpack(">Q", buffer[2:10])
+        offset = 10
+    key = None
+    if masked:
+        key = bytes(buffer[offset:offset + 4])
+        offset += 4
+    if len(buffer) < offset + length:
+        return None
+    payload = bytes(buffer[offset:offset + length])
+    if masked:
+        payload = (np.frombuffer(payload, dtype=np.uint8) ^ np.resize(
+            np.frombuffer(key, dtype=np.uint8), length)).tobytes()
+    return fin, opcode, payload, offset + length
+
+
+class WebSocket:
+    """Client side of a WebSocket, receive() never waits longer than
+    asked"""
+
+    def __init__(self, url, timeout=REQUEST_TIMEOUT):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "wss" else 80)
+        if parts.scheme == "wss":
+            raise ComfyUIError("wss:// is not supported")
+        self.sock = socket.create_connection((parts.hostname, port), timeout)
+        key = base64.b64encode(os.urandom(16))
+        path = parts.path + ("?" + parts.query if parts.query else "")
+        self.sock.sendall(
+            b"GET %s HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\n"
+            b"Connection: Upgrade\r\nSec-WebSocket-Key: %s\r\n"
+            b"Sec-WebSocket-Version: 13\r\n\r\n"
+            % (path.encode(), parts.hostname.encode(), port, key))
+        self.buffer = bytearray()
+        while b"\r\n\r\n" not in self.buffer:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ComfyUIError("WebSocket handshake: connection closed")
+            self.buffer += data
+        head, _, rest = bytes(self.buffer).partition(b"\r\n\r\n")
+        self.buffer = bytearray(rest)
+        lines = head.split(b"\r\n")
+        if b" 101 " not in lines[0] + b" ":
+            raise ComfyUIError("WebSocket handshake: %s"
+                               % lines[0].decode(errors="replace"))
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b":")
+            headers[name.strip().lower()] = value.strip()
+        if headers.get(b"sec-websocket-accept") != ws_accept_key(key):
+            raise ComfyUIError("WebSocket handshake: bad accept key")
+        self.message = bytearray()
+        self.message_opcode = WS_TEXT
+
+    def receive(self, timeout):
+        """Next text or binary message as (opcode, payload), None after
+        timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while True:
+            frame = ws_decode_frame(self.buffer)
+            if frame is not None:
+                fin, opcode, payload, frame_length = frame
+                del self.buffer[:frame_length]
+                if opcode == WS_PING:
+                    self.sock.sendall(ws_encode_frame(WS_PONG, payload, True))
+                elif opcode == WS_CLOSE:
+                    raise ComfyUIError("WebSocket closed by the server")
+                else:
+                    if opcode != 0:
+                        self.message_opcode = opcode
+                    self.message += payload
+                    if fin:
+                        message = bytes(self.message)
+                        self.message = bytearray()
+                        return self.message_opcode, message
+                continue
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                data = self.sock.recv(65536)
+            except socket.timeout:
+                return None
+            if not data:
+                raise ComfyUIError("WebSocket connection closed")
+            self.buffer += data
+
+    def close(self):
+        try:
+            self.sock.sendall(ws_encode_frame(WS_CLOSE, b"", True))
+        except OSError:
+            pass
+        self.sock.close()
+
+
+# ----------------------
+# Client
+# ----------------------
+class ComfyUIClient:
+    def __init__(self, url=DEFAULT_URL, client_id=None):
+        self.url = url.rstrip("/")
+        self.client_id = client_id or uuid.uuid4().hex
+        self.session = requests.Session()
+        self.use_websocket = True
+
+    def request(self, method, path, **kwargs):
+        response = self.session.request(method, self.url + path,
+                                        timeout=REQUEST_TIMEOUT, **kwargs)
+        if response.status_code != 200:
+            raise ComfyUIError("%s %s: %d %s" % (method, path,
+                                                 response.status_code,
+                                                 response.text[:200]))
+        return response
+
+    def upload_image(self, data, name="screenshot.png"):
+        """Uploads image bytes as an input image, returns the name to load
+        it with"""
+        response = self.request(
+            "POST", "/upload/image",
+            files={"image": (name, data, "image/png")},
+            data={"overwrite": "true", "type": "input"})
+        result = response.json()
+        if result.get("subfolder"):
+            return result["subfolder"] + "/" + result["name"]
+        return result["name"]
+
+    def queue_prompt(self, workflow):
+        response = self.request("POST", "/prompt", json={
+            "prompt": workflow, "client_id": self.client_id})
+        return response.json()["prompt_id"]
+
+    def connect(self):
+        """Progress WebSocket of this client, None if it can't be opened"""
+        if not self.use_websocket:
+            return None
+        ws_url = self.url.replace("http", "ws", 1) + \
+            "/ws?clientId=" + self.client_id
+        try:
+            return WebSocket(ws_url)
+        except (OSError, ComfyUIError) as e:
+            print("WARNING: no ComfyUI WebSocket (%s), polling the history"
+                  % e)
+            self.use_websocket = False
+            return None
+
+    def history(self, prompt_id):
+        return self.request("GET", "/history/" + prompt_id).json().get(
+            prompt_id)
+
+    def cancel(self, prompt_id):
+        """Interrupts prompt_id if it is running, removes it from the queue
+        otherwise, so an abandoned prompt doesn't keep the GPU busy"""
+        queue_state = self.request("GET", "/queue").json()
+        running = [entry[1] for entry in queue_state.get("queue_running", [])]
+        if prompt_id in running:
+            self.request("POST", "/interrupt", json={"prompt_id": prompt_id})
+        else:
+            self.request("POST", "/queue", json={"delete": [prompt_id]})
+
+    def wait(self, prompt_id, timeout, websocket=None, cancelled=None):
+        """True once prompt_id is done, False on timeout or when
+        cancelled() returns True"""
+        deadline = time.monotonic() + timeout
+        while cancelled is None or not cancelled():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            if websocket is None:
+                time.sleep(min(remaining, CHECK_INTERVAL))
+                entry = self.history(prompt_id)
+                if entry is not None and \
+                   entry.get("status", {}).get("completed", True):
+                    return True
+                continue
+            message = websocket.receive(min(remaining, CHECK_INTERVAL))
+            if message is None or message[0] != WS_TEXT:
+                # timeout or a binary preview image
+                continue
+            message = json.loads(message[1])
+            data = message.get("data", {})
+            if data.get("prompt_id") != prompt_id:
+                continue
+            if message["type"] in ("execution_error",
+                                   "execution_interrupted"):
+                raise ComfyUIError("prompt %s: %s" % (
+                    prompt_id, data.get("exception_message",
+                                        message["type"])))
+            if message["type"] == "execution_success" or \
+               (message["type"] == "executing" and data.get("node") is None):
+                return True
+        return False
+
+    def output_images(self, prompt_id, node_ids=None):
+        """Bytes of the images the output nodes of prompt_id saved"""
+        entry = self.history(prompt_id) or {}
+        images = []
+        for node_id, output in entry.get("outputs", {}).items():
+            if node_ids is not None and node_id not in node_ids:
+                continue
+            for image in output.get("images", []):
+                response = self.request("GET", "/view", params={
+                    "filename": image["filename"],
+                    "subfolder": image.get("subfolder", ""),
+                    "type": image.get("type", "output")})
+                images.append(response.content)
+        return images
+
+    def generate(self, workflow, image_data, timeout=DEFAULT_TIMEOUT,
+                 input_node=None, cancelled=None):
+        """Runs workflow on the PNG bytes image_data, returns the bytes of
+        the first saved image, None on timeout / cancellation (the
+        prompt is cancelled on the server as well)"""
+        image_name = self.upload_image(image_data)
+        prompt = prepare_workflow(workflow, image_name, input_node)
+        # connect first, so the completion can't be missed
+        websocket = self.connect()
+        try:
+            prompt_id = self.queue_prompt(prompt)
+            if not self.wait(prompt_id, timeout, websocket, cancelled):
+                try:
+                    self.cancel(prompt_id)
+                except (ComfyUIError, requests.RequestException) as e:
+                    print("WARNING: could not cancel ComfyUI prompt %s: %s"
+                          % (prompt_id, e))
+                return None
+        finally:
+            if websocket is not None:
+                websocket.close()
+        images = self.output_images(prompt_id, output_nodes(prompt) or None)
+        if not images:
+            raise ComfyUIError("prompt %s saved no image" % prompt_id)
+        return images[0]
@@ -0,0 +1,319 @@
+"""
+Local stand-in for a ComfyUI server, to run comfyui_client and the demo
+without ComfyUI or a GPU.
+
+Implements the parts of the API the client uses: POST /upload/image,
+POST /prompt, GET /ws (progress messages), GET /history/<prompt_id>,
+GET /view, GET/POST /queue and POST /interrupt. Like ComfyUI, prompts run
+one after the other; each "finishes" after delay seconds and saves a
+canned image, or the uploaded input image when there is none, so the
+overlay shows the screenshot itself. With fail=True every prompt ends in
+an execution_error.
+
+    python fake_comfyui.py --port 8188 --delay 3 --image some.png
+
+    server = FakeComfyUI(port=0, delay=0.5)
+    server.start()
+    client = ComfyUIClient(server.url)
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from comfyui_client import WS_TEXT, ws_accept_key, ws_encode_frame
+
+DEFAULT_PORT = 8188
+DEFAULT_DELAY = 2.0
+
+
+class FakeComfyUI:
+    def __init__(self, host="127.0.0.1", port=DEFAULT_PORT,
+                 delay=DEFAULT_DELAY, image=None, fail=False):
+        self.host = host
+        self.port = port
+        self.delay = delay
+        self.image = None
+        if image is not None:
+            with open(image, "rb") as image_file:
+                self.image = image_file.read()
+        self.fail = fail
+        self.lock = threading.Lock()
+        # uploaded / saved images by name, history by prompt id
+        self.inputs = {}
+        self.outputs = {}
+        self.history = {}
+        # message queues of the connected WebSockets by client id
+        self.clients = {}
+        self.prompt_count = 0
+        # [number, prompt_id, prompt, client_id] waiting and running
+        self.pending = []
+        self.running = None
+        self.interrupt_event = threading.Event()
+        self.work = threading.Condition(self.lock)
+        self.stopping = False
+        self.http_server = None
+
+    @property
+    def url(self):
+        return "http://%s:%d" % (self.host, self.port)
+
+    def start(self):
+        server = self
+
+        class Handler(FakeComfyUIHandler):
+            fake = server
+
+        self.http_server = ThreadingHTTPServer((self.host, self.port),
+                                               Handler)
+        self.http_server.daemon_threads = True
+        # port=0 picks a free one
+        self.port = self.http_server.server_address[1]
+        threading.Thread(target=self.http_server.serve_forever,
+                         daemon=True).start()
+        threading.Thread(target=self.run_prompts, daemon=True).start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            self.stopping = True
+            self.work.notify()
+            for messages in self.clients.values():
+                messages.put(None)
+        self.interrupt_event.set()
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
+
+    def send(self, client_id, message_type, data):
+        with self.lock:
+            messages = self.clients.get(client_id)
+        if messages is not None:
+            messages.put({"type": message_type, "data": data})
+
+    def queue_prompt(self, prompt, client_id):
+        prompt_id = uuid.uuid4().hex
+        with self.lock:
+            self.prompt_count += 1
+            number = self.prompt_count
+            self.pending.append([number, prompt_id, prompt, client_id])
+            self.work.notify()
+        return prompt_id, number
+
+    def queue_state(self):
+        with self.lock:
+            entries = [entry[:3] + [{}, []] for entry in self.pending]
+            running = [self.running[:3] + [{}, []]] if self.running else []
+        return {"queue_running": running, "queue_pending": entries}
+
+    def delete(self, prompt_ids):
+        with self.lock:
+            self.pending = [entry for entry in self.pending
+                            if entry[1] not in prompt_ids]
+
+    def interrupt(self, prompt_id=None):
+        with self.lock:
+            if self.running is not None and \
+               prompt_id in (None, self.running[1]):
+                self.interrupt_event.set()
+
+    def run_prompts(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.stopping:
+                    self.work.wait()
+                if self.stopping:
+                    return
+                self.running = self.pending.pop(0)
+                self.interrupt_event.clear()
+            number, prompt_id, prompt, client_id = self.running
+            self.send(client_id, "execution_start", {"prompt_id": prompt_id})
+            if self.interrupt_event.wait(self.delay):
+                self.send(client_id, "execution_interrupted",
+                          {"prompt_id": prompt_id})
+            else:
+                self.finish_prompt(prompt_id, prompt, client_id, number)
+            with self.lock:
+                self.running = None
+
+    def finish_prompt(self, prompt_id, prompt, client_id, number):
+        if self.fail:
+            self.send(client_id, "execution_error", {
+                "prompt_id": prompt_id,
+                "exception_message": "fake failure"})
+            return
+        image = self.image
+        if image is None:
+            for node in prompt.values():
+                if node.get("class_type") == "LoadImage":
+                    image = self.inputs.get(node["inputs"].get("image"))
+                    if image is not None:
+                        break
+        outputs = {}
+        filename = "idl_demo_%05d_.png" % number
+        output_node = next((node_id for node_id, node in prompt.items()
+                            if node.get("class_type") == "SaveImage"), "9")
+        if image is not None:
+            with self.lock:
+                self.outputs[filename] = image
+            outputs[output_node] = {"images": [{
+                "filename": filename, "subfolder": "", "type": "output"}]}
+        self.send(client_id, "executing",
+                  {"node": output_node, "prompt_id": prompt_id})
+        with self.lock:
+            self.history[prompt_id] = {
+                "prompt": [number, prompt_id, prompt, {}, [output_node]],
+                "outputs": outputs,
+                "status": {"status_str": "success", "completed": True},
+            }
+        self.send(client_id, "executing", {"node": None, "prompt_id": prompt_id})
+
+
+class FakeComfyUIHandler(BaseHTTPRequestHandler):
+    # set by FakeComfyUI.start()
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, value, status=200):
+        self.send_bytes(json.dumps(value).encode("utf-8"), "application/json",
+                        status)
+
+    def send_bytes(self, body, content_type, status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_body(self):
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if parts.path == "/ws":
+            self.serve_websocket(query.get("clientId", uuid.uuid4().hex))
+        elif parts.path.startswith("/history/"):
+            prompt_id = parts.path[len("/history/"):]
+            with self.fake.lock:
+                entry = self.fake.history.get(prompt_id)
+            self.send_json({prompt_id: entry} if entry is not None else {})
+        elif parts.path == "/queue":
+            self.send_json(self.fake.queue_state())
+        elif parts.path == "/view":
+            images = self.fake.inputs if query.get("type") == "input" else \
+                self.fake.outputs
+            with self.fake.lock:
+                image = images.get(query.get("filename"))
+            if image is None:
+                self.send_json({"error": "not found"}, 404)
+            else:
+                self.send_bytes(image, "image/png")
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        if self.path == "/upload/image":
+            self.upload_image()
+        elif self.path == "/prompt":
+            body = json.loads(self.read_body() or b"{}")
+            if not isinstance(body.get("prompt"), dict):
+                self.send_json({"error": "no prompt"}, 400)
+                return
+            prompt_id, number = self.fake.queue_prompt(
+                body["prompt"], body.get("client_id"))
+            self.send_json({"prompt_id": prompt_id, "number": number,
+                            "node_errors": {}})
+        elif self.path == "/queue":
+            body = json.loads(self.read_body() or b"{}")
+            self.fake.delete(body.get("delete", []))
+            self.send_json({})
+        elif self.path == "/interrupt":
+            body = json.loads(self.read_body() or b"{}")
+            self.fake.interrupt(body.get("prompt_id"))
+            self.send_json({})
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def upload_image(self):
+        message = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + self.headers["Content-Type"].encode() +
+            b"\r\n\r\n" + self.read_body())
+        for part in message.iter_parts():
+            if part.get_param("name", header="content-disposition") == "image":
+                name = part.get_filename() or "upload.png"
+                with self.fake.lock:
+                    self.fake.inputs[name] = part.get_payload(decode=True)
+                self.send_json({"name": name, "subfolder": "", "type": "input"})
+                return
+        self.send_json({"error": "no image"}, 400)
+
+    def serve_websocket(self, client_id):
+        key = self.headers.get("Sec-WebSocket-Key", "").encode()
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", ws_accept_key(key).decode())
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        messages = queue.Queue()
+        with self.fake.lock:
+            previous = self.fake.clients.get(client_id)
+            if previous is not None:
+                # the client reconnected, end the old connection
+                previous.put(None)
+            self.fake.clients[client_id] = messages
+        messages.put({"type": "status", "data": {
+            "status": {"exec_info": {"queue_remaining": 0}}, "sid": client_id}})
+        try:
+            while True:
+                message = messages.get()
+                if message is None:
+                    break
+                self.wfile.write(ws_encode_frame(
+                    WS_TEXT, json.dumps(message).encode("utf-8")))
+                self.wfile.flush()
+        except OSError:
+            pass
+        finally:
+            with self.fake.lock:
+                if self.fake.clients.get(client_id) is messages:
+                    del self.fake.clients[client_id]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--delay", type=float, default=DEFAULT_DELAY,
+                        help="seconds until a prompt is done")
+    parser.add_argument("--image", help="PNG every prompt returns, default: "
+                        "the uploaded input image")
+    parser.add_argument("--fail", action="store_true",
+                        help="every prompt ends in an execution_error")
+    args = parser.parse_args()
+    server = FakeComfyUI(args.host, args.port, args.delay, args.image,
+                         args.fail).start()
+    print("Fake ComfyUI on %s, Ctrl+C to stop" % server.url)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    server.stop()
+
+
+if __name__ == "__main__":
+    main()
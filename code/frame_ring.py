@@ -0,0 +1,179 @@
+"""
+Fixed-capacity ring buffer of recent mocap frames.
+
+The NatNet data thread is the only writer (push), the render loop or any
+other single reader takes copies of the latest frame or of the last few
+frames (latest, window) without taking a lock. Every slot holds the frame
+number, the Motive timestamp, the local receive time (time.perf_counter)
+and the rigid body poses; all of it is preallocated once.
+
+The writer fills a slot and only then bumps write_count. A reader copies
+the slots it wants and afterwards re-reads write_count: slots the writer
+may have started to overwrite in the meantime are dropped from the copy.
+"""
+
+import time
+
+import numpy as np
+
+import mocap_arrays
+
+DEFAULT_CAPACITY = 256
+DEFAULT_MAX_RIGID_BODIES = 16
+
+
+class FrameSnapshot:
+    """Copy of one or more ring slots.
+
+    latest() fills the scalar fields and (max_rigid_bodies, ...) arrays,
+    window() the same fields with a leading frame axis. rigid_body_list
+    gives mocap_arrays.RigidBodyView objects for a single frame.
+    """
+
+    def __init__(self, frame_number, timestamp, receive_time, count,
+                 ids, pos, rot, error, tracking_valid):
+        self.frame_number = frame_number
+        self.timestamp = timestamp
+        self.receive_time = receive_time
+        self.count = count
+        self.ids = ids
+        self.pos = pos
+        self.rot = rot
+        self.error = error
+        self.tracking_valid = tracking_valid
+
+    @property
+    def rigid_body_list(self):
+        return [mocap_arrays.RigidBodyView(self, i)
+                for i in range(self.count)]
+
+    def get_age(self, now=None):
+        """Seconds since the (latest) frame was received"""
+        if now is None:
+            now = time.perf_counter()
+        return now - np.max(self.receive_time)
+
+    def __len__(self):
+        return np.size(self.frame_number)
+
+
+class FrameRing:
+    """Single producer, single consumer ring of timestamped frames"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY,
+                 max_rigid_bodies=DEFAULT_MAX_RIGID_BODIES):
+        self.capacity = capacity
+        self.max_rigid_bodies = max_rigid_bodies
+        self.frame_number = np.zeros(capacity, dtype=np.int64)
+        self.timestamp = np.full(capacity, np.nan)
+        self.receive_time = np.zeros(capacity)
+        self.count = np.zeros(capacity, dtype=np.int32)
+        self.ids = np.zeros((capacity, max_rigid_bodies), dtype=np.int32)
+        self.pos = np.zeros((capacity, max_rigid_bodies, 3), dtype=np.float32)
+        self.rot = np.zeros((capacity, max_rigid_bodies, 4), dtype=np.float32)
+        self.error = np.zeros((capacity, max_rigid_bodies), dtype=np.float32)
+        self.tracking_valid = np.zeros((capacity, max_rigid_bodies),
+                                       dtype=bool)
+        # frames pushed so far; written by the producer only
+        self.write_count = 0
+        # frames that had more rigid bodies than max_rigid_bodies
+        self.truncated_count = 0
+
+    # ----------------------
+    # Producer
+    # ----------------------
+    def push(self, mocap_data, receive_time=None):
+        """Stores the prefix, suffix timestamp and rigid bodies of a
+        MoCapData frame (or mocap_arrays.MoCapFrame)"""
+        if receive_time is None:
+            receive_time = time.perf_counter()
+        slot = self.write_count % self.capacity
+
+        frame_number = -1
+        if mocap_data.prefix_data is not None:
+            frame_number = mocap_data.prefix_data.frame_number
+        timestamp = np.nan
+        if mocap_data.suffix_data is not None:
+            timestamp = mocap_data.suffix_data.timestamp
+        self.frame_number[slot] = frame_number
+        self.timestamp[slot] = timestamp
+        self.receive_time[slot] = receive_time
+
+        count = 0
+        rigid_body_data = mocap_data.rigid_body_data
+        if isinstance(rigid_body_data, mocap_arrays.RigidBodyArrays):
+            count = min(rigid_body_data.count, self.max_rigid_bodies)
+            self.ids[slot, :count] = rigid_body_data.ids[:count]
+            self.pos[slot, :count] = rigid_body_data.pos[:count]
+            self.rot[slot, :count] = rigid_body_data.rot[:count]
+            self.error[slot, :count] = rigid_body_data.error[:count]
+            self.tracking_valid[slot, :count] = \
+                rigid_body_data.tracking_valid[:count]
+            total = rigid_body_data.count
+        elif rigid_body_data is not None:
+            rigid_body_list = rigid_body_data.rigid_body_list
+            total = len(rigid_body_list)
+            for rigid_body in rigid_body_list[:self.max_rigid_bodies]:
+                self.ids[slot, count] = rigid_body.id_num
+                self.pos[slot, count] = rigid_body.pos
+                self.rot[slot, count] = rigid_body.rot
+                self.error[slot, count] = rigid_body.error
+                self.tracking_valid[slot, count] = rigid_body.tracking_valid
+                count += 1
+        else:
+            total = 0
+        if total > count:
+            self.truncated_count += 1
+        self.count[slot] = count
+
+        # publish
+        self.write_count += 1
+
+    # ----------------------
+    # Consumer
+    # ----------------------
+    def get_write_count(self):
+        return self.write_count
+
+    def latest(self):
+        """Copy of the newest frame, or None if nothing was pushed yet"""
+        while True:
+            end = self.write_count
+            if end == 0:
+                return None
+            slot = (end - 1) % self.capacity
+            count = int(self.count[slot])
+            snapshot = FrameSnapshot(
+                int(self.frame_number[slot]), float(self.timestamp[slot]),
+                float(self.receive_time[slot]), count,
+                self.ids[slot].copy(), self.pos[slot].copy(),
+                self.rot[slot].copy(), self.error[slot].copy(),
+                self.tracking_valid[slot].copy())
+            # the writer needs a full lap to come back to this slot
+            if self.write_count - end < self.capacity - 1:
+                return snapshot
+
+    def window(self, frame_count):
+        """Copy of up to frame_count most recent frames, oldest first.
+        Returns None if nothing was pushed yet."""
+        end = self.write_count
+        frame_count = min(frame_count, end, self.capacity - 1)
+        if frame_count <= 0:
+            return None
+        slots = np.arange(end - frame_count, end) % self.capacity
+        snapshot = FrameSnapshot(
+            self.frame_number[slots], self.timestamp[slots],
+            self.receive_time[slots], self.count[slots],
+            self.ids[slots], self.pos[slots], self.rot[slots],
+            self.error[slots], self.tracking_valid[slots])
+        # drop the oldest frames if the writer got to their slots
+        overwritten = self.write_count - end - (self.capacity - 1 -
+                                                frame_count)
+        if overwritten > 0:
+            keep = slice(min(overwritten, frame_count), None)
+            snapshot = FrameSnapshot(
+                snapshot.frame_number[keep], snapshot.timestamp[keep],
+                snapshot.receive_time[keep], snapshot.count[keep],
+                snapshot.ids[keep], snapshot.pos[keep], snapshot.rot[keep],
+                snapshot.error[keep], snapshot.tracking_valid[keep])
+        return snapshot
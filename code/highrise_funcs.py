@@ -1,8 +1,31 @@
 from OpenGL.GL import *
 from OpenGL.GLU import *
-import random
 import pygame
 
+from building_grid import generate_grid
+from building_mesh import (
+    BoxInstances,
+    BuildingMesh,
+    box_with_frame_instances,
+    building_axes,
+)
+from scene_graph import SceneGraph, SceneNode
+from screenshot_readback import PixelReadback
+
+# Ground, building cells and frame baked into VBOs, created on the first
+# draw_scene() (needs the GL context) and rebuilt when the building changes
+building_mesh = None
+# Café boxes, instance data refreshed whenever the café moves
+cafe_boxes = None
+# Static building node (cached offscreen) and dynamic café node
+scene = None
+# Asynchronous screenshots, see grab_screenshot_async()
+screenshot_readback = None
+
+# front facade of the building, the café protrudes in front of it
+desired_front_z = -15.0
+cafe_protrusion = 2.0
+
 
 def setup_projection_and_lighting(
     camera_height=2.0,
@@ -50,257 +73,58 @@ def setup_projection_and_lighting(
     glLightfv(GL_LIGHT0, GL_SPECULAR, (1.0, 1.0, 1.0, 1))  # Specular light
 
 
-def draw_box(size: float):
-    """Draw a lit cube of side 'size'."""
-    half = size / 2.0
-    # 8 corners
-    verts = [
-        (-half, -half, half),
-        (half, -half, half),
-        (half, half, half),
-        (-half, half, half),
-        (-half, -half, -half),
-        (half, -half, -half),
-        (half, half, -half),
-        (-half, half, -half),
-    ]
-    # Face indices
-    faces = [
-        (0, 1, 2, 3),  # front
-        (5, 4, 7, 6),  # back
-        (4, 0, 3, 7),  # left
-        (1, 5, 6, 2),  # right
-        (3, 2, 6, 7),  # top
-        (4, 5, 1, 0),  # bottom
-    ]
-    # Normals
-    normals = [(0, 0, 1), (0, 0, -1), (-1, 0, 0), (1, 0, 0), (0, 1, 0), (0, -1, 0)]
-
-    # Draw
-    glBegin(GL_QUADS)
-    for i, face in enumerate(faces):
-        glNormal3fv(normals[i])
-        for vi in face:
-            glVertex3fv(verts[vi])
-    glEnd()
-
-
-def draw_box_with_frame(
-    cx,
-    cy,
-    cz,
-    sx,
-    sy,
-    sz,
-    body_color=(1.0, 1.0, 1.0, 1.0),
-    frame_color=(1.0, 1.0, 1.0, 1.0),
-    frame_thickness=0.5,
-):
-    """
-    Draws a solid box (centered at cx,cy,cz) of size (sx, sy, sz)
-    with a frame around it.
-    """
-    # Compute bounding box corners
-    min_x = cx - sx / 2
-    max_x = cx + sx / 2
-    min_y = cy - sy / 2
-    max_y = cy + sy / 2
-    min_z = cz - sz / 2
-    max_z = cz + sz / 2
-
-    # 1. Draw solid box
-    glPushMatrix()
-    glTranslatef(cx, cy, cz)
-    glScalef(sx, sy, sz)
-    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, body_color)
-    draw_box(1.0)  # Assumes a draw_box function is defined elsewhere
-    glPopMatrix()
-
-    # 2. Draw frame
-    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, frame_color)
-
-    # Vertical columns at corners
-    for corner_x in [min_x, max_x]:
-        for corner_z in [min_z, max_z]:
-            glPushMatrix()
-            glTranslatef(corner_x, (min_y + max_y) / 2.0, corner_z)
-            glScalef(frame_thickness, sy, frame_thickness)
-            draw_box(1.0)
-            glPopMatrix()
-
-    # Horizontal beams (x-direction) at top & bottom
-    for y_level in [min_y, max_y]:
-        for z_coord in [min_z, max_z]:
-            glPushMatrix()
-            glTranslatef((min_x + max_x) / 2.0, y_level, z_coord)
-            glScalef(sx + frame_thickness, frame_thickness, frame_thickness)
-            draw_box(1.0)
-            glPopMatrix()
-
-    # Horizontal beams (z-direction) at top & bottom
-    for y_level in [min_y, max_y]:
-        for x_coord in [min_x, max_x]:
-            glPushMatrix()
-            glTranslatef(x_coord, y_level, (min_z + max_z) / 2.0)
-            glScalef(frame_thickness, frame_thickness, sz + frame_thickness)
-            draw_box(1.0)
-            glPopMatrix()
-
-
-def generate_grid_structure(floors=12, max_axes_x=30, max_axes_z=30, porosity=0.5):
-    # floors = 12
-    # axes_x = 7
-    # axes_z = 7
-    # Pre-generate the random grid structure for the building
-    grid_structure = [
-        [
-            [random.random() < porosity for y in range(max_axes_z)]
-            for x in range(max_axes_x)
-        ]
-        for floor in range(floors)
-    ]
-    return grid_structure
-
-
-def draw_building_structure(grid, axes_width, floors, axes_x, axes_z, floor_height = 4.0):
-    """
-    Draws the building as a collection of white cubes plus a frame,
-    centered at x=0, z=0.
-    """
-    
-
-    # Because building is centered, we offset everything by half the building extents.
-    half_w_x = axes_x * axes_width / 2.0
-    half_w_z = axes_z * axes_width / 2.0
-
-    # 1. Draw each occupied cell
-    for floor_i in range(floors):
-        for x_i in range(axes_x):
-            for z_i in range(axes_z):
-                if grid[floor_i][x_i][z_i]:
-                    glPushMatrix()
-                    # Center of that cell
-                    world_x = (x_i * axes_width) - half_w_x + axes_width * 0.5
-                    world_y = floor_i * floor_height + floor_height * 0.5
-                    world_z = (z_i * axes_width) - half_w_z + axes_width * 0.5
-                    glTranslatef(world_x, world_y, world_z)
-                    glScalef(axes_width, floor_height, axes_width)
-                    # White color
-                    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (1, 1, 1, 1))
-                    draw_box(1.0)
-                    glPopMatrix()
-
-    # 2. Draw the frame (columns and beams)
-    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (1.0, 0.8, 0.0, 1.0))
-    frame_d = 0.5
-    building_height = floors * floor_height
-
-    # Columns at each grid intersection
-    for x_i in range(axes_x + 1):
-        for z_i in range(axes_z + 1):
-            glPushMatrix()
-            col_x = (x_i * axes_width) - half_w_x
-            col_y = building_height * 0.5
-            col_z = (z_i * axes_width) - half_w_z
-            glTranslatef(col_x, col_y, col_z)
-            glScalef(frame_d, building_height, frame_d)
-            draw_box(1.0)
-            glPopMatrix()
-
-    # Horizontal beams at each floor
-    for floor_i in range(1, floors + 1):
-        y_level = floor_i * floor_height
-        # Beams along x-direction
-        for z_i in range(axes_z + 1):
-            glPushMatrix()
-            beam_x = -half_w_x + (axes_x * axes_width) / 2.0
-            beam_y = y_level
-            beam_z = (z_i * axes_width) - half_w_z
-            glTranslatef(beam_x, beam_y, beam_z)
-            glScalef(axes_x * axes_width + frame_d, frame_d, frame_d)
-            draw_box(1.0)
-            glPopMatrix()
-
-        # Beams along z-direction
-        for x_i in range(axes_x + 1):
-            glPushMatrix()
-            beam_x = (x_i * axes_width) - half_w_x
-            beam_y = y_level
-            beam_z = -half_w_z + (axes_z * axes_width) / 2.0
-            glTranslatef(beam_x, beam_y, beam_z)
-            glScalef(frame_d, frame_d, axes_z * axes_width + frame_d)
-            draw_box(1.0)
-            glPopMatrix()
-
-
-def draw_cafe(cx, cy, cz, size):
+def generate_grid_structure(floors=12, max_axes_x=30, max_axes_z=30, porosity=0.5, seed=None):
     """
-    Draws the café by calling 'draw_box_with_frame' with typical café dimensions
-    (square footprint = size x size, height = min(size, 10)).
+    Pre-generates the random grid structure for the building, a
+    (floors, max_axes_x, max_axes_z) bool array, see building_grid.
     """
-    cafe_size = size
-    cafe_height = min(size, 10)
+    return generate_grid(floors, max_axes_x, max_axes_z, porosity, seed)
 
-    body_color = (0.3, 0.3, 0.8, 1.0)  # Blue
-    frame_color = (1.0, 0.8, 0.0, 1.0)  # Yellow
-    frame_d = 0.5
 
-    draw_box_with_frame(
+def cafe_instances(cx, cy, cz, size):
+    """Instance data of the café's boxes: square footprint size x size,
+    height min(size, 10), blue body, yellow frame, see building_mesh"""
+    return box_with_frame_instances(
         cx,
         cy,
         cz,
-        cafe_size,
-        cafe_height,
-        cafe_size,
-        body_color=body_color,
-        frame_color=frame_color,
-        frame_thickness=frame_d,
+        size,
+        min(size, 10),
+        size,
+        body_color=(0.3, 0.3, 0.8, 1.0),
+        frame_color=(1.0, 0.8, 0.0, 1.0),
+        frame_thickness=0.5,
     )
 
 
-def draw_scene(x, y, size, axes_width, grid, floors, floor_height = 4.0):
-    """
-    Clears screen, sets up camera, draws ground plane,
-    then draws the building plus a moving 'café' box.
-    """
-    # 1. Clear/initialize
-    glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
-    glEnable(GL_DEPTH_TEST)
-    glClearColor(1.0, 1.0, 1.0, 1.0)
+def draw_static_scene(axes_width, grid, floors, floor_height=4.0):
+    """Ground plane and building, the static node of the scene"""
+    # Decide how many axes in building to keep total width ~21
+    axes_x, axes_z = building_axes(axes_width)  # keep symmetrical
 
-    # 2. Decide how many axes in building to keep total width ~21
-    target_width = 21.0
-    axes_x = max(1, round(target_width / axes_width))
-    axes_z = axes_x  # keep symmetrical
+    global building_mesh
+    if building_mesh is None:
+        building_mesh = BuildingMesh()
+    building_mesh.update(grid, axes_width, floors, floor_height)
 
-    # 3. Compute building offsets
-    desired_front_z = -15.0
+    # Compute building offsets
     building_depth = axes_z * axes_width
     building_z_offset = desired_front_z + building_depth / 2.0
     building_x_offset = 0.0
 
-    # 4. Draw ground plane
-    glPushMatrix()
-    glTranslatef(0, -1, 0)
-    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (0.95, 0.95, 0.95, 1.0))
-    plane_size = 1000.0
-    glBegin(GL_QUADS)
-    glNormal3f(0, 1, 0)
-    glVertex3f(-plane_size, 0, -plane_size)
-    glVertex3f(-plane_size, 0, plane_size)
-    glVertex3f(plane_size, 0, plane_size)
-    glVertex3f(plane_size, 0, -plane_size)
-    glEnd()
-    glPopMatrix()
+    # Draw ground plane
+    building_mesh.draw_ground()
 
-    # 5. Draw building
+    # Draw building
     glPushMatrix()
     glTranslatef(building_x_offset, 0, building_z_offset)
-    draw_building_structure(grid, axes_width, floors, axes_x, axes_z)
+    building_mesh.draw_building()
     glPopMatrix()
 
-    # 6. Compute café position (just an example offset relative to building)
-    cafe_protrusion = 2.0
+
+def draw_dynamic_scene(x, y, size):
+    """The café, the dynamic node of the scene"""
+    # Compute café position (just an example offset relative to building)
     cafe_front_z = desired_front_z - cafe_protrusion
     # Shift x, y so the café's lower-left corner is at (x,y)
     adjusted_cx = x #+ size / 2.0
@@ -308,8 +132,42 @@ def draw_scene(x, y, size, axes_width, grid, floors, floor_height = 4.0):
     # Front face goes at cafe_front_z, so center is half 'size' behind that
     adjusted_cz = cafe_front_z + size / 2.0
 
-    # 7. Draw café
-    draw_cafe(adjusted_cx, adjusted_cy, adjusted_cz, size)
+    global cafe_boxes
+    if cafe_boxes is None:
+        cafe_boxes = BoxInstances()
+    cafe_boxes.set_instances(
+        cafe_instances(adjusted_cx, adjusted_cy, adjusted_cz, size),
+        GL_DYNAMIC_DRAW,
+    )
+    cafe_boxes.draw()
+
+
+def get_scene():
+    global scene
+    if scene is None:
+        scene = SceneGraph()
+        scene.add(SceneNode("building", draw_static_scene, static=True))
+        scene.add(SceneNode("cafe", draw_dynamic_scene))
+    return scene
+
+
+def invalidate_scene():
+    """Makes the next draw_scene() redraw everything, call it after
+    drawing something else (e.g. the overlay) into the window"""
+    get_scene().invalidate()
+
+
+def draw_scene(x, y, size, axes_width, grid, floors, floor_height = 4.0):
+    """
+    Draws the ground plane and the building plus a moving 'café' box.
+    The building is cached offscreen and only redrawn when axes_width, grid,
+    floors or floor_height change; the café when x, y or size change.
+    Returns False if nothing changed and the frame was left as it is.
+    """
+    scene = get_scene()
+    scene.set_state("building", axes_width, grid, floors, floor_height)
+    scene.set_state("cafe", x, y, size)
+    return scene.render()
 
 
 def save_screenshot(display, filename="dummy_screenshot.png"):
@@ -318,21 +176,43 @@ def save_screenshot(display, filename="dummy_screenshot.png"):
     # Read the pixels from the frame buffer
     glPixelStorei(GL_PACK_ALIGNMENT, 1)
     data = glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE)
-    # Create a Pygame surface from the pixel data
+    # Create a Pygame surface from the pixel data, flipped to top-down rows
     image = pygame.image.fromstring(data, (width, height), "RGBA", True)
-    # Flip the image vertically to correct orientation
-    image = pygame.transform.flip(image, False, False)
     # Save the image as a PNG file
     pygame.image.save(image, filename)
     print(f"Screenshot saved as {filename}")
 
 
-def load_texture(image_path):
-    """Load an image and convert it to a texture."""
-    image = pygame.image.load(image_path)
-    image_data = pygame.image.tostring(image, "RGBA", True)
-    width, height = image.get_rect().size
+def grab_screenshot_async(display, on_grabbed):
+    """
+    Starts an asynchronous readback of the current OpenGL buffer and returns
+    at once. poll_screenshots() calls on_grabbed(pixels, size) with the RGBA
+    pixels, top row first, once the GPU is done.
+    """
+    global screenshot_readback
+    if screenshot_readback is None:
+        screenshot_readback = PixelReadback()
+    screenshot_readback.request(display, on_grabbed)
+
+
+def poll_screenshots():
+    """Hands finished readbacks to their callbacks, call once per frame."""
+    if screenshot_readback is not None:
+        screenshot_readback.poll()
+
+
+def close_screenshots():
+    """Waits for pending readbacks, needs the GL context."""
+    global screenshot_readback
+    if screenshot_readback is None:
+        return
+    screenshot_readback.finish()
+    screenshot_readback.delete()
+    screenshot_readback = None
+
 
+def texture_from_pixels(image_data, width, height):
+    """Texture from RGBA bytes, bottom row first (decoded off the render thread)."""
     texture_id = glGenTextures(1)
     glBindTexture(GL_TEXTURE_2D, texture_id)
     glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
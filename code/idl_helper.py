@@ -1,5 +1,7 @@
 import numpy as np
 
+from projection_surfaces import PlaneSurface, SphereSurface
+
 
 def screen_boundary(w, h):
     # x boundary -4 ~ 4
@@ -98,9 +100,14 @@ def idl_remap(x, y, z):
     return x, z, -y
 
 def process_tracked_poses(rigid_body_0, rigid_body_1):
+    return process_tracked_positions(rigid_body_0.pos, rigid_body_1.pos)
+
+
+def process_tracked_positions(position_0, position_1):
+    """process_tracked_poses for the raw start and end positions"""
     # remap because of the change of coordinating system in IDL
-    new_pos0 = idl_remap(*rigid_body_0.pos)
-    new_pos1 = idl_remap(*rigid_body_1.pos)
+    new_pos0 = idl_remap(*position_0)
+    new_pos1 = idl_remap(*position_1)
 
     # create ray from trakced 2 poses
     ray_origin = np.array(
@@ -132,6 +139,153 @@ def process_tracked_poses(rigid_body_0, rigid_body_1):
     return pt_screen, pt_dome, distance
 
 
+# ----------------------
+# Batched pointers
+# ----------------------
+# Same geometry as above for N pointers at once. Arrays have a leading
+# pointer axis, misses are reported in boolean masks (the points of
+# missed pointers are NaN).
+
+def screen_boundaries(points):
+    # x boundary -4 ~ 4
+    # y boundary 0 ~ 5
+    return np.clip(points[..., :2], [-4, 0], [4, 5])
+
+
+def row_norms(vectors):
+    return np.sqrt((vectors * vectors).sum(axis=-1))
+
+
+def normalize_rows(vectors):
+    return vectors / row_norms(vectors)[..., None]
+
+
+def ray_plane_intersections(ray_origins, ray_directions, plane_point, plane_normal):
+    ray_directions = normalize_rows(ray_directions)
+    plane_normal = plane_normal / np.linalg.norm(plane_normal)
+
+    dot_products = ray_directions @ plane_normal
+    # np.isclose(dot_product, 0)
+    not_parallel = np.abs(dot_products) > 1e-8
+    t = np.divide(
+        (plane_point - ray_origins) @ plane_normal, dot_products,
+        out=np.full_like(dot_products, -1.0), where=not_parallel
+    )
+    hit = t >= 0
+
+    points = np.where(hit[:, None], ray_origins + t[:, None] * ray_directions, np.nan)
+    return points, hit
+
+
+def ray_sphere_intersections(ray_origins, ray_directions, sphere_center, sphere_radius):
+    oc = ray_origins - sphere_center
+
+    # Quadratic coefficients, per row
+    a = (ray_directions * ray_directions).sum(axis=1)
+    b = 2.0 * (oc * ray_directions).sum(axis=1)
+    c = (oc * oc).sum(axis=1) - sphere_radius**2
+
+    discriminant = b**2 - 4 * a * c
+    root = np.sqrt(np.maximum(discriminant, 0))
+    t1 = (-b - root) / (2 * a)
+    t2 = (-b + root) / (2 * a)
+
+    # nearest positive intersection, t1 <= t2
+    t = np.where(t1 >= 0, t1, t2)
+    hit = (discriminant >= 0) & (t >= 0)
+
+    points = np.where(hit[:, None], ray_origins + t[:, None] * ray_directions, np.nan)
+    return points, hit
+
+
+def ray_dome_intersections(
+    ray_origins, ray_directions, dome_center, dome_radius, dome_up_direction
+):
+    ray_directions = normalize_rows(ray_directions)
+    points, hit = ray_sphere_intersections(
+        ray_origins, ray_directions, dome_center, dome_radius
+    )
+    # only the upper hemisphere
+    hit &= (points - dome_center) @ dome_up_direction >= 0
+    points[~hit] = np.nan
+    return points, hit
+
+
+def idl_remap_points(points):
+    # x, y, z -> x, z, -y
+    return points[..., [0, 2, 1]] * np.array([1, 1, -1])
+
+
+def pair_tracked_poses(ids, positions):
+    """Pairs rigid bodies by id, (0, 1), (2, 3), ... -> (N, 2, 3) poses.
+    An unpaired last body is ignored."""
+    order = np.argsort(ids, kind="stable")
+    pair_count = len(order) // 2
+    return np.asarray(positions, dtype=float)[order[:2 * pair_count]].reshape(
+        pair_count, 2, 3
+    )
+
+
+def process_tracked_pose_pairs(poses, surfaces=None):
+    """process_tracked_poses for (N, 2, 3) start/end positions.
+
+    surfaces is an optional projection_surfaces.ProjectionSurfaces with a
+    "screen" and a "dome" surface that replace the fixed plane and dome.
+    Returns screen points (N, 2), screen hit mask (N,), dome points (N, 3),
+    dome hit mask (N,) and start-end distances (N,).
+    """
+    poses = idl_remap_points(np.asarray(poses, dtype=float))
+    ray_origins = poses[:, 0]
+    ray_directions = poses[:, 0] - poses[:, 1]
+    distances = row_norms(ray_directions)
+
+    if surfaces is not None:
+        # one walk, the nearest hit on each of the two surfaces
+        hits = surfaces.cast(ray_origins, ray_directions, ["screen", "dome"],
+                             separate=True)
+        return (hits["screen"].local, hits["screen"].hit, hits["dome"].points,
+                hits["dome"].hit, distances)
+
+    # fixed plane
+    plane_point = np.array([0, 0, 2.7])
+    plane_normal = np.array([0, 0, 1])
+    pts_screen, screen_hit = ray_plane_intersections(
+        ray_origins, ray_directions, plane_point, plane_normal
+    )
+    pts_screen = screen_boundaries(pts_screen)
+
+    # fixed dome in the space
+    dome_center = np.array([0, 0, 0])
+    dome_radius = 4.0
+    dome_up_direction = np.array([0, 1, 0])
+    pts_dome, dome_hit = ray_dome_intersections(
+        ray_origins, ray_directions, dome_center, dome_radius, dome_up_direction
+    )
+
+    return pts_screen, screen_hit, pts_dome, dome_hit, distances
+
+
+def uses_fixed_surfaces(surfaces):
+    """True if surfaces only holds the fixed screen and dome above, the
+    closed form path then gives the same hits for less"""
+    if surfaces.names != ["screen", "dome"]:
+        return False
+    screen, dome = surfaces.surfaces
+
+    def same(a, b):
+        return np.allclose(np.asarray(a, dtype=float), b)
+
+    return (
+        isinstance(screen, PlaneSurface) and screen.clamp
+        and same(screen.point, [0, 0, 2.7]) and same(screen.normal, [0, 0, 1])
+        and same(screen.u_axis, [1, 0, 0])
+        and same(screen.u_range, [-4, 4]) and same(screen.v_range, [0, 5])
+        and isinstance(dome, SphereSurface) and dome.closed
+        and dome.up is not None and same(dome.up, [0, 1, 0])
+        and same(dome.center, [0, 0, 0]) and same(dome.radius, 4.0)
+    )
+
+
 def map_point_2_holophonix(x, y, z):
     x = -x
     y = z
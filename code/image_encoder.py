@@ -0,0 +1,201 @@
+"""
+Background image encoding for screenshots and animation frames.
+
+EncoderPool takes raw (height, width, 3 or 4) uint8 arrays, first row at
+the top, and writes them from a thread pool (zlib releases the GIL, so PNG
+compression runs in parallel) or optionally a process pool. At most
+max_pending images are queued or being encoded; submit() blocks beyond
+that, so a fast producer cannot pile up frames in memory.
+
+Formats, picked from the file extension unless given:
+
+    png   zlib compression level 0 (stored) to 9, "up" row filter
+    ppm   binary P6, RGB, no compression
+    raw   the bytes of the array as they are
+    webp  Pillow, if installed (quality)
+    qoi   the qoi package, if installed
+"""
+
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    import qoi
+except ImportError:
+    qoi = None
+
+DEFAULT_FORMAT = "png"
+DEFAULT_COMPRESS_LEVEL = 6
+DEFAULT_WEBP_QUALITY = 90
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+# ----------------------
+# Encoders
+# ----------------------
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + \
+        struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+def encode_png(pixels, compress_level=DEFAULT_COMPRESS_LEVEL):
+    """PNG bytes of an RGB or RGBA array"""
+    height, width, channels = pixels.shape
+    color_type = {3: 2, 4: 6}[channels]
+    rows = pixels.reshape(height, width * channels)
+    filtered = np.empty((height, width * channels + 1), dtype=np.uint8)
+    if compress_level == 0:
+        filtered[:, 0] = 0  # none
+        filtered[:, 1:] = rows
+    else:
+        # "up": difference to the row above, cheap and good on renders
+        filtered[:, 0] = 2
+        filtered[0, 1:] = rows[0]
+        np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    header = struct.pack(">IIBBBBB", width, height, 8, color_type, 0, 0, 0)
+    return PNG_SIGNATURE + png_chunk(b"IHDR", header) + \
+        png_chunk(b"IDAT", zlib.compress(filtered, compress_level)) + \
+        png_chunk(b"IEND", b"")
+
+
+def write_png(pixels, filename, compress_level=DEFAULT_COMPRESS_LEVEL,
+              **options):
+    with open(filename, "wb") as image_file:
+        image_file.write(encode_png(pixels, compress_level))
+
+
+def write_ppm(pixels, filename, **options):
+    height, width, _ = pixels.shape
+    with open(filename, "wb") as image_file:
+        image_file.write(b"P6\n%d %d\n255\n" % (width, height))
+        image_file.write(np.ascontiguousarray(pixels[:, :, :3]))
+
+
+def write_raw(pixels, filename, **options):
+    with open(filename, "wb") as image_file:
+        image_file.write(np.ascontiguousarray(pixels))
+
+
+def write_webp(pixels, filename, quality=DEFAULT_WEBP_QUALITY, **options):
+    Image.fromarray(pixels).save(filename, "WEBP", quality=quality)
+
+
+def write_qoi(pixels, filename, **options):
+    qoi.write(filename, np.ascontiguousarray(pixels))
+
+
+FORMATS = ("png", "ppm", "raw", "webp", "qoi")
+WRITERS = {
+    "png": write_png,
+    "ppm": write_ppm,
+    "raw": write_raw,
+}
+if Image is not None:
+    WRITERS["webp"] = write_webp
+if qoi is not None:
+    WRITERS["qoi"] = write_qoi
+
+
+def available_formats():
+    return sorted(WRITERS)
+
+
+def format_from_filename(filename, default=DEFAULT_FORMAT):
+    extension = os.path.splitext(filename)[1].lower().lstrip(".")
+    return extension if extension in FORMATS else default
+
+
+def write_image(pixels, filename, image_format=None, **options):
+    """Encodes and writes one image, returns filename"""
+    if image_format is None:
+        image_format = format_from_filename(filename)
+    if image_format not in WRITERS:
+        raise ValueError("image format '%s' not available, use one of %s"
+                         % (image_format, ", ".join(available_formats())))
+    # readers never see a half written file
+    temp_filename = filename + ".tmp"
+    WRITERS[image_format](pixels, temp_filename, **options)
+    os.replace(temp_filename, filename)
+    return filename
+
+
+# ----------------------
+# Pool
+# ----------------------
+class EncoderPool:
+    """Bounded pool of image writers.
+
+    on_done(filename) callbacks run on a pool thread (the submitting
+    process' callback thread with use_processes=True).
+    """
+
+    def __init__(self, workers=None, max_pending=None, image_format=None,
+                 use_processes=False, **options):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending or 2 * self.workers
+        self.image_format = image_format
+        self.options = options
+        executor_type = ProcessPoolExecutor if use_processes else \
+            ThreadPoolExecutor
+        self.executor = executor_type(self.workers)
+        self.slots = threading.BoundedSemaphore(self.max_pending)
+        self.lock = threading.Lock()
+        self.written_count = 0
+        self.failed_count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def submit(self, pixels, filename, image_format=None, on_done=None,
+               **options):
+        """Queues pixels for filename, blocks while max_pending images are
+        in flight. The pool keeps a reference to pixels, don't reuse it."""
+        if image_format is None:
+            image_format = self.image_format
+        options = dict(self.options, **options)
+        self.slots.acquire()
+        try:
+            future = self.executor.submit(write_image, pixels, filename,
+                                          image_format, **options)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(
+            lambda future: self.finished(future, filename, on_done))
+        return future
+
+    def finished(self, future, filename, on_done):
+        self.slots.release()
+        error = future.exception()
+        with self.lock:
+            if error is None:
+                self.written_count += 1
+            else:
+                self.failed_count += 1
+        if error is not None:
+            print("ERROR: could not save %s:\n  %s" % (filename, error))
+        elif on_done is not None:
+            on_done(filename)
+
+    def saver(self, filename, on_saved=None, **options):
+        """screenshot_readback.PixelReadback callback writing filename"""
+        def callback(pixels, size):
+            self.submit(pixels, filename, on_done=on_saved, **options)
+        return callback
+
+    def close(self, wait=True):
+        """Finishes (wait=True) everything submitted so far"""
+        self.executor.shutdown(wait=wait)
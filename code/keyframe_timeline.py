@@ -0,0 +1,125 @@
+"""
+Keyframe timeline for the café animation.
+
+A Timeline holds keyframes (one row of parameters each, e.g. x, y, size,
+axes_width) and the duration of every segment between them. sample()
+evaluates any number of times at once with NumPy, frames() precomputes
+the (frames, params) array of a whole export, and sample(t) with a clock
+time drives real-time playback such as the live demo's attract mode.
+
+    timeline = Timeline(STATES_V2, easing="quad")
+    parameters = timeline.frames(600)          # parameters[frame]
+    x, y, size, axes_width = timeline.sample(time.perf_counter() - start)
+
+Easing reshapes the local time of a segment ("linear", "quad", "cubic"
+in-out, or any vectorized function of t in [0, 1]). Interpolation is
+"linear" between the two keyframes of a segment or "catmull_rom", a
+spline through all keyframes that keeps the velocity continuous.
+"""
+
+import numpy as np
+
+
+# ----------------------
+# Easing, t in [0, 1]
+# ----------------------
+def ease_linear(t):
+    return t
+
+
+def ease_in_out_quad(t):
+    return np.where(t < 0.5, 2.0 * t * t, -1.0 + (4.0 - 2.0 * t) * t)
+
+
+def ease_in_out_cubic(t):
+    return np.where(t < 0.5, 4.0 * t * t * t,
+                    1.0 - 4.0 * (1.0 - t) * (1.0 - t) * (1.0 - t))
+
+
+EASINGS = {
+    "linear": ease_linear,
+    "quad": ease_in_out_quad,
+    "cubic": ease_in_out_cubic,
+}
+INTERPOLATIONS = ("linear", "catmull_rom")
+
+
+class Timeline:
+    """Keyframes with per segment durations.
+
+    With loop=True the last keyframe blends back into the first, so there
+    are as many segments as keyframes; otherwise one less and sampling
+    holds the end values. durations defaults to 1 per segment.
+    """
+
+    def __init__(self, keyframes, durations=None, easing="quad",
+                 interpolation="linear", loop=True):
+        self.keyframes = np.array(keyframes, dtype=np.float64, ndmin=2)
+        self.loop = loop
+        count = len(self.keyframes)
+        segment_count = count if loop else count - 1
+        if segment_count < 1:
+            raise ValueError("a timeline needs at least %d keyframes"
+                             % (1 if loop else 2))
+        if durations is None:
+            durations = np.ones(segment_count)
+        self.durations = np.array(durations, dtype=np.float64)
+        if self.durations.shape != (segment_count,):
+            raise ValueError("expected %d segment durations, got %d"
+                             % (segment_count, self.durations.size))
+        if np.any(self.durations <= 0):
+            raise ValueError("segment durations must be positive")
+        self.starts = np.concatenate(([0.0], np.cumsum(self.durations)))
+        self.duration = float(self.starts[-1])
+
+        self.easing = EASINGS[easing] if isinstance(easing, str) else easing
+        if interpolation not in INTERPOLATIONS:
+            raise ValueError("unknown interpolation '%s', use one of %s"
+                             % (interpolation, ", ".join(INTERPOLATIONS)))
+        self.interpolation = interpolation
+
+        # keyframes before / at the start / at the end / after each segment
+        index = np.arange(segment_count)
+        if loop:
+            neighbours = [(index - 1) % count, index, (index + 1) % count,
+                          (index + 2) % count]
+        else:
+            neighbours = [np.maximum(index - 1, 0), index, index + 1,
+                          np.minimum(index + 2, count - 1)]
+        self.p0, self.p1, self.p2, self.p3 = \
+            [self.keyframes[i] for i in neighbours]
+
+    def sample(self, times):
+        """Parameters at times (seconds or any unit of the durations),
+        shape (params,) for a scalar time, (len(times), params) else"""
+        times = np.asarray(times, dtype=np.float64)
+        scalar = times.ndim == 0
+        times = np.atleast_1d(times)
+        if self.loop:
+            times = np.mod(times, self.duration)
+        else:
+            times = np.clip(times, 0.0, self.duration)
+
+        segment = np.searchsorted(self.starts, times, side="right") - 1
+        segment = np.clip(segment, 0, len(self.durations) - 1)
+        local = (times - self.starts[segment]) / self.durations[segment]
+        t = np.asarray(self.easing(np.clip(local, 0.0, 1.0)))[:, None]
+
+        p1 = self.p1[segment]
+        p2 = self.p2[segment]
+        if self.interpolation == "linear":
+            values = p1 + (p2 - p1) * t
+        else:
+            m1 = (p2 - self.p0[segment]) * 0.5
+            m2 = (self.p3[segment] - p1) * 0.5
+            t2 = t * t
+            t3 = t2 * t
+            values = (2 * t3 - 3 * t2 + 1) * p1 + (t3 - 2 * t2 + t) * m1 + \
+                (-2 * t3 + 3 * t2) * p2 + (t3 - t2) * m2
+        return values[0] if scalar else values
+
+    def frames(self, total_frames):
+        """(total_frames, params) array, the timeline spread over
+        total_frames evenly spaced frames"""
+        times = np.arange(total_frames) * (self.duration / total_frames)
+        return self.sample(times)
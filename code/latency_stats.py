@@ -0,0 +1,135 @@
+"""
+Per-stage latency statistics for the mocap -> pixel / speaker pipeline.
+
+Every stage keeps the last WINDOW_SIZE samples in a preallocated NumPy ring,
+so record() is a couple of stores and never allocates. Percentiles are only
+computed when summary(), dump_csv() or the HTTP endpoint ask for them.
+
+Stages are measured in seconds from the local receive time of a frame
+(time.perf_counter, same clock as frame_ring), except STAGE_MOTIVE which is
+camera mid exposure -> transmit on Motive's own high resolution clock.
+
+    curl http://127.0.0.1:8765/
+"""
+
+import csv
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Stages, in pipeline order
+STAGE_MOTIVE = "motive"    # camera mid exposure -> transmit (Motive)
+STAGE_DECODE = "decode"    # receive -> frame decoded
+STAGE_POSES = "poses"      # receive -> idl.process_tracked_poses done
+STAGE_OSC = "osc"          # receive -> OSC messages sent
+STAGE_FLIP = "flip"        # receive -> pygame.display.flip done
+STAGES = (STAGE_MOTIVE, STAGE_DECODE, STAGE_POSES, STAGE_OSC, STAGE_FLIP)
+
+WINDOW_SIZE = 4096
+PERCENTILES = (50, 95, 99)
+CSV_FIELDS = ("stage", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms",
+              "max_ms")
+
+
+class LatencyStats:
+    def __init__(self, stages=STAGES, window_size=WINDOW_SIZE):
+        self.stages = tuple(stages)
+        self.window_size = window_size
+        self.samples = {stage: np.zeros(window_size) for stage in self.stages}
+        # samples recorded per stage, the ring index is count % window_size
+        self.counts = dict.fromkeys(self.stages, 0)
+        self.http_server = None
+
+    # ----------------------
+    # Recording
+    # ----------------------
+    def record(self, stage, seconds):
+        count = self.counts[stage]
+        self.samples[stage][count % self.window_size] = seconds
+        self.counts[stage] = count + 1
+
+    def record_since(self, stage, receive_time, now=None):
+        """Records now - receive_time, now defaults to time.perf_counter()"""
+        if receive_time is None:
+            return
+        if now is None:
+            now = time.perf_counter()
+        self.record(stage, now - receive_time)
+
+    def record_frame(self, mocap_data, receive_time, clock_frequency=0):
+        """Motive and decode stages of a freshly decoded frame"""
+        self.record_since(STAGE_DECODE, receive_time)
+        suffix_data = mocap_data.suffix_data
+        if clock_frequency > 0 and suffix_data is not None and \
+           suffix_data.stamp_camera_mid_exposure > 0:
+            self.record(STAGE_MOTIVE, (suffix_data.stamp_transmit -
+                                       suffix_data.stamp_camera_mid_exposure)
+                        / clock_frequency)
+
+    # ----------------------
+    # Reporting
+    # ----------------------
+    def get_samples(self, stage):
+        count = min(self.counts[stage], self.window_size)
+        return self.samples[stage][:count].copy()
+
+    def get_percentile(self, stage, percentile=50):
+        """Percentile of a stage in seconds, None before the first sample"""
+        values = self.get_samples(stage)
+        if len(values) == 0:
+            return None
+        return float(np.percentile(values, percentile))
+
+    def summary(self):
+        """{stage: {count, mean_ms, p50_ms, p95_ms, p99_ms, max_ms}}"""
+        result = {}
+        for stage in self.stages:
+            values = self.get_samples(stage) * 1000.0
+            stage_summary = dict.fromkeys(CSV_FIELDS[1:])
+            stage_summary["count"] = self.counts[stage]
+            if len(values) > 0:
+                stage_summary["mean_ms"] = float(np.mean(values))
+                stage_summary["max_ms"] = float(np.max(values))
+                for percentile, value in zip(
+                        PERCENTILES, np.percentile(values, PERCENTILES)):
+                    stage_summary["p%d_ms" % percentile] = float(value)
+            result[stage] = stage_summary
+        return result
+
+    def dump_csv(self, path):
+        with open(path, "w", newline="") as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(CSV_FIELDS)
+            for stage, stage_summary in self.summary().items():
+                writer.writerow([stage] + [stage_summary[field]
+                                           for field in CSV_FIELDS[1:]])
+
+    def serve_http(self, port=8765, host="127.0.0.1"):
+        """Serves summary() as JSON from a daemon thread"""
+        stats = self
+
+        class SummaryHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = json.dumps(stats.summary(), indent=2).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer((host, port), SummaryHandler)
+        threading.Thread(target=self.http_server.serve_forever,
+                         daemon=True).start()
+        return self.http_server
+
+    def shutdown(self):
+        if self.http_server is not None:
+            self.http_server.shutdown()
+            self.http_server.server_close()
+            self.http_server = None
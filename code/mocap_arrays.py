@@ -0,0 +1,190 @@
+"""
+Structure-of-arrays storage for NatNet rigid bodies.
+
+MoCapData.RigidBodyData keeps one RigidBody object (plus pos/rot tuples)
+per rigid body per frame. RigidBodyArrays instead keeps the ids, positions
+(N x 3), quaternions (N x 4), errors and tracking flags of a frame in
+contiguous NumPy arrays that are allocated once and refilled in place.
+RigidBodyView gives the attribute access (.id_num, .pos, .rot, ...) that
+code written against MoCapData.RigidBody expects.
+
+MoCapFrame is a MoCapData.MoCapData that owns one RigidBodyArrays and is
+reused for every frame, see natnet_decoder.unpack_mocap_data(frame=...).
+Views and arrays are overwritten by the next frame, copy what you keep.
+"""
+
+import numpy as np
+
+import MoCapData
+
+# NatNet 3+ rigid body record, same layout as natnet_decoder.RigidBodyRecord
+# id, pos(x, y, z), rot(qx, qy, qz, qw), mean error, params
+RIGID_BODY_DTYPE = np.dtype([
+    ('id', '<i4'),
+    ('pos', '<f4', (3,)),
+    ('rot', '<f4', (4,)),
+    ('error', '<f4'),
+    ('params', '<i2'),
+])
+
+DEFAULT_CAPACITY = 16
+
+
+class RigidBodyView:
+    """Read-only MoCapData.RigidBody look-alike for row index of arrays"""
+    __slots__ = ("arrays", "index")
+
+    # NatNet 3+ streams no longer carry rigid body markers
+    rb_marker_list = ()
+    marker_num = -1
+
+    def __init__(self, arrays, index):
+        self.arrays = arrays
+        self.index = index
+
+    @property
+    def id_num(self):
+        return int(self.arrays.ids[self.index])
+
+    @property
+    def pos(self):
+        return self.arrays.pos[self.index]
+
+    @property
+    def rot(self):
+        return self.arrays.rot[self.index]
+
+    @property
+    def error(self):
+        return float(self.arrays.error[self.index])
+
+    @property
+    def tracking_valid(self):
+        return bool(self.arrays.tracking_valid[self.index])
+
+    def to_rigid_body(self):
+        """Copy of this row as a MoCapData.RigidBody"""
+        rigid_body = MoCapData.RigidBody(
+            self.id_num, tuple(self.pos.tolist()), tuple(self.rot.tolist()))
+        rigid_body.error = self.error
+        rigid_body.tracking_valid = self.tracking_valid
+        return rigid_body
+
+    def get_as_string(self, tab_str="  ", level=0):
+        rigid_body = self.to_rigid_body()
+        rigid_body.marker_num = self.index
+        return rigid_body.get_as_string(tab_str, level)
+
+
+class RigidBodyArrays:
+    """Drop-in for MoCapData.RigidBodyData backed by NumPy arrays"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.count = 0
+        self.__allocate(capacity)
+
+    def __allocate(self, capacity):
+        self.ids = np.zeros(capacity, dtype=np.int32)
+        self.pos = np.zeros((capacity, 3), dtype=np.float32)
+        self.rot = np.zeros((capacity, 4), dtype=np.float32)
+        self.error = np.zeros(capacity, dtype=np.float32)
+        self.tracking_valid = np.zeros(capacity, dtype=bool)
+        self.views = [RigidBodyView(self, i) for i in range(capacity)]
+
+    def get_capacity(self):
+        return len(self.ids)
+
+    def reserve(self, capacity):
+        """Grows the arrays (doubling) to hold at least capacity bodies.
+        Existing rows are kept."""
+        old_capacity = self.get_capacity()
+        if capacity <= old_capacity:
+            return
+        ids, pos, rot = self.ids, self.pos, self.rot
+        error, tracking_valid = self.error, self.tracking_valid
+        self.__allocate(max(capacity, 2 * old_capacity))
+        count = self.count
+        self.ids[:count] = ids[:count]
+        self.pos[:count] = pos[:count]
+        self.rot[:count] = rot[:count]
+        self.error[:count] = error[:count]
+        self.tracking_valid[:count] = tracking_valid[:count]
+
+    def clear(self):
+        self.count = 0
+
+    def unpack_from(self, data, offset, count):
+        """Fills the arrays from count packed rigid body records at offset.
+        Returns the offset past the last record."""
+        self.reserve(count)
+        records = np.frombuffer(data, dtype=RIGID_BODY_DTYPE, count=count,
+                                offset=offset)
+        self.ids[:count] = records['id']
+        self.pos[:count] = records['pos']
+        self.rot[:count] = records['rot']
+        self.error[:count] = records['error']
+        np.not_equal(records['params'] & 0x01, 0,
+                     out=self.tracking_valid[:count])
+        self.count = count
+        return offset + RIGID_BODY_DTYPE.itemsize * count
+
+    def add_rigid_body(self, rigid_body):
+        """Appends the values of a MoCapData.RigidBody (or view)"""
+        index = self.count
+        self.reserve(index + 1)
+        self.ids[index] = rigid_body.id_num
+        self.pos[index] = rigid_body.pos
+        self.rot[index] = rigid_body.rot
+        self.error[index] = rigid_body.error
+        self.tracking_valid[index] = rigid_body.tracking_valid
+        self.count = index + 1
+        return self.count
+
+    def get_rigid_body_count(self):
+        return self.count
+
+    # Views of the valid rows, shared with the next frame
+    def get_ids(self):
+        return self.ids[:self.count]
+
+    def get_positions(self):
+        return self.pos[:self.count]
+
+    def get_rotations(self):
+        return self.rot[:self.count]
+
+    def get_tracking_valid(self):
+        return self.tracking_valid[:self.count]
+
+    @property
+    def rigid_body_list(self):
+        return self.views[:self.count]
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        return self.rigid_body_list[index]
+
+    def __iter__(self):
+        return iter(self.rigid_body_list)
+
+    def get_as_string(self, tab_str="  ", level=0):
+        out_tab_str = MoCapData.get_tab_str(tab_str, level)
+        out_str = "%sRigid Body Count: %3.1d\n" % (out_tab_str, self.count)
+        for view in self.rigid_body_list:
+            out_str += view.get_as_string(tab_str, level+1)
+        return out_str
+
+
+class MoCapFrame(MoCapData.MoCapData):
+    """MoCapData frame whose rigid bodies live in a reused RigidBodyArrays"""
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        super().__init__()
+        self.rigid_body_arrays = RigidBodyArrays(capacity)
+
+    def reset(self):
+        """Drops the sections of the previous frame, keeps the arrays"""
+        MoCapData.MoCapData.__init__(self)
+        self.rigid_body_arrays.clear()
@@ -0,0 +1,223 @@
+"""
+Benchmark of the NatNet frame decoders.
+
+Builds NAT_FRAMEOFDATA packets from MoCapData.generate_mocap_data frames
+and times the reference decoder in NatNetClient against natnet_decoder,
+decoding every section and only the rigid bodies, into MoCapData objects
+and into the reused NumPy arrays of mocap_arrays.MoCapFrame.
+
+    python natnet_bench.py
+"""
+
+import struct
+import timeit
+
+import MoCapData
+from NatNetClient import NatNetClient
+
+# ----------------------
+# Configuration
+# ----------------------
+NATNET_VERSION = (4, 1)
+FRAME_COUNT = 240
+# rigid bodies streamed on top of the 3 generate_mocap_data adds
+EXTRA_RIGID_BODIES = 40
+REPEAT = 5
+
+
+# ----------------------
+# Packet building
+# ----------------------
+def pack_section(count, body, major, minor):
+    """Section header (count and, for NatNet 4.1+, byte count) + body"""
+    out = struct.pack('<i', count)
+    if (major == 4 and minor > 0) or major > 4:
+        out += struct.pack('<i', len(body))
+    return out + body
+
+
+def pack_rigid_body(rigid_body):
+    param = 0x01 if rigid_body.tracking_valid else 0x00
+    return struct.pack('<i3f4ffh', rigid_body.id_num, *rigid_body.pos,
+                       *rigid_body.rot, rigid_body.error, param)
+
+
+def pack_channels(channel_data_list):
+    out = b''
+    for channel_data in channel_data_list:
+        out += struct.pack('<i', len(channel_data.frame_list))
+        for frame_entry in channel_data.frame_list:
+            out += struct.pack('<f', frame_entry)
+    return out
+
+
+def pack_mocap_data(mocap_data, major=4, minor=1):
+    """Serializes a MoCapData frame into a NAT_FRAMEOFDATA packet"""
+    out = struct.pack('<i', mocap_data.prefix_data.frame_number)
+
+    body = b''
+    marker_data_list = []
+    if mocap_data.marker_set_data is not None:
+        marker_data_list = mocap_data.marker_set_data.marker_data_list
+    for marker_data in marker_data_list:
+        model_name = marker_data.model_name
+        if isinstance(model_name, str):
+            model_name = model_name.encode('utf-8')
+        body += model_name + b'\0'
+        body += struct.pack('<i', marker_data.get_num_points())
+        for pos in marker_data.marker_pos_list:
+            body += struct.pack('<3f', *pos)
+    out += pack_section(len(marker_data_list), body, major, minor)
+
+    body = b''
+    pos_list = []
+    if mocap_data.legacy_other_markers is not None:
+        pos_list = mocap_data.legacy_other_markers.marker_pos_list
+    for pos in pos_list:
+        body += struct.pack('<3f', *pos)
+    out += pack_section(len(pos_list), body, major, minor)
+
+    rigid_body_list = mocap_data.rigid_body_data.rigid_body_list
+    body = b''.join(pack_rigid_body(rb) for rb in rigid_body_list)
+    out += pack_section(len(rigid_body_list), body, major, minor)
+
+    body = b''
+    skeleton_list = mocap_data.skeleton_data.skeleton_list
+    for skeleton in skeleton_list:
+        body += struct.pack('<ii', skeleton.id_num,
+                            len(skeleton.rigid_body_list))
+        body += b''.join(pack_rigid_body(rb)
+                         for rb in skeleton.rigid_body_list)
+    out += pack_section(len(skeleton_list), body, major, minor)
+
+    if (major == 4 and minor > 0) or major > 4:
+        body = b''
+        asset_list = []
+        if mocap_data.asset_data is not None:
+            asset_list = mocap_data.asset_data.asset_list
+        for asset in asset_list:
+            body += struct.pack('<ii', asset.asset_id,
+                                len(asset.rigid_body_list))
+            for rb in asset.rigid_body_list:
+                body += struct.pack('<i3f4ffh', rb.id_num, *rb.pos, *rb.rot,
+                                    rb.mean_error, rb.param)
+            body += struct.pack('<i', len(asset.marker_list))
+            for marker in asset.marker_list:
+                body += struct.pack('<i3ffhf', marker.marker_id, *marker.pos,
+                                    marker.marker_size, marker.marker_params,
+                                    marker.residual)
+        out += pack_section(len(asset_list), body, major, minor)
+
+    labeled_marker_list = mocap_data.labeled_marker_data.labeled_marker_list
+    body = b''
+    for marker in labeled_marker_list:
+        body += struct.pack('<i3ffhf', marker.id_num, *marker.pos,
+                            marker.size, marker.param,
+                            marker.residual / 1000.0)
+    out += pack_section(len(labeled_marker_list), body, major, minor)
+
+    body = b''
+    force_plate_list = mocap_data.force_plate_data.force_plate_list
+    for force_plate in force_plate_list:
+        body += struct.pack('<ii', force_plate.id_num,
+                            len(force_plate.channel_data_list))
+        body += pack_channels(force_plate.channel_data_list)
+    out += pack_section(len(force_plate_list), body, major, minor)
+
+    body = b''
+    device_list = mocap_data.device_data.device_list
+    for device in device_list:
+        body += struct.pack('<ii', device.id_num,
+                            len(device.channel_data_list))
+        body += pack_channels(device.channel_data_list)
+    out += pack_section(len(device_list), body, major, minor)
+
+    suffix_data = mocap_data.suffix_data
+    out += struct.pack('<iidqqq', suffix_data.timecode,
+                       suffix_data.timecode_sub, suffix_data.timestamp,
+                       suffix_data.stamp_camera_mid_exposure,
+                       suffix_data.stamp_data_received,
+                       suffix_data.stamp_transmit)
+    if (major == 4 and minor > 0) or major > 4:
+        out += struct.pack('<ii', suffix_data.prec_timestamp_secs,
+                           suffix_data.prec_timestamp_frac_secs)
+    out += struct.pack('<h', suffix_data.param)
+
+    header = struct.pack('<hH', NatNetClient.NAT_FRAMEOFDATA, len(out))
+    return header + out
+
+
+def generate_packets(frame_count=FRAME_COUNT,
+                     extra_rigid_bodies=EXTRA_RIGID_BODIES,
+                     major=NATNET_VERSION[0], minor=NATNET_VERSION[1]):
+    packets = []
+    for frame_num in range(frame_count):
+        mocap_data = MoCapData.generate_mocap_data(frame_num)
+        rigid_body_data = mocap_data.rigid_body_data
+        for body_num in range(3, 3 + extra_rigid_bodies):
+            rigid_body_data.add_rigid_body(
+                MoCapData.generate_rigid_body(body_num, frame_num))
+        packets.append(pack_mocap_data(mocap_data, major, minor))
+    return packets
+
+
+# ----------------------
+# Benchmark
+# ----------------------
+def rigid_bodies_match(mocap_data_a, mocap_data_b):
+    list_a = mocap_data_a.rigid_body_data.rigid_body_list
+    list_b = mocap_data_b.rigid_body_data.rigid_body_list
+    if len(list_a) != len(list_b):
+        return False
+    for rb_a, rb_b in zip(list_a, list_b):
+        if (rb_a.id_num != rb_b.id_num or tuple(rb_a.pos) != tuple(rb_b.pos)
+                or tuple(rb_a.rot) != tuple(rb_b.rot)
+                or rb_a.tracking_valid != rb_b.tracking_valid):
+            return False
+    return True
+
+
+def decode_all(client, packets, major, minor):
+    for packet in packets:
+        client.unpack_frame_of_data(packet, 4, len(packet) - 4, major, minor)
+
+
+def main():
+    major, minor = NATNET_VERSION
+    packets = generate_packets()
+    client = NatNetClient()
+    print("NatNet %d.%d, %d frames, %d bytes per frame" % (
+        major, minor, len(packets), len(packets[0])))
+
+    # label, decoder, sections
+    configurations = [
+        ("legacy", "legacy", None),
+        ("fast", "fast", None),
+        ("fast-rb", "fast", ["rigid_bodies"]),
+        ("arrays", "arrays", None),
+        ("arrays-rb", "arrays", ["rigid_bodies"]),
+    ]
+    results = {}
+    reference = None
+    for label, decoder, sections in configurations:
+        client.set_decoder(decoder)
+        client.set_sections(sections)
+        mocap_data = client.unpack_frame_of_data(
+            packets[0], 4, len(packets[0]) - 4, major, minor)[1]
+        # "arrays" frames are reused, compare before decoding the next one
+        if reference is None:
+            reference = mocap_data
+        elif not rigid_bodies_match(reference, mocap_data):
+            print("WARNING: %s disagrees on rigid body data" % label)
+        timer = timeit.Timer(lambda: decode_all(client, packets, major, minor))
+        best = min(timer.repeat(repeat=REPEAT, number=1))
+        results[label] = best / len(packets)
+        print("%-9s %8.1f us/frame  (%7.0f frames/s)" % (
+            label, results[label] * 1e6, 1.0 / results[label]))
+
+    for label, _, _ in configurations[1:]:
+        print("speedup   %8.2fx  %s" % (results["legacy"] / results[label],
+                                        label))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,368 @@
+"""
+Slice-free decoder for NatNet frame of data packets (NatNet 3.0 and later).
+
+The reference decoder in NatNetClient re-slices the packet for every field
+and unpacks rigid bodies and markers one element at a time. The functions
+here read every field with unpack_from() on the original receive buffer and
+decode homogeneous runs (rigid bodies, labeled markers, marker positions,
+analog channel frames) with a single precompiled struct.Struct per block.
+The result is the same MoCapData object tree the reference decoder builds.
+"""
+
+import struct
+from functools import lru_cache
+
+import MoCapData
+
+# Frame sections, in packet order
+SECTION_MARKER_SETS = "marker_sets"
+SECTION_LEGACY_MARKERS = "legacy_markers"
+SECTION_RIGID_BODIES = "rigid_bodies"
+SECTION_SKELETONS = "skeletons"
+SECTION_ASSETS = "assets"
+SECTION_LABELED_MARKERS = "labeled_markers"
+SECTION_FORCE_PLATES = "force_plates"
+SECTION_DEVICES = "devices"
+SECTION_SUFFIX = "suffix"
+
+# Scalar layouts
+IntValue = struct.Struct('<i')
+ShortValue = struct.Struct('<h')
+IdAndCount = struct.Struct('<ii')
+
+# Per element record layouts
+# id, pos(x, y, z), rot(qx, qy, qz, qw), mean error, params
+RIGID_BODY_FORMAT = 'iffffffffh'
+RigidBodyRecord = struct.Struct('<' + RIGID_BODY_FORMAT)
+# id, pos(x, y, z), size, params, residual
+MARKER_FORMAT = 'iffffhf'
+MarkerRecord = struct.Struct('<' + MARKER_FORMAT)
+
+# Frame suffix layouts
+# timecode, timecode sub, timestamp, mid exposure, data received, transmit
+SuffixRecord3 = struct.Struct('<iidqqq')
+# ... followed by precision timestamp seconds and fractional seconds
+SuffixRecord41 = struct.Struct('<iidqqqii')
+
+
+@lru_cache(maxsize=256)
+def float_block(count):
+    """Precompiled layout for a run of count floats"""
+    return struct.Struct('<%df' % count)
+
+
+@lru_cache(maxsize=256)
+def rigid_body_block(count):
+    """Precompiled layout for a run of count rigid body records"""
+    return struct.Struct('<' + RIGID_BODY_FORMAT * count)
+
+
+@lru_cache(maxsize=256)
+def marker_block(count):
+    """Precompiled layout for a run of count labeled/asset marker records"""
+    return struct.Struct('<' + MARKER_FORMAT * count)
+
+
+def has_byte_counts(major, minor):
+    """NatNet 4.1 and later prefix every frame section with its size"""
+    return (major == 4 and minor > 0) or major > 4
+
+
+def unpack_positions(data, offset, count):
+    """Returns a list of count (x, y, z) tuples and the new offset"""
+    values = float_block(3 * count).unpack_from(data, offset)
+    pos_list = list(zip(values[0::3], values[1::3], values[2::3]))
+    return pos_list, offset + 12 * count
+
+
+def unpack_rigid_bodies(data, offset, count, rigid_body_listener=None):
+    """Decodes a run of NatNet 3+ rigid bodies"""
+    values = rigid_body_block(count).unpack_from(data, offset)
+    rigid_body_list = []
+    for i in range(0, 10 * count, 10):
+        new_id = values[i]
+        pos = values[i + 1:i + 4]
+        rot = values[i + 4:i + 8]
+        rigid_body = MoCapData.RigidBody(new_id, pos, rot)
+        rigid_body.error = values[i + 8]
+        rigid_body.tracking_valid = (values[i + 9] & 0x01) != 0
+        rigid_body_list.append(rigid_body)
+        if rigid_body_listener is not None:
+            rigid_body_listener(new_id, pos, rot)
+    return rigid_body_list, offset + RigidBodyRecord.size * count
+
+
+def unpack_marker_records(data, offset, count):
+    """Returns the flat field tuple of count marker records"""
+    values = marker_block(count).unpack_from(data, offset)
+    return values, offset + MarkerRecord.size * count
+
+
+def unpack_marker_set_data(data, offset, size_fields):
+    marker_set_data = MoCapData.MarkerSetData()
+    marker_set_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    marker_data_list = marker_set_data.marker_data_list
+    for _ in range(marker_set_count):
+        name_end = data.find(b'\0', offset)
+        marker_data = MoCapData.MarkerData()
+        marker_data.set_model_name(bytes(data[offset:name_end]))
+        offset = name_end + 1
+        marker_count, = IntValue.unpack_from(data, offset)
+        offset += 4
+        if (marker_count < 0) or (marker_count > 10000):
+            print("WARNING: Early return.  Invalid marker count")
+            return len(data), marker_set_data
+        marker_data.marker_pos_list, offset = unpack_positions(
+            data, offset, marker_count)
+        marker_data_list.append(marker_data)
+    return offset, marker_set_data
+
+
+def unpack_legacy_other_markers(data, offset, size_fields):
+    other_marker_data = MoCapData.LegacyMarkerData()
+    other_marker_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    if other_marker_count > 0:
+        other_marker_data.marker_pos_list, offset = unpack_positions(
+            data, offset, other_marker_count)
+    return offset, other_marker_data
+
+
+def unpack_rigid_body_data(data, offset, size_fields,
+                           rigid_body_listener=None):
+    rigid_body_data = MoCapData.RigidBodyData()
+    rigid_body_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    rigid_body_data.rigid_body_list, offset = unpack_rigid_bodies(
+        data, offset, rigid_body_count, rigid_body_listener)
+    return offset, rigid_body_data
+
+
+def unpack_rigid_body_arrays(data, offset, size_fields, rigid_body_arrays,
+                             rigid_body_listener=None):
+    """Decodes the rigid body section into a mocap_arrays.RigidBodyArrays"""
+    rigid_body_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    offset = rigid_body_arrays.unpack_from(data, offset, rigid_body_count)
+    if rigid_body_listener is not None:
+        for rigid_body in rigid_body_arrays.rigid_body_list:
+            rigid_body_listener(rigid_body.id_num, rigid_body.pos,
+                                rigid_body.rot)
+    return offset, rigid_body_arrays
+
+
+def unpack_skeleton_data(data, offset, size_fields,
+                         rigid_body_listener=None):
+    skeleton_data = MoCapData.SkeletonData()
+    skeleton_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    for _ in range(skeleton_count):
+        new_id, rigid_body_count = IdAndCount.unpack_from(data, offset)
+        offset += 8
+        skeleton = MoCapData.Skeleton(new_id)
+        skeleton.rigid_body_list, offset = unpack_rigid_bodies(
+            data, offset, rigid_body_count, rigid_body_listener)
+        skeleton_data.skeleton_list.append(skeleton)
+    return offset, skeleton_data
+
+
+def unpack_asset_data(data, offset, size_fields):
+    asset_data = MoCapData.AssetData()
+    asset_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    for _ in range(asset_count):
+        asset = MoCapData.Asset()
+        new_id, rigid_body_count = IdAndCount.unpack_from(data, offset)
+        offset += 8
+        asset.set_id(new_id)
+
+        values = rigid_body_block(rigid_body_count).unpack_from(data, offset)
+        offset += RigidBodyRecord.size * rigid_body_count
+        for rb_num in range(rigid_body_count):
+            i = 10 * rb_num
+            rigid_body = MoCapData.AssetRigidBodyData(
+                values[i], values[i + 1:i + 4], values[i + 4:i + 8],
+                values[i + 8], values[i + 9])
+            rigid_body.rb_num = rb_num
+            asset.rigid_body_list.append(rigid_body)
+
+        marker_count, = IntValue.unpack_from(data, offset)
+        offset += 4
+        values, offset = unpack_marker_records(data, offset, marker_count)
+        for marker_num in range(marker_count):
+            i = 7 * marker_num
+            asset.marker_list.append(MoCapData.AssetMarkerData(
+                values[i], values[i + 1:i + 4], values[i + 4], values[i + 5],
+                values[i + 6], marker_num))
+        asset_data.asset_list.append(asset)
+    return offset, asset_data
+
+
+def unpack_labeled_marker_data(data, offset, size_fields):
+    labeled_marker_data = MoCapData.LabeledMarkerData()
+    labeled_marker_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    values, offset = unpack_marker_records(data, offset, labeled_marker_count)
+    labeled_marker_list = labeled_marker_data.labeled_marker_list
+    for i in range(0, 7 * labeled_marker_count, 7):
+        labeled_marker_list.append(MoCapData.LabeledMarker(
+            values[i], values[i + 1:i + 4], values[i + 4], values[i + 5],
+            values[i + 6] * 1000.0))
+    return offset, labeled_marker_data
+
+
+def unpack_channels(data, offset, channel_count, channel_class):
+    """Decodes the analog channels of a force plate or device"""
+    channel_list = []
+    for _ in range(channel_count):
+        frame_count, = IntValue.unpack_from(data, offset)
+        offset += 4
+        channel_data = channel_class()
+        channel_data.frame_list = list(
+            float_block(frame_count).unpack_from(data, offset))
+        offset += 4 * frame_count
+        channel_list.append(channel_data)
+    return offset, channel_list
+
+
+def unpack_force_plate_data(data, offset, size_fields):
+    force_plate_data = MoCapData.ForcePlateData()
+    force_plate_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    for _ in range(force_plate_count):
+        force_plate_id, channel_count = IdAndCount.unpack_from(data, offset)
+        offset += 8
+        force_plate = MoCapData.ForcePlate(force_plate_id)
+        offset, force_plate.channel_data_list = unpack_channels(
+            data, offset, channel_count, MoCapData.ForcePlateChannelData)
+        force_plate_data.force_plate_list.append(force_plate)
+    return offset, force_plate_data
+
+
+def unpack_device_data(data, offset, size_fields):
+    device_data = MoCapData.DeviceData()
+    device_count, = IntValue.unpack_from(data, offset)
+    offset += 4 + size_fields
+    for _ in range(device_count):
+        device_id, channel_count = IdAndCount.unpack_from(data, offset)
+        offset += 8
+        device = MoCapData.Device(device_id)
+        offset, device.channel_data_list = unpack_channels(
+            data, offset, channel_count, MoCapData.DeviceChannelData)
+        device_data.device_list.append(device)
+    return offset, device_data
+
+
+def unpack_frame_suffix_data(data, offset, size_fields):
+    frame_suffix_data = MoCapData.FrameSuffixData()
+    if size_fields:
+        (frame_suffix_data.timecode,
+         frame_suffix_data.timecode_sub,
+         frame_suffix_data.timestamp,
+         frame_suffix_data.stamp_camera_mid_exposure,
+         frame_suffix_data.stamp_data_received,
+         frame_suffix_data.stamp_transmit,
+         frame_suffix_data.prec_timestamp_secs,
+         frame_suffix_data.prec_timestamp_frac_secs) = \
+            SuffixRecord41.unpack_from(data, offset)
+        offset += SuffixRecord41.size
+    else:
+        (frame_suffix_data.timecode,
+         frame_suffix_data.timecode_sub,
+         frame_suffix_data.timestamp,
+         frame_suffix_data.stamp_camera_mid_exposure,
+         frame_suffix_data.stamp_data_received,
+         frame_suffix_data.stamp_transmit) = \
+            SuffixRecord3.unpack_from(data, offset)
+        offset += SuffixRecord3.size
+
+    param, = ShortValue.unpack_from(data, offset)
+    offset += 2
+    frame_suffix_data.param = param
+    frame_suffix_data.is_recording = (param & 0x01) != 0
+    frame_suffix_data.tracked_models_changed = (param & 0x02) != 0
+    return offset, frame_suffix_data
+
+
+# section name, decoder, MoCapData attribute
+FRAME_SECTIONS = (
+    (SECTION_MARKER_SETS, unpack_marker_set_data, "marker_set_data"),
+    (SECTION_LEGACY_MARKERS, unpack_legacy_other_markers,
+     "legacy_other_markers"),
+    (SECTION_RIGID_BODIES, unpack_rigid_body_data, "rigid_body_data"),
+    (SECTION_SKELETONS, unpack_skeleton_data, "skeleton_data"),
+    (SECTION_ASSETS, unpack_asset_data, "asset_data"),
+    (SECTION_LABELED_MARKERS, unpack_labeled_marker_data,
+     "labeled_marker_data"),
+    (SECTION_FORCE_PLATES, unpack_force_plate_data, "force_plate_data"),
+    (SECTION_DEVICES, unpack_device_data, "device_data"),
+    (SECTION_SUFFIX, unpack_frame_suffix_data, "suffix_data"),
+)
+SECTION_NAMES = tuple(section[0] for section in FRAME_SECTIONS)
+# sections whose rigid bodies are sent to the rigid body listener
+LISTENER_SECTIONS = (SECTION_RIGID_BODIES, SECTION_SKELETONS)
+
+
+def unpack_mocap_data(data, offset, packet_size, major, minor,
+                      rigid_body_listener=None, sections=None, frame=None):
+    """Decodes the frame of mocap data that starts at offset in data.
+
+    data must be the bytes/bytearray the packet was received into; it is
+    never copied. sections is an optional collection of SECTION_* names to
+    decode; the others are left as None on the returned frame. Unwanted
+    sections are jumped over with the NatNet 4.1+ byte counts (older
+    streams are decoded and dropped) and nothing after the last wanted
+    section is read at all.
+    frame is an optional mocap_arrays.MoCapFrame that is reset and filled
+    instead of building a new MoCapData; its rigid bodies are decoded into
+    the preallocated arrays.
+    Returns the number of bytes consumed and a MoCapData.MoCapData instance.
+    """
+    if not hasattr(data, 'find'):
+        data = bytes(data)
+    start = offset
+    size_fields = 4 if has_byte_counts(major, minor) else 0
+    remaining = None
+    if sections is not None:
+        remaining = set(sections)
+    if frame is not None:
+        frame.reset()
+        mocap_data = frame
+    else:
+        mocap_data = MoCapData.MoCapData()
+
+    frame_number, = IntValue.unpack_from(data, offset)
+    offset += 4
+    mocap_data.set_prefix_data(MoCapData.FramePrefixData(frame_number))
+
+    for name, unpack_section, attribute in FRAME_SECTIONS:
+        # Assets (Motive 3.1/NatNet 4.1 and greater)
+        if name == SECTION_ASSETS and not size_fields:
+            continue
+        if remaining is not None:
+            if not remaining:
+                # nothing wanted past this point
+                return packet_size, mocap_data
+            if name not in remaining:
+                if size_fields:
+                    # count (4 bytes), byte count (4 bytes), body
+                    size_in_bytes, = IntValue.unpack_from(data, offset + 4)
+                    offset += 8 + size_in_bytes
+                else:
+                    offset, _ = unpack_section(data, offset, size_fields)
+                continue
+            remaining.discard(name)
+
+        if name == SECTION_RIGID_BODIES and frame is not None:
+            offset, section_data = unpack_rigid_body_arrays(
+                data, offset, size_fields, frame.rigid_body_arrays,
+                rigid_body_listener)
+        elif name in LISTENER_SECTIONS:
+            offset, section_data = unpack_section(
+                data, offset, size_fields, rigid_body_listener)
+        else:
+            offset, section_data = unpack_section(data, offset, size_fields)
+        setattr(mocap_data, attribute, section_data)
+
+    return offset - start, mocap_data
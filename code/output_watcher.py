@@ -0,0 +1,203 @@
+"""
+Watches the ComfyUI output folder for new, completely written images.
+
+A background thread puts the path of every new image into a queue, the
+render loop takes them with poll() without ever blocking. Two backends:
+
+    inotify  Linux. The kernel reports IN_CLOSE_WRITE (the writer closed
+             the file, so it is complete) and IN_MOVED_TO (renamed into
+             the folder), nothing is scanned.
+    scandir  everywhere else. Rescans the folder every poll_interval but
+             only looks at names it has not seen yet; a new file is
+             reported once its size and mtime stayed the same for
+             stable_time seconds and, for PNGs, it ends with the IEND
+             chunk, so half written files are skipped.
+
+Files that already exist when the watcher starts are never reported.
+
+    watcher = OutputWatcher(COMFYUI_OUTPUT_FOLDER)
+    watcher.start()
+    ...
+    for path in watcher.poll():   # every frame
+        ...
+    watcher.stop()
+"""
+
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+DEFAULT_EXTENSIONS = (".png",)
+DEFAULT_POLL_INTERVAL = 0.05
+DEFAULT_STABLE_TIME = 0.2
+# how often the inotify thread checks for stop()
+STOP_CHECK_INTERVAL = 0.5
+
+# <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+INOTIFY_EVENT = struct.Struct("iIII")
+# last chunk of every PNG file
+PNG_END = b"IEND\xaeB`\x82"
+
+
+def is_complete(path):
+    """False for PNGs whose end is not written yet"""
+    if not path.lower().endswith(".png"):
+        return True
+    try:
+        with open(path, "rb") as image_file:
+            image_file.seek(-len(PNG_END), os.SEEK_END)
+            return image_file.read() == PNG_END
+    except OSError:
+        return False
+
+
+def inotify_available():
+    return sys.platform.startswith("linux") and \
+        ctypes.util.find_library("c") is not None
+
+
+class OutputWatcher:
+    def __init__(self, folder, extensions=DEFAULT_EXTENSIONS, use_inotify=None,
+                 poll_interval=DEFAULT_POLL_INTERVAL,
+                 stable_time=DEFAULT_STABLE_TIME):
+        self.folder = folder
+        self.extensions = tuple(extension.lower() for extension in extensions)
+        if use_inotify is None:
+            use_inotify = inotify_available()
+        self.backend = "inotify" if use_inotify else "scandir"
+        self.poll_interval = poll_interval
+        self.stable_time = stable_time
+        self.paths = queue.Queue()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.inotify_fd = None
+        # scandir backend: names already reported or there at start, and
+        # new names -> (size, mtime_ns, time first seen that way)
+        self.seen = set()
+        self.candidates = {}
+
+    def start(self):
+        if not os.path.isdir(self.folder):
+            raise FileNotFoundError("output folder %s does not exist"
+                                    % self.folder)
+        if self.backend == "inotify":
+            self.open_inotify()
+            target = self.run_inotify
+        else:
+            self.seen = {entry.name for entry in os.scandir(self.folder)}
+            target = self.run_scandir
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=target, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.inotify_fd is not None:
+            os.close(self.inotify_fd)
+            self.inotify_fd = None
+
+    def poll(self):
+        """New complete images since the last call, oldest first"""
+        paths = []
+        while True:
+            try:
+                paths.append(self.paths.get_nowait())
+            except queue.Empty:
+                return paths
+
+    def wait(self, timeout=None):
+        """Next new image, blocks up to timeout seconds, None if none came"""
+        try:
+            return self.paths.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def wanted(self, name):
+        return name.lower().endswith(self.extensions)
+
+    # ----------------------
+    # inotify
+    # ----------------------
+    def open_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(IN_CLOEXEC)
+        if fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, "inotify_init1: " + os.strerror(error))
+        watch = libc.inotify_add_watch(fd, os.fsencode(self.folder),
+                                       IN_CLOSE_WRITE | IN_MOVED_TO)
+        if watch < 0:
+            error = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(error, "inotify_add_watch: " + os.strerror(error),
+                          self.folder)
+        self.inotify_fd = fd
+
+    def run_inotify(self):
+        while not self.stop_event.is_set():
+            readable, _, _ = select.select([self.inotify_fd], [], [],
+                                           STOP_CHECK_INTERVAL)
+            if not readable:
+                continue
+            data = os.read(self.inotify_fd, 65536)
+            offset = 0
+            while offset < len(data):
+                _, mask, _, name_length = INOTIFY_EVENT.unpack_from(data,
+                                                                    offset)
+                offset += INOTIFY_EVENT.size
+                name = data[offset:offset + name_length].rstrip(b"\0")
+                offset += name_length
+                if mask & IN_Q_OVERFLOW:
+                    print("WARNING: inotify queue overflow, output images "
+                          "may have been missed")
+                    continue
+                name = os.fsdecode(name)
+                if name and self.wanted(name):
+                    self.paths.put(os.path.join(self.folder, name))
+
+    # ----------------------
+    # scandir
+    # ----------------------
+    def run_scandir(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.scan()
+            except OSError as e:
+                print("WARNING: could not scan %s: %s" % (self.folder, e))
+
+    def scan(self):
+        now = time.monotonic()
+        for entry in os.scandir(self.folder):
+            if entry.name in self.seen:
+                continue
+            if not self.wanted(entry.name):
+                self.seen.add(entry.name)
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                self.candidates.pop(entry.name, None)
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            previous = self.candidates.get(entry.name)
+            if previous is None or previous[:2] != state:
+                # new or still growing
+                self.candidates[entry.name] = state + (now,)
+            elif stat.st_size > 0 and now - previous[2] >= self.stable_time \
+                    and is_complete(entry.path):
+                del self.candidates[entry.name]
+                self.seen.add(entry.name)
+                self.paths.put(entry.path)
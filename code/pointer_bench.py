@@ -0,0 +1,100 @@
+"""
+Benchmark of the pointer ray casting in receive_new_pos.
+
+Times the pose step for one visitor (two rigid bodies) the way the app
+took it before batching (process_tracked_poses on RigidBody objects), the
+scalar path it takes now (process_tracked_positions on the frame ring
+arrays) and the batched path (pair_tracked_poses +
+process_tracked_pose_pairs), for one and for several pointers, and
+checks that they agree. The batched path through the projection surface
+registry (projection_surfaces.json) is timed as well, the app only takes
+it for surfaces other than the fixed screen and dome.
+
+    python pointer_bench.py
+"""
+
+import timeit
+
+import numpy as np
+
+import idl_helper as idl
+import MoCapData
+from projection_surfaces import load_projection_surfaces
+
+# ----------------------
+# Configuration
+# ----------------------
+POINTER_COUNTS = (1, 4, 16)
+PROJECTION_SURFACES_CONFIG = "projection_surfaces.json"
+NUMBER = 2000
+REPEAT = 5
+SEED = 1
+
+
+# ----------------------
+# Benchmark
+# ----------------------
+def random_pointers(count, rng):
+    """ids (2 * count,) and positions (2 * count, 3) of pointers aimed up
+    at the screen from inside the dome"""
+    starts = rng.uniform([-2, 1, -2], [2, 2, 0], (count, 3))
+    ends = starts - rng.uniform([-0.3, -0.5, 0.2], [0.3, 0.1, 0.5], (count, 3))
+    positions = np.stack((starts, ends), axis=1).reshape(-1, 3)
+    return np.arange(2 * count), positions
+
+
+def best_time(statement):
+    """Microseconds per call, best of REPEAT"""
+    return min(timeit.repeat(statement, number=NUMBER, repeat=REPEAT)) \
+        / NUMBER * 1e6
+
+
+def main():
+    rng = np.random.default_rng(SEED)
+    ids, positions = random_pointers(1, rng)
+    rigid_bodies = []
+    for id_num, position in zip(ids, positions):
+        rigid_bodies.append(MoCapData.RigidBody(int(id_num), position.tolist(),
+                                                [0, 0, 0, 1]))
+
+    def legacy():
+        return idl.process_tracked_poses(*rigid_bodies)
+
+    def scalar():
+        start, end = positions.tolist()
+        if ids[0] > ids[1]:
+            start, end = end, start
+        return idl.process_tracked_positions(start, end)
+
+    def batched(ids=ids, positions=positions, surfaces=None):
+        return idl.process_tracked_pose_pairs(
+            idl.pair_tracked_poses(ids, positions), surfaces)
+
+    surfaces = load_projection_surfaces(PROJECTION_SURFACES_CONFIG)
+
+    pt_screen, pt_dome, distance = scalar()
+    pts_screen, screen_hit, pts_dome, dome_hit, distances = batched()
+    assert legacy()[0] == pt_screen
+    assert screen_hit[0] and dome_hit[0]
+    assert np.allclose(pts_screen[0], pt_screen)
+    assert np.allclose(pts_dome[0], pt_dome)
+    assert np.isclose(distances[0], distance)
+    registry_hits = batched(surfaces=surfaces)
+    assert registry_hits[1][0] and registry_hits[3][0]
+    assert np.allclose(registry_hits[0][0], pt_screen)
+    assert np.allclose(registry_hits[2][0], pt_dome)
+
+    print("one pointer, microseconds per frame")
+    print("  %-34s %7.1f" % ("process_tracked_poses (before)", best_time(legacy)))
+    print("  %-34s %7.1f" % ("process_tracked_positions (now)", best_time(scalar)))
+    print("  %-34s %7.1f" % ("process_tracked_pose_pairs", best_time(batched)))
+    print("  %-34s %7.1f" % ("  with the surface registry",
+                             best_time(lambda: batched(surfaces=surfaces))))
+    for count in POINTER_COUNTS[1:]:
+        many_ids, many_positions = random_pointers(count, rng)
+        print("%d pointers, batched: %.1f" % (count, best_time(
+            lambda: batched(many_ids, many_positions))))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+"""
+Temporal filters for rigid body positions.
+
+A pose filter keeps a few numbers of state per rigid body id (rows of
+preallocated arrays) and smooths every new frame in one vectorized step:
+
+    one_euro  One Euro filter (Casiez et al. 2012), speed adaptive low pass
+    kalman    constant velocity Kalman filter, white noise acceleration
+
+Both estimate a velocity, so the output can be predicted forward by
+prediction seconds (e.g. the measured render latency) to hide pipeline
+delay. NatNetClient.set_pose_filter() runs the filter on the receive thread
+and overwrites the decoded positions in place, before the frame ring sees
+them. Rotations are passed through unfiltered.
+"""
+
+import abc
+import math
+import time
+
+import numpy as np
+
+import mocap_arrays
+
+DEFAULT_CAPACITY = 16
+# a body unseen for longer than this starts again from its raw position
+RESET_AFTER = 0.5
+
+
+class PoseFilter(abc.ABC):
+    """Per rigid body state bookkeeping shared by the filters"""
+
+    def __init__(self, prediction=0.0, reset_after=RESET_AFTER,
+                 capacity=DEFAULT_CAPACITY):
+        self.prediction = prediction
+        self.reset_after = reset_after
+        self.rows = {}
+        self.last_time = np.zeros(capacity)
+        self.position = np.zeros((capacity, 3))
+        self.velocity = np.zeros((capacity, 3))
+
+    def set_prediction(self, prediction):
+        """Seconds to extrapolate the filtered positions forward"""
+        self.prediction = max(0.0, prediction)
+
+    def get_prediction(self):
+        return self.prediction
+
+    def reset(self):
+        self.rows.clear()
+
+    def grow(self, capacity):
+        """Extra rows for the state arrays of the subclasses too"""
+        for name, value in list(vars(self).items()):
+            if isinstance(value, np.ndarray) and len(value) < capacity:
+                grown = np.zeros((capacity,) + value.shape[1:], value.dtype)
+                grown[:len(value)] = value
+                setattr(self, name, grown)
+
+    def lookup(self, ids):
+        rows = np.empty(len(ids), dtype=int)
+        for i, id_num in enumerate(ids):
+            row = self.rows.get(id_num)
+            if row is None:
+                row = len(self.rows)
+                self.rows[id_num] = row
+                # fresh rows start from their first sample
+                if row >= len(self.last_time):
+                    self.grow(2 * len(self.last_time))
+                self.last_time[row] = -math.inf
+            rows[i] = row
+        return rows
+
+    def filter(self, ids, positions, timestamp):
+        """Filtered (and predicted) (N, 3) positions of bodies ids"""
+        positions = np.asarray(positions, dtype=float)
+        rows = self.lookup([int(id_num) for id_num in ids])
+        dt = timestamp - self.last_time[rows]
+        first = ~(dt <= self.reset_after)
+        # repeated timestamps would divide by zero
+        dt = np.maximum(dt, 1e-6)
+
+        self.update(rows, positions, np.where(first, 1.0, dt), first)
+        self.last_time[rows] = timestamp
+        return self.position[rows] + self.prediction * self.velocity[rows]
+
+    @abc.abstractmethod
+    def update(self, rows, positions, dt, first):
+        """Moves position and velocity of rows towards the new positions"""
+
+    def apply(self, mocap_data, receive_time=None):
+        """Filters the rigid bodies of a decoded frame in place. Uses the
+        Motive timestamp, or the receive time if the suffix was skipped."""
+        rigid_body_data = mocap_data.rigid_body_data
+        if rigid_body_data is None:
+            return
+        if mocap_data.suffix_data is not None and \
+           mocap_data.suffix_data.timestamp > 0:
+            timestamp = mocap_data.suffix_data.timestamp
+        elif receive_time is not None:
+            timestamp = receive_time
+        else:
+            timestamp = time.perf_counter()
+
+        if isinstance(rigid_body_data, mocap_arrays.RigidBodyArrays):
+            count = rigid_body_data.count
+            if count:
+                rigid_body_data.pos[:count] = self.filter(
+                    rigid_body_data.ids[:count], rigid_body_data.pos[:count],
+                    timestamp)
+            return
+        rigid_body_list = rigid_body_data.rigid_body_list
+        if not rigid_body_list:
+            return
+        filtered = self.filter(
+            [rigid_body.id_num for rigid_body in rigid_body_list],
+            [rigid_body.pos for rigid_body in rigid_body_list], timestamp)
+        for rigid_body, pos in zip(rigid_body_list, filtered.tolist()):
+            rigid_body.pos = tuple(pos)
+
+
+def smoothing_factor(cutoff, dt):
+    tau = 1.0 / (2 * math.pi * cutoff)
+    return 1.0 / (1.0 + tau / dt)
+
+
+class OneEuroPoseFilter(PoseFilter):
+    """min_cutoff (Hz) sets the jitter reduction at rest, beta how fast
+    the cutoff opens up with speed (m/s), d_cutoff smooths the speed"""
+
+    def __init__(self, min_cutoff=1.0, beta=10.0, d_cutoff=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.min_cutoff = min_cutoff
+        self.beta = beta
+        self.d_cutoff = d_cutoff
+
+    def update(self, rows, positions, dt, first):
+        previous = self.position[rows]
+        speed = (positions - previous) / dt[:, None]
+        alpha = smoothing_factor(self.d_cutoff, dt)[:, None]
+        velocity = self.velocity[rows] + alpha * (speed - self.velocity[rows])
+
+        cutoff = self.min_cutoff + self.beta * np.linalg.norm(velocity,
+                                                              axis=1)
+        alpha = smoothing_factor(cutoff, dt)[:, None]
+        position = previous + alpha * (positions - previous)
+
+        self.position[rows] = np.where(first[:, None], positions, position)
+        self.velocity[rows] = np.where(first[:, None], 0.0, velocity)
+
+
+class KalmanPoseFilter(PoseFilter):
+    """Constant velocity model per axis. process_noise is the white noise
+    acceleration spectral density (m^2/s^3), measurement_noise the marker
+    position variance (m^2)"""
+
+    def __init__(self, process_noise=50.0, measurement_noise=1e-6,
+                 initial_velocity_variance=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.initial_velocity_variance = initial_velocity_variance
+        # covariance of (position, velocity), the same for the three axes
+        self.covariance = np.zeros((len(self.last_time), 2, 2))
+
+    def update(self, rows, positions, dt, first):
+        p = self.covariance[rows]
+        q = self.process_noise
+
+        # predict
+        position = self.position[rows] + dt[:, None] * self.velocity[rows]
+        velocity = self.velocity[rows]
+        p00 = p[:, 0, 0] + dt * (2 * p[:, 0, 1] + dt * p[:, 1, 1]) + \
+            q * dt ** 3 / 3
+        p01 = p[:, 0, 1] + dt * p[:, 1, 1] + q * dt ** 2 / 2
+        p11 = p[:, 1, 1] + q * dt
+
+        # correct with the measured position
+        s = p00 + self.measurement_noise
+        k0 = (p00 / s)[:, None]
+        k1 = (p01 / s)[:, None]
+        innovation = positions - position
+        position = position + k0 * innovation
+        velocity = velocity + k1 * innovation
+        p[:, 0, 0] = (1 - k0[:, 0]) * p00
+        p[:, 0, 1] = p[:, 1, 0] = (1 - k0[:, 0]) * p01
+        p[:, 1, 1] = p11 - k1[:, 0] * p01
+
+        # first sample: position known, velocity unknown
+        p[first] = [[self.measurement_noise, 0],
+                    [0, self.initial_velocity_variance]]
+        self.covariance[rows] = p
+        self.position[rows] = np.where(first[:, None], positions, position)
+        self.velocity[rows] = np.where(first[:, None], 0.0, velocity)
+
+
+FILTER_TYPES = {
+    "one_euro": OneEuroPoseFilter,
+    "kalman": KalmanPoseFilter,
+}
+
+
+def make_pose_filter(kind, **params):
+    if kind not in FILTER_TYPES:
+        raise ValueError("unknown pose filter '%s'" % kind)
+    return FILTER_TYPES[kind](**params)
@@ -0,0 +1,484 @@
+"""
+Registry of projection surfaces for pointer ray casting.
+
+idl_helper.process_tracked_poses intersects one hard-coded plane and dome.
+ProjectionSurfaces holds any number of named surfaces loaded from a JSON
+file (see projection_surfaces.json):
+
+    plane     point, normal, u_axis, u_range, v_range[, clamp]
+              a rectangle; with "clamp" the plane is unbounded and the
+              local coordinates are clamped to the ranges (screen_boundary)
+    sphere    center, radius[, up, closed]; with "up" only that hemisphere
+              (dome). A closed dome still has the other half in the way:
+              a ray crossing it first misses, as in process_tracked_poses
+    cylinder  base, axis, radius, height; the side wall only
+    mesh      triangles [[[x, y, z] * 3], ...] or obj (path of a .obj file)
+
+All coordinates are in the remapped IDL frame (idl_helper.idl_remap).
+Bounded surface elements (mesh triangles included) are put in a bounding
+volume hierarchy; cast() walks it for all rays at once, so the cost grows
+with the depth of the tree rather than with the number of triangles.
+Unbounded elements (clamped planes) are tested for every ray. With
+separate=True cast() returns the nearest hit on each surface instead of
+the nearest overall, still from one walk.
+"""
+
+import json
+import os
+
+import numpy as np
+
+BVH_LEAF_SIZE = 16
+# smallest ray parameter counted as a hit
+EPSILON = 1e-9
+
+
+def normalized(vector):
+    vector = np.asarray(vector, dtype=float)
+    return vector / np.linalg.norm(vector)
+
+
+def row_dot(a, b):
+    return (a * b).sum(axis=-1)
+
+
+def perpendicular_frame(axis):
+    """Two unit vectors completing axis to an orthonormal frame"""
+    helper = np.array([1.0, 0, 0])
+    if abs(np.dot(helper, axis)) > 0.9:
+        helper = np.array([0, 1.0, 0])
+    ref = normalized(helper - np.dot(helper, axis) * axis)
+    return ref, np.cross(axis, ref)
+
+
+class PlaneSurface:
+    """Rectangle point + u * u_axis + v * v_axis, u/v within the ranges"""
+
+    def __init__(self, name, point, normal, u_axis, u_range, v_range,
+                 clamp=False):
+        self.name = name
+        self.point = np.asarray(point, dtype=float)
+        self.normal = normalized(normal)
+        # u_axis projected into the plane, v_axis completes the frame
+        u_axis = np.asarray(u_axis, dtype=float)
+        self.u_axis = normalized(u_axis - np.dot(u_axis, self.normal) *
+                                 self.normal)
+        self.v_axis = np.cross(self.normal, self.u_axis)
+        self.u_range = tuple(u_range)
+        self.v_range = tuple(v_range)
+        self.clamp = clamp
+
+    def element_count(self):
+        return 1
+
+    def element_bounds(self):
+        if self.clamp:
+            return np.full((1, 3), -np.inf), np.full((1, 3), np.inf)
+        corners = np.array([self.point + u * self.u_axis + v * self.v_axis
+                            for u in self.u_range for v in self.v_range])
+        return corners.min(axis=0)[None], corners.max(axis=0)[None]
+
+    def intersect(self, elements, origins, directions):
+        dot_products = directions @ self.normal
+        not_parallel = np.abs(dot_products) > 1e-8
+        t = np.divide((self.point - origins) @ self.normal, dot_products,
+                      out=np.full_like(dot_products, np.inf),
+                      where=not_parallel)
+        t[t < EPSILON] = np.inf
+
+        offsets = origins + np.where(np.isfinite(t), t, 0)[:, None] * \
+            directions - self.point
+        local = np.stack((offsets @ self.u_axis, offsets @ self.v_axis),
+                         axis=1)
+        low = (self.u_range[0], self.v_range[0])
+        high = (self.u_range[1], self.v_range[1])
+        if self.clamp:
+            local = np.clip(local, low, high)
+        else:
+            inside = np.all((local >= low) & (local <= high), axis=1)
+            t[~inside] = np.inf
+        return t, local, np.zeros(len(t), dtype=int)
+
+
+class SphereSurface:
+    """Sphere, or with up the hemisphere (dome) on that side"""
+
+    def __init__(self, name, center, radius, up=None, closed=False):
+        self.name = name
+        self.center = np.asarray(center, dtype=float)
+        self.radius = float(radius)
+        self.up = None if up is None else normalized(up)
+        self.closed = closed
+        # pole and reference direction of the local angles
+        self.pole = np.array([0, 0, 1.0]) if up is None else self.up
+        self.ref, self.ref2 = perpendicular_frame(self.pole)
+
+    def element_count(self):
+        return 1
+
+    def element_bounds(self):
+        return (self.center - self.radius)[None], \
+            (self.center + self.radius)[None]
+
+    def accept(self, origins, directions, t):
+        if self.up is None:
+            return np.isfinite(t)
+        points = origins + np.where(np.isfinite(t), t, 0)[:, None] * \
+            directions
+        return np.isfinite(t) & ((points - self.center) @ self.up >= 0)
+
+    def intersect(self, elements, origins, directions):
+        # directions are unit length, a = 1
+        oc = origins - self.center
+        b = row_dot(oc, directions)
+        c = row_dot(oc, oc) - self.radius ** 2
+        discriminant = b ** 2 - c
+        root = np.sqrt(np.maximum(discriminant, 0))
+        missed = discriminant < 0
+
+        # nearest root on the (hemi)sphere in front of the origin
+        t = np.full(len(origins), np.inf)
+        for t_root in (-b + root, -b - root):
+            t_root = np.where(missed | (t_root < EPSILON), np.inf, t_root)
+            if self.closed:
+                t = np.minimum(t, t_root)
+            else:
+                valid = self.accept(origins, directions, t_root)
+                t = np.where(valid & (t_root < t), t_root, t)
+        if self.closed:
+            # the nearest crossing of the whole sphere, if on the dome
+            t = np.where(self.accept(origins, directions, t), t, np.inf)
+
+        to_points = origins + np.where(np.isfinite(t), t, 0)[:, None] * \
+            directions - self.center
+        # azimuth, elevation about the pole
+        local = np.stack((np.arctan2(to_points @ self.ref2,
+                                     to_points @ self.ref),
+                          np.arcsin(np.clip(to_points @ self.pole /
+                                            self.radius, -1, 1))), axis=1)
+        return t, local, np.zeros(len(t), dtype=int)
+
+
+class CylinderSurface:
+    """Side wall of a cylinder from base along axis for height"""
+
+    def __init__(self, name, base, axis, radius, height):
+        self.name = name
+        self.base = np.asarray(base, dtype=float)
+        self.axis = normalized(axis)
+        self.radius = float(radius)
+        self.height = float(height)
+        # reference direction for the angle around the axis
+        self.ref, self.ref2 = perpendicular_frame(self.axis)
+
+    def element_count(self):
+        return 1
+
+    def element_bounds(self):
+        top = self.base + self.height * self.axis
+        # extent of the end circles along each world axis
+        extent = self.radius * np.sqrt(np.maximum(1 - self.axis ** 2, 0))
+        low = np.minimum(self.base, top) - extent
+        high = np.maximum(self.base, top) + extent
+        return low[None], high[None]
+
+    def intersect(self, elements, origins, directions):
+        # components perpendicular to the axis
+        oc = origins - self.base
+        d_perp = directions - (directions @ self.axis)[:, None] * self.axis
+        oc_perp = oc - (oc @ self.axis)[:, None] * self.axis
+        a = row_dot(d_perp, d_perp)
+        b = row_dot(oc_perp, d_perp)
+        c = row_dot(oc_perp, oc_perp) - self.radius ** 2
+        discriminant = b ** 2 - a * c
+        root = np.sqrt(np.maximum(discriminant, 0))
+        usable = (discriminant >= 0) & (a > 1e-12)
+        safe_a = np.where(usable, a, 1.0)
+
+        t = np.full(len(origins), np.inf)
+        for t_root in ((-b + root) / safe_a, (-b - root) / safe_a):
+            heights = (oc + t_root[:, None] * directions) @ self.axis
+            valid = usable & (t_root >= EPSILON) & (heights >= 0) & \
+                (heights <= self.height)
+            t = np.where(valid & (t_root < t), t_root, t)
+
+        offsets = oc + np.where(np.isfinite(t), t, 0)[:, None] * directions
+        # arc length, height
+        local = np.stack((self.radius * np.arctan2(offsets @ self.ref2,
+                                                   offsets @ self.ref),
+                          offsets @ self.axis), axis=1)
+        return t, local, np.zeros(len(t), dtype=int)
+
+
+class MeshSurface:
+    """Triangle mesh, every triangle is a separate element"""
+
+    def __init__(self, name, triangles):
+        self.name = name
+        self.triangles = np.asarray(triangles, dtype=float).reshape(-1, 3, 3)
+
+    def element_count(self):
+        return len(self.triangles)
+
+    def element_bounds(self):
+        return self.triangles.min(axis=1), self.triangles.max(axis=1)
+
+    def intersect(self, elements, origins, directions):
+        """Moeller-Trumbore, rays x elements; local = barycentric (u, v)"""
+        elements = np.asarray(elements)
+        triangles = self.triangles[elements]
+        v0 = triangles[:, 0]
+        edge1 = triangles[:, 1] - v0
+        edge2 = triangles[:, 2] - v0
+        # (rays, triangles, 3)
+        p = np.cross(directions[:, None], edge2[None])
+        det = row_dot(p, edge1[None])
+        usable = np.abs(det) > 1e-12
+        inv_det = np.divide(1.0, det, out=np.zeros_like(det), where=usable)
+        s = origins[:, None] - v0[None]
+        u = row_dot(s, p) * inv_det
+        q = np.cross(s, edge1[None])
+        v = row_dot(directions[:, None], q) * inv_det
+        t = row_dot(q, edge2[None]) * inv_det
+        valid = usable & (u >= 0) & (v >= 0) & (u + v <= 1) & (t >= EPSILON)
+        t = np.where(valid, t, np.inf)
+
+        nearest = np.argmin(t, axis=1)
+        rows = np.arange(len(origins))
+        local = np.stack((u[rows, nearest], v[rows, nearest]), axis=1)
+        return t[rows, nearest], local, elements[nearest]
+
+
+def load_obj_triangles(path):
+    """Triangles of a Wavefront .obj file, polygons are fanned"""
+    vertices = []
+    triangles = []
+    with open(path) as obj_file:
+        for line in obj_file:
+            fields = line.split()
+            if not fields:
+                continue
+            if fields[0] == "v":
+                vertices.append([float(value) for value in fields[1:4]])
+            elif fields[0] == "f":
+                # "f 1/1/1 2/2/2 3/3/3", 1 based, negative = relative
+                indices = [int(field.split("/")[0]) for field in fields[1:]]
+                indices = [i - 1 if i > 0 else len(vertices) + i
+                           for i in indices]
+                for i in range(1, len(indices) - 1):
+                    triangles.append([vertices[indices[0]],
+                                      vertices[indices[i]],
+                                      vertices[indices[i + 1]]])
+    return triangles
+
+
+SURFACE_TYPES = {
+    "plane": PlaneSurface,
+    "sphere": SphereSurface,
+    "dome": SphereSurface,
+    "cylinder": CylinderSurface,
+    "mesh": MeshSurface,
+}
+
+
+def surface_from_config(config, base_folder="."):
+    config = dict(config)
+    surface_type = config.pop("type")
+    if surface_type not in SURFACE_TYPES:
+        raise ValueError("unknown projection surface type '%s'"
+                         % surface_type)
+    if surface_type == "mesh" and "obj" in config:
+        config["triangles"] = load_obj_triangles(
+            os.path.join(base_folder, config.pop("obj")))
+    return SURFACE_TYPES[surface_type](**config)
+
+
+class SurfaceHits:
+    """Nearest hit per ray. surface is -1 (and t inf, point NaN) for
+    misses, local holds the surface coordinates of the hit"""
+
+    def __init__(self, ray_count):
+        self.t = np.full(ray_count, np.inf)
+        self.surface = np.full(ray_count, -1, dtype=int)
+        self.element = np.full(ray_count, -1, dtype=int)
+        self.local = np.full((ray_count, 2), np.nan)
+        self.points = np.full((ray_count, 3), np.nan)
+
+    @property
+    def hit(self):
+        return self.surface >= 0
+
+    def update(self, rays, surface_index, elements, t, local):
+        closer = t < self.t[rays]
+        rays = rays[closer]
+        self.t[rays] = t[closer]
+        self.surface[rays] = surface_index
+        self.element[rays] = elements[closer]
+        self.local[rays] = local[closer]
+
+
+class ProjectionSurfaces:
+    def __init__(self, surfaces):
+        self.surfaces = list(surfaces)
+        self.names = [surface.name for surface in self.surfaces]
+        self.__build()
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def __getitem__(self, name):
+        return self.surfaces[self.index(name)]
+
+    # ----------------------
+    # BVH
+    # ----------------------
+    def __build(self):
+        # one row per surface element
+        surface_ids, element_ids, lows, highs = [], [], [], []
+        for surface_index, surface in enumerate(self.surfaces):
+            low, high = surface.element_bounds()
+            surface_ids.append(np.full(len(low), surface_index))
+            element_ids.append(np.arange(len(low)))
+            lows.append(low)
+            highs.append(high)
+        if self.surfaces:
+            surface_ids = np.concatenate(surface_ids)
+            element_ids = np.concatenate(element_ids)
+            lows = np.concatenate(lows)
+            highs = np.concatenate(highs)
+        else:
+            surface_ids = element_ids = np.zeros(0, dtype=int)
+            lows = highs = np.zeros((0, 3))
+
+        bounded = np.all(np.isfinite(lows) & np.isfinite(highs), axis=1)
+        self.unbounded = np.flatnonzero(~bounded)
+        bounded = np.flatnonzero(bounded)
+
+        self.element_surface = surface_ids
+        self.element_index = element_ids
+        # flat node arrays, children of an inner node, leaf element range
+        self.node_low, self.node_high = [], []
+        self.node_children, self.node_elements = [], []
+        self.leaf_order = []
+        if len(bounded):
+            centroids = np.zeros_like(lows)
+            centroids[bounded] = (lows[bounded] + highs[bounded]) / 2
+            self.__build_node(bounded, lows, highs, centroids)
+        self.node_low = np.array(self.node_low).reshape(-1, 3)
+        self.node_high = np.array(self.node_high).reshape(-1, 3)
+
+    def __build_node(self, elements, lows, highs, centroids):
+        node = len(self.node_low)
+        self.node_low.append(lows[elements].min(axis=0))
+        self.node_high.append(highs[elements].max(axis=0))
+        self.node_children.append(None)
+        self.node_elements.append(None)
+        if len(elements) <= BVH_LEAF_SIZE:
+            self.node_elements[node] = elements
+            return node
+        # median split along the widest centroid axis
+        spread = np.ptp(centroids[elements], axis=0)
+        order = np.argsort(centroids[elements, np.argmax(spread)],
+                           kind="stable")
+        half = len(elements) // 2
+        left = self.__build_node(elements[order[:half]], lows, highs,
+                                 centroids)
+        right = self.__build_node(elements[order[half:]], lows, highs,
+                                  centroids)
+        self.node_children[node] = (left, right)
+        return node
+
+    # ----------------------
+    # Ray casting
+    # ----------------------
+    def distance(self, node, point):
+        closest = np.clip(point, self.node_low[node], self.node_high[node])
+        return np.linalg.norm(closest - point)
+
+    def __intersect_elements(self, targets, rays, elements, origins,
+                             directions, enabled):
+        elements = elements[enabled[self.element_surface[elements]]]
+        for surface_index in np.unique(self.element_surface[elements]):
+            surface_elements = self.element_index[
+                elements[self.element_surface[elements] == surface_index]]
+            t, local, hit_elements = self.surfaces[surface_index].intersect(
+                surface_elements, origins[rays], directions[rays])
+            targets[surface_index].update(rays, surface_index, hit_elements,
+                                          t, local)
+
+    def cast(self, origins, directions, names=None, separate=False):
+        """Nearest hit of every ray (origins, directions: (N, 3)) on the
+        surfaces, or only on the named ones. Returns a SurfaceHits, with
+        separate=True a {name: SurfaceHits} of the nearest hit on each."""
+        origins = np.atleast_2d(np.asarray(origins, dtype=float))
+        directions = np.atleast_2d(np.asarray(directions, dtype=float))
+        directions = directions / np.linalg.norm(directions, axis=1,
+                                                 keepdims=True)
+        enabled = np.ones(len(self.surfaces), dtype=bool)
+        if names is not None:
+            enabled[:] = False
+            enabled[[self.index(name) for name in names]] = True
+        if separate:
+            targets = [SurfaceHits(len(origins)) for _ in self.surfaces]
+            searched = [targets[i] for i in np.flatnonzero(enabled)]
+        else:
+            hits = SurfaceHits(len(origins))
+            targets = [hits] * len(self.surfaces)
+            searched = [hits]
+
+        all_rays = np.arange(len(origins))
+        if len(self.unbounded):
+            self.__intersect_elements(targets, all_rays, self.unbounded,
+                                      origins, directions, enabled)
+
+        if len(self.node_low):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                inverse = 1.0 / directions
+            stack = [(0, all_rays)]
+            while stack:
+                node, rays = stack.pop()
+                # slab test, skipping boxes behind the best hit so far
+                t0 = (self.node_low[node] - origins[rays]) * inverse[rays]
+                t1 = (self.node_high[node] - origins[rays]) * inverse[rays]
+                t_near = np.nanmax(np.minimum(t0, t1), axis=1)
+                t_far = np.nanmin(np.maximum(t0, t1), axis=1)
+                # a box is only skipped once every searched surface has
+                # a hit in front of it
+                best_t = searched[0].t[rays]
+                for surface_hits in searched[1:]:
+                    best_t = np.maximum(best_t, surface_hits.t[rays])
+                inside = (t_far >= np.maximum(t_near, 0)) & \
+                    (t_near <= best_t)
+                rays = rays[inside]
+                if len(rays) == 0:
+                    continue
+                if self.node_elements[node] is not None:
+                    self.__intersect_elements(
+                        targets, rays, self.node_elements[node], origins,
+                        directions, enabled)
+                else:
+                    # nearer child on top of the stack, so its hits can
+                    # prune the other one
+                    left, right = self.node_children[node]
+                    center = origins[rays].mean(axis=0)
+                    if self.distance(left, center) < \
+                       self.distance(right, center):
+                        left, right = right, left
+                    stack.append((left, rays))
+                    stack.append((right, rays))
+
+        for surface_hits in searched:
+            hit = surface_hits.hit
+            surface_hits.points[hit] = origins[hit] + \
+                surface_hits.t[hit, None] * directions[hit]
+        if separate:
+            return {self.names[i]: targets[i] for i in np.flatnonzero(enabled)}
+        return hits
+
+
+def load_projection_surfaces(path):
+    with open(path) as config_file:
+        config = json.load(config_file)
+    base_folder = os.path.dirname(os.path.abspath(path))
+    return ProjectionSurfaces(surface_from_config(surface_config, base_folder)
+                              for surface_config in config["surfaces"])
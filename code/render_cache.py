@@ -0,0 +1,261 @@
+"""
+Cache of generated renders, so a café placed where an earlier visitor put
+it shows its image at once instead of running Stable Diffusion again.
+
+An entry is found by
+    key    hash of the quantized café configuration (frozen x, y, size),
+           grid seed, workflow and styling reference hashes (make_key)
+    phash  64 bit difference hash of the screenshot (perceptual_hash);
+           a lookup matches the entry of the same key with the closest
+           phash within max_distance differing bits
+and stored on disk as <folder>/<key>_<phash>.png. The folder is bounded
+to max_bytes, the least recently used files go first; it is re-indexed
+from the file names on start, so the cache survives restarts.
+
+TextureCache keeps the GL textures of the last few images, a hit on one of
+those skips decoding as well. CachedGenerator wraps a render_jobs
+generator with the cache.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+import pygame
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+DEFAULT_MAX_DISTANCE = 6
+DEFAULT_QUANTUM = 0.5
+DEFAULT_TEXTURE_CAPACITY = 8
+HASH_SIZE = 8
+
+
+# ----------------------
+# Keys
+# ----------------------
+def file_hash(path):
+    """Short content hash of a file, "missing" if it does not exist"""
+    try:
+        with open(path, "rb") as hashed_file:
+            return hashlib.sha256(hashed_file.read()).hexdigest()[:16]
+    except FileNotFoundError:
+        return "missing"
+
+
+def make_key(x, y, size, grid_seed, workflow_hash, reference_hash,
+             quantum=DEFAULT_QUANTUM):
+    """Hex key of a café configuration, positions and size rounded to
+    quantum"""
+    values = [round(value / quantum) for value in (x, y, size)]
+    values += [grid_seed, workflow_hash, reference_hash]
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()[:24]
+
+
+def perceptual_hash(pixels, hash_size=HASH_SIZE):
+    """Difference hash of an RGB(A) array: every bit tells whether a cell
+    of a (hash_size, hash_size + 1) grid of mean brightness is brighter
+    than its left neighbour"""
+    gray = pixels[..., :3].astype(np.float32) @ np.array(
+        [0.299, 0.587, 0.114], dtype=np.float32)
+    height, width = gray.shape
+    row_edges = np.linspace(0, height, hash_size + 1).astype(int)[:-1]
+    column_edges = np.linspace(0, width, hash_size + 2).astype(int)[:-1]
+    cells = np.add.reduceat(np.add.reduceat(gray, row_edges, axis=0),
+                            column_edges, axis=1)
+    counts = np.outer(np.diff(np.append(row_edges, height)),
+                      np.diff(np.append(column_edges, width)))
+    means = cells / counts
+    bits = (means[:, 1:] > means[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count("1")
+
+
+def image_pixels(image):
+    """RGBA array of an image file, or the array itself"""
+    if isinstance(image, np.ndarray):
+        return image
+    surface = pygame.image.load(image)
+    width, height = surface.get_size()
+    return np.frombuffer(pygame.image.tostring(surface, "RGBA"),
+                         dtype=np.uint8).reshape(height, width, 4)
+
+
+# ----------------------
+# Caches
+# ----------------------
+class TextureCache:
+    """The last capacity textures by name, delete(texture) frees evicted
+    ones. put() and delete run on the render thread; keep capacity >= 2
+    so the texture on screen is never the one evicted."""
+
+    def __init__(self, delete, capacity=DEFAULT_TEXTURE_CAPACITY):
+        self.delete = delete
+        self.capacity = max(2, capacity)
+        self.textures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __contains__(self, name):
+        with self.lock:
+            return name in self.textures
+
+    def get(self, name):
+        with self.lock:
+            texture = self.textures.get(name)
+            if texture is not None:
+                self.textures.move_to_end(name)
+            return texture
+
+    def put(self, name, texture):
+        with self.lock:
+            self.textures[name] = texture
+            self.textures.move_to_end(name)
+            evicted = []
+            while len(self.textures) > self.capacity:
+                evicted.append(self.textures.popitem(last=False)[1])
+        for old_texture in evicted:
+            self.delete(old_texture)
+
+    def clear(self):
+        with self.lock:
+            textures = list(self.textures.values())
+            self.textures.clear()
+        for texture in textures:
+            self.delete(texture)
+
+
+class RenderCache:
+    def __init__(self, folder, max_bytes=DEFAULT_MAX_BYTES,
+                 max_distance=DEFAULT_MAX_DISTANCE, textures=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.max_distance = max_distance
+        self.textures = textures
+        self.lock = threading.Lock()
+        # key -> {phash: path}, path -> (size, last use)
+        self.index = {}
+        self.files = {}
+        self.total_bytes = 0
+        self.hit_count = 0
+        self.miss_count = 0
+        os.makedirs(folder, exist_ok=True)
+        self.load()
+
+    def __contains__(self, key):
+        """True if any image of the café configuration key is cached"""
+        with self.lock:
+            return bool(self.index.get(key))
+
+    def load(self):
+        for entry in os.scandir(self.folder):
+            name, extension = os.path.splitext(entry.name)
+            key, _, phash = name.partition("_")
+            if extension != ".png" or not phash:
+                continue
+            try:
+                phash = int(phash, 16)
+            except ValueError:
+                continue
+            stat = entry.stat()
+            self.add(key, phash, entry.path, stat.st_size, stat.st_mtime)
+        self.evict()
+
+    def add(self, key, phash, path, size, last_use):
+        self.index.setdefault(key, {})[phash] = path
+        self.files[path] = (size, last_use)
+        self.total_bytes += size
+
+    def lookup(self, key, phash):
+        """Path of the closest cached image, None on a miss"""
+        with self.lock:
+            entries = self.index.get(key, {})
+            best = min(entries, default=None,
+                       key=lambda cached: hamming_distance(cached, phash))
+            if best is None or \
+               hamming_distance(best, phash) > self.max_distance:
+                self.miss_count += 1
+                return None
+            self.hit_count += 1
+            path = entries[best]
+            now = time.time()
+            self.files[path] = (self.files[path][0], now)
+        try:
+            # the last use survives restarts as the mtime
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return path
+
+    def store(self, key, phash, image_data):
+        """Writes the image bytes, returns their path"""
+        path = os.path.join(self.folder, "%s_%016x.png" % (key, phash))
+        temp_path = path + ".tmp"
+        with open(temp_path, "wb") as image_file:
+            image_file.write(image_data)
+        os.replace(temp_path, path)
+        with self.lock:
+            if path in self.files:
+                self.total_bytes -= self.files[path][0]
+            self.add(key, phash, path, len(image_data), time.time())
+            self.evict()
+        return path
+
+    def evict(self):
+        """Removes least recently used files until max_bytes fits"""
+        while self.total_bytes > self.max_bytes and len(self.files) > 1:
+            path = min(self.files, key=lambda cached: self.files[cached][1])
+            size, _ = self.files.pop(path)
+            self.total_bytes -= size
+            key, _, phash = os.path.basename(path)[:-4].partition("_")
+            self.index.get(key, {}).pop(int(phash, 16), None)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class CachedGenerator:
+    """render_jobs generator that answers from the cache when it can.
+
+    Jobs without a cache_key go straight to generator. On a hit the job
+    gets cache_hit = True and cache_path, and skips decoding if the
+    texture is still in the cache's TextureCache. Images are only stored
+    if generator is cacheable."""
+
+    def __init__(self, generator, cache):
+        self.generator = generator
+        self.cache = cache
+
+    def __call__(self, job, timeout):
+        if job.cache_key is None:
+            return self.generator(job, timeout)
+        phash = perceptual_hash(image_pixels(job.screenshot))
+        cached_path = self.cache.lookup(job.cache_key, phash)
+        if cached_path is not None:
+            job.cache_hit = True
+            job.cache_path = cached_path
+            if self.cache.textures is not None and \
+               cached_path in self.cache.textures:
+                job.decode_needed = False
+            return cached_path
+
+        image = self.generator(job, timeout)
+        if image is None or job.cancel_requested or \
+           not getattr(self.generator, "cacheable", False):
+            return image
+        if isinstance(image, str):
+            with open(image, "rb") as image_file:
+                image_data = image_file.read()
+        else:
+            image_data = image
+        try:
+            job.cache_path = self.cache.store(job.cache_key, phash, image_data)
+        except OSError as e:
+            print("WARNING: could not cache the render: %s" % e)
+        return image
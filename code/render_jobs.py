@@ -0,0 +1,270 @@
+"""
+Background render jobs: screenshot in, generated image out.
+
+The render loop submits a job per saved screenshot and polls for finished
+jobs once per frame; everything slow (waiting for the generated image,
+decoding it) runs on one worker thread, so the loop keeps its frame rate.
+
+    queued -> generating -> decoding -> ready
+                        \\-> failed / timed_out / cancelled
+
+A job's screenshot is a file path or an RGBA pixel array. A generator
+produces the image for a job: generator(job, timeout) returns the path or
+the bytes of the image, or None on timeout. FolderGenerator waits for the
+next image an output_watcher.OutputWatcher reports, ComfyUIGenerator runs
+the workflow through the ComfyUI API (comfyui_client), MockGenerator
+returns a fixed image after a delay. A generator's cacheable is True if
+its image surely belongs to the job, only those go into render_cache.
+Decoding turns the image into RGBA
+bytes, bottom row first, ready for glTexImage2D on the render thread.
+
+Jobs run by priority, then in submit order: a speculative job
+(PRIORITY_SPECULATIVE) never delays one the visitor is waiting for.
+
+    jobs = RenderJobManager(FolderGenerator(watcher), timeout=30)
+    jobs.start()
+    jobs.submit("screenshot/screenshot.png")     # any thread
+    for job in jobs.poll():                      # every frame
+        if job.state == READY:
+            texture_from_pixels(job.pixels, *job.size)
+"""
+
+import io
+import itertools
+import queue
+import threading
+import time
+
+import pygame
+
+from image_encoder import encode_png, write_image
+
+QUEUED = "queued"
+GENERATING = "generating"
+DECODING = "decoding"
+READY = "ready"
+FAILED = "failed"
+TIMED_OUT = "timed_out"
+CANCELLED = "cancelled"
+FINAL_STATES = (READY, FAILED, TIMED_OUT, CANCELLED)
+
+# lower runs first
+PRIORITY_NORMAL = 0
+PRIORITY_SPECULATIVE = 1
+
+DEFAULT_TIMEOUT = 30.0
+# zlib level of screenshots uploaded to ComfyUI, fast beats small locally
+UPLOAD_COMPRESS_LEVEL = 1
+# how often a waiting generator checks for cancellation
+CANCEL_CHECK_INTERVAL = 0.1
+
+
+class RenderJob:
+    def __init__(self, job_id, screenshot, cache_key=None,
+                 priority=PRIORITY_NORMAL):
+        self.job_id = job_id
+        self.screenshot = screenshot
+        self.priority = priority
+        # render_cache: key of the café configuration, whether the image
+        # came from the cache and where it is stored
+        self.cache_key = cache_key
+        self.cache_hit = False
+        self.cache_path = None
+        # False if the image is still on the GPU, pixels stays None
+        self.decode_needed = True
+        self.state = QUEUED
+        # time.time() each state was entered
+        self.times = {QUEUED: time.time()}
+        self.image_path = None
+        self.pixels = None
+        self.size = None
+        self.error = None
+        self.cancel_requested = False
+
+    def set_state(self, state):
+        self.state = state
+        self.times[state] = time.time()
+
+    @property
+    def done(self):
+        return self.state in FINAL_STATES
+
+    @property
+    def speculative(self):
+        return self.priority == PRIORITY_SPECULATIVE
+
+    def elapsed(self):
+        """Seconds from submit to the current state"""
+        return self.times[self.state] - self.times[QUEUED]
+
+
+def decode_image(image):
+    """(RGBA bytes bottom row first, (width, height)) of an image file or
+    the bytes of one"""
+    if isinstance(image, bytes):
+        image = pygame.image.load(io.BytesIO(image), "image.png")
+    else:
+        image = pygame.image.load(image)
+    return pygame.image.tostring(image, "RGBA", True), image.get_size()
+
+
+class FolderGenerator:
+    """The next image the watcher reports after the job started. Pixel
+    screenshots are first written to screenshot_path, where ComfyUI picks
+    them up. The image can't be tied to the job: a late one of a cancelled
+    job is taken for the next."""
+
+    cacheable = False
+
+    def __init__(self, watcher, screenshot_path=None):
+        self.watcher = watcher
+        self.screenshot_path = screenshot_path
+
+    def __call__(self, job, timeout):
+        # anything that arrived before belongs to an older screenshot
+        self.watcher.poll()
+        if self.screenshot_path is not None and \
+           not isinstance(job.screenshot, str):
+            write_image(job.screenshot, self.screenshot_path)
+        deadline = time.time() + timeout
+        while not job.cancel_requested:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            image_path = self.watcher.wait(min(remaining, CANCEL_CHECK_INTERVAL))
+            if image_path is not None:
+                return image_path
+        return None
+
+
+class ComfyUIGenerator:
+    """The first image workflow saves for the job's screenshot"""
+
+    cacheable = True
+
+    def __init__(self, client, workflow, input_node=None):
+        self.client = client
+        self.workflow = workflow
+        self.input_node = input_node
+
+    def __call__(self, job, timeout):
+        if isinstance(job.screenshot, str):
+            with open(job.screenshot, "rb") as screenshot_file:
+                image_data = screenshot_file.read()
+        else:
+            image_data = encode_png(job.screenshot, UPLOAD_COMPRESS_LEVEL)
+        return self.client.generate(
+            self.workflow, image_data, timeout, self.input_node,
+            cancelled=lambda: job.cancel_requested)
+
+
+class MockGenerator:
+    cacheable = True
+
+    def __init__(self, image_path, delay=1.0):
+        self.image_path = image_path
+        self.delay = delay
+
+    def __call__(self, job, timeout):
+        if self.delay > timeout:
+            time.sleep(timeout)
+            return None
+        time.sleep(self.delay)
+        return self.image_path
+
+
+class RenderJobManager:
+    def __init__(self, generator, timeout=DEFAULT_TIMEOUT, decode=decode_image):
+        self.generator = generator
+        self.timeout = timeout
+        self.decode = decode
+        self.job_ids = itertools.count(1)
+        # (priority, job id, job), None as the job stops the worker
+        self.jobs = queue.PriorityQueue()
+        self.finished = queue.Queue()
+        self.lock = threading.Lock()
+        self.active = {}
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.cancel_all()
+        if self.thread is not None:
+            self.jobs.put((PRIORITY_NORMAL - 1, 0, None))
+            self.thread.join()
+            self.thread = None
+
+    def submit(self, screenshot, cache_key=None, priority=PRIORITY_NORMAL):
+        """Queues a job for a screenshot file or pixel array, from any
+        thread"""
+        job = RenderJob(next(self.job_ids), screenshot, cache_key, priority)
+        with self.lock:
+            self.active[job.job_id] = job
+        self.jobs.put((priority, job.job_id, job))
+        return job
+
+    def cancel(self, job):
+        """Drops job if it isn't finished yet"""
+        job.cancel_requested = True
+
+    def cancel_all(self):
+        """Drops every unfinished job, poll() reports them as cancelled"""
+        with self.lock:
+            for job in self.active.values():
+                job.cancel_requested = True
+
+    def poll(self):
+        """Jobs that reached a final state since the last call, never
+        blocks"""
+        jobs = []
+        while True:
+            try:
+                jobs.append(self.finished.get_nowait())
+            except queue.Empty:
+                return jobs
+
+    def pending_count(self):
+        with self.lock:
+            return len(self.active)
+
+    def finish(self, job, state, error=None):
+        job.error = error
+        if job.cancel_requested and state != CANCELLED:
+            state = CANCELLED
+            job.pixels = None
+        job.set_state(state)
+        with self.lock:
+            self.active.pop(job.job_id, None)
+        self.finished.put(job)
+
+    def run(self):
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                break
+            if job.cancel_requested:
+                self.finish(job, CANCELLED)
+                continue
+            try:
+                self.process(job)
+            except Exception as e:
+                self.finish(job, FAILED, e)
+
+    def process(self, job):
+        job.set_state(GENERATING)
+        image = self.generator(job, self.timeout)
+        if image is None:
+            self.finish(job, TIMED_OUT)
+            return
+        if job.cancel_requested:
+            self.finish(job, CANCELLED)
+            return
+        if isinstance(image, str):
+            job.image_path = image
+        if job.decode_needed:
+            job.set_state(DECODING)
+            job.pixels, job.size = self.decode(image)
+        self.finish(job, READY)
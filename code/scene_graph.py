@@ -0,0 +1,204 @@
+"""
+Minimal scene graph with dirty tracking.
+
+A SceneNode draws one part of the scene from a state tuple. Nodes are
+marked dirty when set_state() gets a different state. Static nodes (the
+ground and the building) are rendered into an offscreen color + depth
+framebuffer that is blitted back on every redraw, dynamic nodes (the café)
+are drawn on top of it. render() does nothing and returns False while no
+node is dirty, the caller can then skip the buffer swap as well.
+
+Without framebuffer objects / glBlitFramebuffer every redraw draws all
+nodes again, the dirty tracking still applies.
+"""
+
+from OpenGL.GL import *
+
+CLEAR_COLOR = (1.0, 1.0, 1.0, 1.0)
+
+
+def same_state(a, b):
+    """Numbers compare by value, anything else (grids) by identity"""
+    if a is None or b is None or len(a) != len(b):
+        return False
+    for value_a, value_b in zip(a, b):
+        if value_a is value_b:
+            continue
+        if not isinstance(value_a, (int, float)) or value_a != value_b:
+            return False
+    return True
+
+
+class SceneNode:
+    """draw(*state) renders the node with the current matrices"""
+
+    def __init__(self, name, draw, static=False):
+        self.name = name
+        self.draw_func = draw
+        self.static = static
+        self.state = None
+        self.dirty = True
+
+    def set_state(self, *state):
+        if not same_state(state, self.state):
+            self.state = state
+            self.dirty = True
+
+    def draw(self):
+        if self.state is not None:
+            self.draw_func(*self.state)
+        self.dirty = False
+
+
+class StaticLayer:
+    """Offscreen color + depth buffers matching the default framebuffer"""
+
+    def __init__(self):
+        self.framebuffer_id = None
+        self.renderbuffer_ids = None
+        self.size = None
+
+    @staticmethod
+    def supported():
+        return bool(glGenFramebuffers) and bool(glBlitFramebuffer)
+
+    def resize(self, size):
+        if size == self.size:
+            return
+        self.delete()
+        width, height = size
+        # depth blits need the exact format of the window's depth buffer
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        stencil_bits = glGetIntegerv(GL_STENCIL_BITS)
+        depth_format = GL_DEPTH24_STENCIL8 if stencil_bits else \
+            GL_DEPTH_COMPONENT24
+        depth_attachment = GL_DEPTH_STENCIL_ATTACHMENT if stencil_bits else \
+            GL_DEPTH_ATTACHMENT
+
+        self.framebuffer_id = glGenFramebuffers(1)
+        self.renderbuffer_ids = glGenRenderbuffers(2)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer_id)
+        for renderbuffer_id, internal_format, attachment in (
+                (self.renderbuffer_ids[0], GL_RGBA8, GL_COLOR_ATTACHMENT0),
+                (self.renderbuffer_ids[1], depth_format, depth_attachment)):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer_id)
+            glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width,
+                                  height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment,
+                                      GL_RENDERBUFFER, renderbuffer_id)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        glBindRenderbuffer(GL_RENDERBUFFER, 0)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            self.delete()
+            raise RuntimeError("static layer framebuffer incomplete: 0x%x"
+                               % status)
+        self.size = size
+
+    def bind(self):
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer_id)
+
+    def blit(self):
+        """Copies color and depth into the default framebuffer"""
+        width, height = self.size
+        glBindFramebuffer(GL_READ_FRAMEBUFFER, self.framebuffer_id)
+        glBindFramebuffer(GL_DRAW_FRAMEBUFFER, 0)
+        glBlitFramebuffer(0, 0, width, height, 0, 0, width, height,
+                          GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT,
+                          GL_NEAREST)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+
+    def delete(self):
+        if self.framebuffer_id is not None:
+            glDeleteFramebuffers(1, [self.framebuffer_id])
+            glDeleteRenderbuffers(2, self.renderbuffer_ids)
+        self.framebuffer_id = None
+        self.renderbuffer_ids = None
+        self.size = None
+
+
+class SceneGraph:
+    def __init__(self, use_static_layer=True):
+        self.nodes = {}
+        self.use_static_layer = use_static_layer
+        self.static_layer = None
+        self.static_valid = False
+        # redraws done and skipped, for profiling
+        self.render_count = 0
+        self.skip_count = 0
+
+    def add(self, node):
+        self.nodes[node.name] = node
+        return node
+
+    def set_state(self, name, *state):
+        self.nodes[name].set_state(*state)
+
+    def invalidate(self):
+        """Forces a full redraw, e.g. after something else drew over the
+        window or the GL state the nodes rely on changed"""
+        self.static_valid = False
+        for node in self.nodes.values():
+            node.dirty = True
+
+    def is_dirty(self):
+        return any(node.dirty for node in self.nodes.values())
+
+    def render(self):
+        """Redraws the default framebuffer if any node is dirty.
+        Returns True if it did."""
+        if not self.is_dirty():
+            self.skip_count += 1
+            return False
+        static_nodes = [node for node in self.nodes.values() if node.static]
+        dynamic_nodes = [node for node in self.nodes.values()
+                         if not node.static]
+
+        if self.use_static_layer and self.static_layer is None:
+            if StaticLayer.supported():
+                self.static_layer = StaticLayer()
+            else:
+                print("WARNING: no framebuffer objects, static scene "
+                      "nodes are redrawn every frame")
+                self.use_static_layer = False
+
+        if self.use_static_layer:
+            viewport = glGetIntegerv(GL_VIEWPORT)
+            size = (int(viewport[2]), int(viewport[3]))
+            if size != self.static_layer.size:
+                self.static_valid = False
+            if not self.static_valid or \
+               any(node.dirty for node in static_nodes):
+                try:
+                    self.static_layer.resize(size)
+                except RuntimeError as e:
+                    print("WARNING: %s, static scene nodes are redrawn "
+                          "every frame" % e)
+                    self.use_static_layer = False
+                    return self.render()
+                self.static_layer.bind()
+                self.clear()
+                for node in static_nodes:
+                    node.draw()
+                self.static_valid = True
+            self.static_layer.blit()
+        else:
+            self.clear()
+            for node in static_nodes:
+                node.draw()
+
+        for node in dynamic_nodes:
+            node.draw()
+        self.render_count += 1
+        return True
+
+    def clear(self):
+        glClearColor(*CLEAR_COLOR)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        glEnable(GL_DEPTH_TEST)
+
+    def delete(self):
+        if self.static_layer is not None:
+            self.static_layer.delete()
+            self.static_layer = None
+        self.static_valid = False
@@ -0,0 +1,144 @@
+"""
+Asynchronous framebuffer readback for screenshots.
+
+request() starts a glReadPixels into one of a few pixel pack buffers (PBOs)
+and returns at once, the GPU copies the frame while the render loop goes
+on. poll(), called once per frame, maps the buffers whose copy is done
+(checked with a fence, never waiting), copies the rows top-down into a
+NumPy array in the same pass and hands that array to a callback, e.g. an
+image_encoder.EncoderPool that encodes it without copying it again.
+
+    readback = PixelReadback()
+    encoder = EncoderPool()
+    readback.request(display, encoder.saver("screenshot.png"))
+    ...
+    readback.poll()        # every frame
+
+Needs a current GL context. Without PBO support request() reads the pixels
+synchronously.
+"""
+
+import ctypes
+
+import numpy as np
+from OpenGL.GL import *
+
+DEFAULT_BUFFER_COUNT = 2
+
+
+class PendingReadback:
+    def __init__(self, buffer_id):
+        self.buffer_id = buffer_id
+        self.buffer_size = 0
+        self.size = None
+        self.fence = None
+        self.callback = None
+
+
+class PixelReadback:
+    """Ring of pixel pack buffers, oldest request completes first"""
+
+    def __init__(self, buffer_count=DEFAULT_BUFFER_COUNT):
+        self.buffer_count = buffer_count
+        self.slots = None
+        self.pending = []
+        self.use_pbo = None
+        self.next_slot = 0
+
+    def setup(self):
+        self.use_pbo = bool(glGenBuffers) and bool(glMapBufferRange)
+        if not self.use_pbo:
+            print("WARNING: no pixel buffer objects, screenshots are read "
+                  "back synchronously")
+            self.slots = []
+            return
+        buffer_ids = np.atleast_1d(glGenBuffers(self.buffer_count))
+        self.slots = [PendingReadback(int(buffer_id))
+                      for buffer_id in buffer_ids]
+
+    def request(self, size, callback, x=0, y=0):
+        """Starts reading the RGBA pixels of the current read buffer,
+        callback(pixels, size) gets them from a later poll() as a
+        (height, width, 4) uint8 array, first row at the top"""
+        if self.slots is None:
+            self.setup()
+        width, height = size
+        if not self.use_pbo:
+            glPixelStorei(GL_PACK_ALIGNMENT, 1)
+            data = glReadPixels(x, y, width, height, GL_RGBA,
+                                GL_UNSIGNED_BYTE)
+            pixels = np.frombuffer(data, dtype=np.uint8).reshape(
+                height, width, 4)[::-1]
+            callback(np.ascontiguousarray(pixels), size)
+            return
+
+        slot = self.slots[self.next_slot]
+        if slot in self.pending:
+            # every buffer busy, the oldest has to finish now
+            self.complete(slot)
+        self.next_slot = (self.next_slot + 1) % len(self.slots)
+
+        byte_count = width * height * 4
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.buffer_id)
+        if byte_count != slot.buffer_size:
+            glBufferData(GL_PIXEL_PACK_BUFFER, byte_count, None,
+                         GL_STREAM_READ)
+            slot.buffer_size = byte_count
+        glPixelStorei(GL_PACK_ALIGNMENT, 1)
+        glReadPixels(x, y, width, height, GL_RGBA, GL_UNSIGNED_BYTE,
+                     ctypes.c_void_p(0))
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        slot.size = (width, height)
+        slot.callback = callback
+        slot.fence = glFenceSync(GL_SYNC_GPU_COMMANDS_COMPLETE, 0) \
+            if bool(glFenceSync) else None
+        self.pending.append(slot)
+
+    def is_ready(self, slot):
+        if slot.fence is None:
+            return True
+        status = glClientWaitSync(slot.fence, 0, 0)
+        return status in (GL_ALREADY_SIGNALED, GL_CONDITION_SATISFIED)
+
+    def poll(self):
+        """Completes the requests the GPU is done with, returns how many"""
+        completed = 0
+        while self.pending and self.is_ready(self.pending[0]):
+            self.complete(self.pending[0])
+            completed += 1
+        return completed
+
+    def finish(self):
+        """Completes every request, waiting for the GPU if needed"""
+        while self.pending:
+            self.complete(self.pending[0])
+
+    def complete(self, slot):
+        self.pending.remove(slot)
+        if slot.fence is not None:
+            glDeleteSync(slot.fence)
+            slot.fence = None
+        width, height = slot.size
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, slot.buffer_id)
+        address = glMapBufferRange(GL_PIXEL_PACK_BUFFER, 0, slot.buffer_size,
+                                   GL_MAP_READ_BIT)
+        mapped = np.ctypeslib.as_array(
+            ctypes.cast(address, ctypes.POINTER(ctypes.c_uint8)),
+            shape=(height, width, 4))
+        # the only copy, flips GL's bottom-up rows on the way
+        pixels = mapped[::-1].copy()
+        glUnmapBuffer(GL_PIXEL_PACK_BUFFER)
+        glBindBuffer(GL_PIXEL_PACK_BUFFER, 0)
+        callback = slot.callback
+        slot.callback = None
+        callback(pixels, slot.size)
+
+    def delete(self):
+        for slot in self.pending:
+            if slot.fence is not None:
+                glDeleteSync(slot.fence)
+        self.pending = []
+        if self.slots:
+            glDeleteBuffers(len(self.slots),
+                            [slot.buffer_id for slot in self.slots])
+        self.slots = None
@@ -0,0 +1,112 @@
+"""
+Speculative pre-generation: renders for café configurations the visitor
+lingers on, made while they are still aiming.
+
+In interaction mode the GPU workstation is idle. Once the café stayed
+within dwell_radius (world units, size included) for dwell_time seconds,
+update() returns the cache key of that configuration; the render loop
+redraws the frame, grabs it and hands the pixels to submit(), which
+queues a PRIORITY_SPECULATIVE job. The job's image lands in the
+render_cache, so a click on the same configuration finds it there.
+
+Speculation is bounded: a configuration already cached or being
+generated is skipped, each dwell is tried once, and at most max_pending
+jobs are unfinished, the oldest is cancelled for a newer one. On the
+click, cancel(keep_key) drops all speculative jobs except the one for the
+clicked configuration, which the click's job then waits for.
+
+    speculative = SpeculativeRenders(render_jobs, render_cache, key_of)
+    key = speculative.update(pos_x, pos_y, cafe_size)     # every frame
+    if key is not None:
+        grab_screenshot_async(display, lambda pixels, size:
+                              speculative.submit(pixels, key))
+"""
+
+import threading
+import time
+
+from render_jobs import PRIORITY_SPECULATIVE
+
+DEFAULT_DWELL_TIME = 0.8
+DEFAULT_DWELL_RADIUS = 0.5
+DEFAULT_MAX_PENDING = 2
+
+
+class SpeculativeRenders:
+    def __init__(self, jobs, cache, key_of, dwell_time=DEFAULT_DWELL_TIME,
+                 dwell_radius=DEFAULT_DWELL_RADIUS,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.jobs = jobs
+        self.cache = cache
+        # key_of(x, y, size) -> cache key
+        self.key_of = key_of
+        self.dwell_time = dwell_time
+        self.dwell_radius = dwell_radius
+        self.max_pending = max(1, max_pending)
+        self.lock = threading.Lock()
+        # unfinished speculative jobs, oldest first
+        self.pending = []
+        # (x, y, size) the café dwells around, since when, and whether it
+        # was handled already
+        self.anchor = None
+        self.anchor_time = None
+        self.anchor_done = False
+        self.submitted_count = 0
+        self.cancelled_count = 0
+
+    def update(self, x, y, size, now=None):
+        """Key to pre-generate for the café at (x, y, size), None if there
+        is nothing to do. Call once per interaction frame."""
+        if now is None:
+            now = time.time()
+        position = (x, y, size)
+        if self.anchor is None or max(
+                abs(value - anchor_value)
+                for value, anchor_value in zip(position, self.anchor)) \
+                > self.dwell_radius:
+            self.anchor = position
+            self.anchor_time = now
+            self.anchor_done = False
+            return None
+        if self.anchor_done or now - self.anchor_time < self.dwell_time:
+            return None
+        self.anchor_done = True
+        key = self.key_of(x, y, size)
+        if key in self.cache or key in self.pending_keys():
+            return None
+        return key
+
+    def pending_keys(self):
+        with self.lock:
+            self.pending = [job for job in self.pending if not job.done]
+            return {job.cache_key for job in self.pending}
+
+    def submit(self, screenshot, key):
+        """Queues the speculative job for the screenshot of key, from the
+        screenshot thread"""
+        with self.lock:
+            self.pending = [job for job in self.pending if not job.done]
+            while len(self.pending) >= self.max_pending:
+                self.jobs.cancel(self.pending.pop(0))
+                self.cancelled_count += 1
+            job = self.jobs.submit(screenshot, key, PRIORITY_SPECULATIVE)
+            self.pending.append(job)
+            self.submitted_count += 1
+        return job
+
+    def cancel(self, keep_key=None):
+        """Cancels the unfinished speculative jobs, except the one for
+        keep_key"""
+        with self.lock:
+            kept = []
+            for job in self.pending:
+                if job.done:
+                    continue
+                if keep_key is not None and job.cache_key == keep_key:
+                    kept.append(job)
+                else:
+                    self.jobs.cancel(job)
+                    self.cancelled_count += 1
+            self.pending = kept
+        # the café may come back to where it was
+        self.anchor = None
@@ -0,0 +1,173 @@
+"""
+Streams rendered frames into one video file instead of an image per frame.
+
+Frames are (height, width, 4) uint8 RGBA arrays, first row at the top, as
+image_encoder takes them. write() queues a frame and returns, a writer
+thread feeds the queue to the output; at most max_pending frames wait, so
+write() blocks when the encoder falls behind.
+
+    FFmpegWriter     pipes raw frames into ffmpeg's stdin, which encodes
+                     them (H.264 by default, ffv1 etc. for lossless)
+    RawVideoWriter   appends the raw frames to a single file, no encoder
+                     needed. ffmpeg_command() prints how to convert it.
+
+    with open_video_writer("animation.mp4", (1920, 1200), fps=30) as video:
+        video.write(pixels)
+"""
+
+import abc
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+import numpy as np
+
+DEFAULT_FPS = 30
+DEFAULT_CODEC = "libx264"
+DEFAULT_CRF = 18
+DEFAULT_MAX_PENDING = 4
+# extensions written without ffmpeg
+RAW_EXTENSIONS = (".rgba", ".raw")
+
+
+class VideoWriter(abc.ABC):
+    """Writer thread and bounded queue, subclasses implement the output"""
+
+    def __init__(self, filename, size, fps=DEFAULT_FPS,
+                 max_pending=DEFAULT_MAX_PENDING):
+        self.filename = filename
+        self.size = tuple(size)
+        self.fps = fps
+        self.frames = queue.Queue(max_pending)
+        self.error = None
+        self.written_count = 0
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, pixels):
+        """Queues one frame. The writer keeps a reference to pixels,
+        don't reuse it."""
+        if self.error is not None:
+            raise RuntimeError("could not write %s: %s"
+                               % (self.filename, self.error))
+        height, width = pixels.shape[:2]
+        if (width, height) != self.size:
+            raise ValueError("frame is %dx%d, video is %dx%d"
+                             % ((width, height) + self.size))
+        self.frames.put(pixels)
+
+    def run(self):
+        while True:
+            pixels = self.frames.get()
+            if pixels is None:
+                break
+            if self.error is not None:
+                # drain, write() reports the error
+                continue
+            try:
+                self.write_frame(np.ascontiguousarray(pixels))
+                self.written_count += 1
+            except Exception as e:
+                self.error = e
+
+    def close(self):
+        """Writes the queued frames and finishes the file"""
+        if self.thread is not None:
+            self.frames.put(None)
+            self.thread.join()
+            self.thread = None
+        self.finish()
+        if self.error is not None:
+            raise RuntimeError("could not write %s: %s"
+                               % (self.filename, self.error))
+
+    @abc.abstractmethod
+    def write_frame(self, pixels):
+        """Writes one frame, called on the writer thread"""
+
+    def finish(self):
+        pass
+
+
+class FFmpegWriter(VideoWriter):
+    def __init__(self, filename, size, fps=DEFAULT_FPS, codec=DEFAULT_CODEC,
+                 crf=DEFAULT_CRF, pixel_format="yuv420p", extra_args=(),
+                 ffmpeg=None, max_pending=DEFAULT_MAX_PENDING):
+        super().__init__(filename, size, fps, max_pending)
+        ffmpeg = ffmpeg or shutil.which("ffmpeg")
+        if ffmpeg is None:
+            raise RuntimeError("ffmpeg not found, install it or write a %s "
+                               "file" % " / ".join(RAW_EXTENSIONS))
+        width, height = self.size
+        command = [
+            ffmpeg, "-y", "-loglevel", "error", "-nostats",
+            "-f", "rawvideo", "-pix_fmt", "rgba",
+            "-s", "%dx%d" % (width, height), "-r", str(fps), "-i", "-",
+            "-c:v", codec,
+        ]
+        if crf is not None:
+            command += ["-crf", str(crf)]
+        if pixel_format is not None:
+            command += ["-pix_fmt", pixel_format]
+        command += list(extra_args) + [filename]
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE,
+                                        stderr=subprocess.PIPE)
+        self.start()
+
+    def write_frame(self, pixels):
+        self.process.stdin.write(memoryview(pixels).cast("B"))
+
+    def finish(self):
+        try:
+            self.process.stdin.close()
+        except BrokenPipeError:
+            pass
+        stderr = self.process.stderr.read().decode(errors="replace").strip()
+        if self.process.wait() != 0 and self.error is None:
+            self.error = "ffmpeg exited with %d: %s" % (
+                self.process.returncode, stderr)
+
+
+class RawVideoWriter(VideoWriter):
+    """Lossless intermediate: the RGBA frames back to back in one file"""
+
+    def __init__(self, filename, size, fps=DEFAULT_FPS,
+                 max_pending=DEFAULT_MAX_PENDING, **options):
+        super().__init__(filename, size, fps, max_pending)
+        self.temp_filename = filename + ".tmp"
+        self.file = open(self.temp_filename, "wb")
+        self.start()
+
+    def write_frame(self, pixels):
+        self.file.write(memoryview(pixels).cast("B"))
+
+    def finish(self):
+        self.file.close()
+        if self.error is None:
+            os.replace(self.temp_filename, self.filename)
+
+    def ffmpeg_command(self, output="animation.mp4"):
+        width, height = self.size
+        return ("ffmpeg -f rawvideo -pix_fmt rgba -s %dx%d -r %s -i %s "
+                "-c:v %s -crf %d -pix_fmt yuv420p %s"
+                % (width, height, self.fps, self.filename, DEFAULT_CODEC,
+                   DEFAULT_CRF, output))
+
+
+def open_video_writer(filename, size, fps=DEFAULT_FPS, **options):
+    """RawVideoWriter for .rgba / .raw files, FFmpegWriter otherwise"""
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in RAW_EXTENSIONS:
+        return RawVideoWriter(filename, size, fps, **options)
+    return FFmpegWriter(filename, size, fps, **options)
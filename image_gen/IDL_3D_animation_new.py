@@ -2,16 +2,39 @@
 
 """
 Single-file example using PyOpenGL + pygame to animate a highrise building.
-It uses keyframed states (x, y, size, axes_width) with ease-in/ease-out.
+It uses keyframed states (x, y, size, axes_width) with ease-in/ease-out,
+evaluated for all frames at once by keyframe_timeline.Timeline.
 The building stays centered; only the blue "glass box" cafe moves.
 """
 
+import json
 import math
-import random
+import multiprocessing
 import os
+import sys
+import threading
+import time
+import numpy as np
 import pygame
 from pygame.locals import *
 
+import render_context
+
+# -----------------------------------------------------------
+# Render target
+# -----------------------------------------------------------
+# "window", "hidden", "egl" or "osmesa" (see render_context), the
+# IDL_RENDER_BACKEND environment variable overrides it
+RENDER_BACKEND = os.environ.get("IDL_RENDER_BACKEND", "window")
+# processes rendering image frames in parallel, 0 = one per core; they
+# render on "egl" instead of "window". The IDL_EXPORT_PROCESSES
+# environment variable overrides it
+EXPORT_PROCESSES = int(os.environ.get("IDL_EXPORT_PROCESSES", "1")) or os.cpu_count() or 1
+# print the parameters of every frame
+VERBOSE = False
+# must happen before OpenGL is imported
+render_context.select_platform(RENDER_BACKEND)
+
 from OpenGL.GL import *
 from OpenGL.GLU import *
 
@@ -22,20 +45,63 @@ from highrise_funcs import (
     setup_projection_and_lighting,
 )
 
+# shared helpers (building grid, image_encoder, video_writer, keyframes) live next to the main app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "code"))
+from building_grid import generate_grid, occupied_cells
+from cafe_keyframes import STATES_V2
+from image_encoder import EncoderPool
+from keyframe_timeline import Timeline
+from video_writer import open_video_writer
+
 # -----------------------------------------------------------
-# Utility / drawing code
+# Frame export
 # -----------------------------------------------------------
+# "images" writes one FRAME_FORMAT file per frame, "video" streams the
+# frames into VIDEO_FILE. The IDL_FRAME_OUTPUT environment variable
+# overrides it
+FRAME_OUTPUT = os.environ.get("IDL_FRAME_OUTPUT", "images")
+# encoded by ffmpeg, or ".rgba" for the raw frames in one file (lossless,
+# no ffmpeg needed), see video_writer
+VIDEO_FILE = "animation.mp4"
+VIDEO_FPS = 30
+VIDEO_CRF = 18
+# "png", "ppm", "raw" (+ "webp", "qoi" if installed), see image_encoder
+FRAME_FORMAT = "png"
+PNG_COMPRESS_LEVEL = 6
+# encoder threads, None = one per core
+ENCODER_WORKERS = None
+OUT_DIR = "screenshots"
+# frames handed to a worker process at a time
+EXPORT_CHUNK_FRAMES = 10
+# written frames, so an interrupted export continues where it stopped
+MANIFEST_NAME = "manifest.json"
+# seconds between manifest updates while exporting
+MANIFEST_SAVE_INTERVAL = 1.0
 
+# -----------------------------------------------------------
+# Animation
+# -----------------------------------------------------------
+WINDOW_SCALE = 0.75
+SCREEN_SIZE = (2560, 1600)
+
+# Pre-generate a big grid so we can handle up to e.g. 30 axes
+FLOORS = 12
+MAX_AXES = 30
+GRID_SEED = 42
+
+# keyframe states [x, y, size, axes_width] are in cafe_keyframes
+# We'll do 4 states, total 600 frames, so 4 segments of 150 frames each.
+STATES = STATES_V2
+TOTAL_FRAMES = 600
+# relative length of each segment (state i -> i + 1), None = all equal
+KEYFRAME_DURATIONS = None
+# "linear", "quad" or "cubic" (in-out) and "linear" or "catmull_rom"
+KEYFRAME_EASING = "quad"
+KEYFRAME_INTERPOLATION = "linear"
 
-def ease_in_out_quad(t: float) -> float:
-    """
-    Standard easeInOutQuad function.
-    t is in [0,1], returns adjusted t with smooth acceleration.
-    """
-    if t < 0.5:
-        return 2.0 * t * t
-    else:
-        return -1.0 + (4.0 - 2.0 * t) * t
+# -----------------------------------------------------------
+# Utility / drawing code
+# -----------------------------------------------------------
 
 
 def draw_box(size: float):
@@ -73,29 +139,34 @@ def draw_box(size: float):
     glEnd()
 
 
-def save_screenshot(display_size, filename="frame.png"):
-    """Save the current OpenGL framebuffer as a PNG screenshot."""
+def read_pixels(display_size):
+    """The current OpenGL framebuffer as a (height, width, 4) array, top row first."""
     width, height = display_size
     glPixelStorei(GL_PACK_ALIGNMENT, 1)
-    pixels = glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE)
-    surf = pygame.image.fromstring(pixels, (width, height), "RGBA", True)
-    # Flip vertical if needed
-    surf = pygame.transform.flip(surf, False, False)
+    data = glReadPixels(0, 0, width, height, GL_RGBA, GL_UNSIGNED_BYTE)
+    return np.frombuffer(data, dtype=np.uint8).reshape(height, width, 4)[::-1]
+
+
+def save_screenshot(display_size, filename="frame.png", encoder=None, on_done=None):
+    """
+    Save the current OpenGL framebuffer as a screenshot. With an
+    image_encoder.EncoderPool the file is encoded in the background and
+    the pool's future is returned.
+    """
+    pixels = read_pixels(display_size)
+    if encoder is not None:
+        return encoder.submit(pixels, filename, on_done=on_done)
+    surf = pygame.image.frombuffer(pixels.tobytes(), display_size, "RGBA")
     pygame.image.save(surf, filename)
 
 
-def generate_grid_structure(floors, max_axes_x, max_axes_z, porosity=0.5):
+def generate_grid_structure(floors, max_axes_x, max_axes_z, porosity=0.5, seed=None):
     """
     Generate a random True/False 3D array for floors x axes_x x axes_z,
-    up to a maximum dimension. We'll fill everything with random.
+    up to a maximum dimension, the same as the live demo's for the same
+    seed (see building_grid).
     """
-    return [
-        [
-            [random.random() < porosity for _ in range(max_axes_z)]
-            for _ in range(max_axes_x)
-        ]
-        for _ in range(floors)
-    ]
+    return generate_grid(floors, max_axes_x, max_axes_z, porosity, seed)
 
 
 def draw_building_structure(grid, axes_width, floors, axes_x, axes_z):
@@ -110,21 +181,18 @@ def draw_building_structure(grid, axes_width, floors, axes_x, axes_z):
     half_w_z = axes_z * axes_width / 2.0
 
     # Draw each occupied cell
-    for floor_i in range(floors):
-        for x_i in range(axes_x):
-            for z_i in range(axes_z):
-                if grid[floor_i][x_i][z_i]:
-                    glPushMatrix()
-                    # center of that cell
-                    world_x = (x_i * axes_width) - half_w_x + axes_width * 0.5
-                    world_y = floor_i * floor_height + floor_height * 0.5
-                    world_z = (z_i * axes_width) - half_w_z + axes_width * 0.5
-                    glTranslatef(world_x, world_y, world_z)
-                    glScalef(axes_width, floor_height, axes_width)
-                    # white color
-                    glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (1, 1, 1, 1))
-                    draw_box(1.0)
-                    glPopMatrix()
+    for floor_i, x_i, z_i in zip(*occupied_cells(grid, floors, axes_x, axes_z)):
+        glPushMatrix()
+        # center of that cell
+        world_x = (x_i * axes_width) - half_w_x + axes_width * 0.5
+        world_y = floor_i * floor_height + floor_height * 0.5
+        world_z = (z_i * axes_width) - half_w_z + axes_width * 0.5
+        glTranslatef(world_x, world_y, world_z)
+        glScalef(axes_width, floor_height, axes_width)
+        # white color
+        glMaterialfv(GL_FRONT, GL_AMBIENT_AND_DIFFUSE, (1, 1, 1, 1))
+        draw_box(1.0)
+        glPopMatrix()
 
     # Draw the frame (columns/beams)
     # Columns at each grid intersection
@@ -282,131 +350,276 @@ def draw_scene(x, y, size, axes_width, grid, floors):
             glPopMatrix()
 
 
-def interpolate_keyframes(frame, total_frames, states):
-    """
-    We have a list of keyframe states, each a list [x, y, size, axes_width].
-    We'll loop from 0->1->2->...->(n-1)->0 over total_frames with ease-in/out.
-    """
-    n = len(states)
-    # how many transitions? = n
-    frames_per_segment = total_frames // n
-    seg_i = frame // frames_per_segment  # which segment
-    seg_i_next = (seg_i + 1) % n
-
-    # local t in [0,1]
-    seg_start_frame = seg_i * frames_per_segment
-    seg_end_frame = seg_start_frame + frames_per_segment
-    if seg_end_frame > total_frames:
-        seg_end_frame = total_frames
-    seg_local = float(frame - seg_start_frame) / float(frames_per_segment)
-    if seg_local < 0:
-        seg_local = 0.0
-    if seg_local > 1:
-        seg_local = 1.0
-
-    t_eased = ease_in_out_quad(seg_local)
-
-    s0 = states[seg_i]
-    s1 = states[seg_i_next]
-
-    # param wise interpolation
-    out = []
-    for i in range(len(s0)):
-        val0 = s0[i]
-        val1 = s1[i]
-        val = val0 + (val1 - val0) * t_eased
-        out.append(val)
-
-    return out  # [x, y, size, axes_width]
+def quit_requested():
+    """True if the window was closed or Escape pressed."""
+    for event in pygame.event.get():
+        if event.type == QUIT:
+            return True
+        elif event.type == KEYDOWN and event.key == K_ESCAPE:
+            return True
+    return False
 
 
-def main():
-    pygame.init()
-    window_scale = 0.75
-    screen_width, screen_height = 2560, 1600
-    disp_w, disp_h = int(screen_width * window_scale), int(screen_height * window_scale)
-    display = (disp_w, disp_h)
-    pygame.display.set_caption("GenAI_render_Animation")
+def display_size():
+    return (int(SCREEN_SIZE[0] * WINDOW_SCALE), int(SCREEN_SIZE[1] * WINDOW_SCALE))
+
+
+def frame_filename(frame):
+    return os.path.join(OUT_DIR, f"frame_{frame:03d}.{FRAME_FORMAT}")
 
-    screen = pygame.display.set_mode(display, DOUBLEBUF | OPENGL)
 
+def export_settings():
+    """Everything the frames depend on."""
+    return {
+        "states": STATES,
+        "total_frames": TOTAL_FRAMES,
+        "durations": KEYFRAME_DURATIONS,
+        "easing": KEYFRAME_EASING,
+        "interpolation": KEYFRAME_INTERPOLATION,
+        "floors": FLOORS,
+        "max_axes": MAX_AXES,
+        "grid_seed": GRID_SEED,
+        "display": list(display_size()),
+        "frame_format": FRAME_FORMAT,
+    }
+
+
+class ExportManifest:
+    """
+    The frames already written to OUT_DIR, kept as JSON next to them.
+    A manifest written with other settings is ignored, and a frame only
+    counts as done while its file exists.
+    """
+
+    def __init__(self, settings):
+        self.path = os.path.join(OUT_DIR, MANIFEST_NAME)
+        # compare as they come back from JSON
+        self.settings = json.loads(json.dumps(settings))
+        self.done = set()
+        self.lock = threading.Lock()
+        self.saved_time = 0.0
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as manifest_file:
+                data = json.load(manifest_file)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            print(f"WARNING: ignoring unreadable {self.path}: {e}")
+            return
+        if data.get("settings") != self.settings:
+            print(f"WARNING: {self.path} was written with other settings, exporting every frame again")
+            return
+        self.done = {frame for frame in data.get("done", []) if os.path.exists(frame_filename(frame))}
+
+    def pending(self, total_frames):
+        return [frame for frame in range(total_frames) if frame not in self.done]
+
+    def add(self, frames):
+        """Marks frames as written, called from any thread."""
+        with self.lock:
+            self.done.update(frames)
+            if time.perf_counter() - self.saved_time >= MANIFEST_SAVE_INTERVAL:
+                self.save_locked()
+
+    def save(self):
+        with self.lock:
+            self.save_locked()
+
+    def save_locked(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump({"settings": self.settings, "done": sorted(self.done)}, manifest_file)
+        os.replace(temp_path, self.path)
+        self.saved_time = time.perf_counter()
+
+
+def setup_scene():
+    """GL state and grid every context renders with."""
     setup_projection_and_lighting()
     # Force a white background
     glClearColor(1.0, 1.0, 1.0, 1.0)
+    return generate_grid_structure(FLOORS, MAX_AXES, MAX_AXES, porosity=0.5, seed=GRID_SEED)
 
-    # Pre-generate a big grid so we can handle up to e.g. 30 axes
-    floors = 12
-    max_axes = 30
-    random.seed(42)
-    grid = generate_grid_structure(floors, max_axes, max_axes, porosity=0.5)
-
-    # Let's define our keyframe states: [x, y, size, axes_width]
-    # We'll do 4 states, total 600 frames, so 4 segments of 150 frames each.
-    states_v1 = [
-        # near left, small cafe, building axes=3 
-        [-13.0, 0.0, 5.0, 3.0],
-        # further right, bigger cafe, same axes_width=3
-        [2.0, 22.0, 12.0, 10.0],
-        # center, medium cafe, building axes_width=1.5 => ~30 wide
-        [-10, 30.0, 20.0, 2],
-        # left, small cafe, building axes_width=5 
-        [-5.0, 20.0, 5.0, 5.0],
-    ]
-    states_v2 = [
-        
-        # left, small cafe, building axes_width=5 
-        [0.0, 8.0, 5.0, 5.0],
-        # further right, bigger cafe, same axes_width=3
-        [-13.0, 22.0, 12.0, 10.0],
-        # center, medium cafe, building axes_width=1.5 => ~30 wide
-        [-10, 30.0, 20.0, 2],
-        # near left, small cafe, building axes=3 
-        [8.0, 0.0, 4.0, 3.0],
-    ]
-    states = states_v2
-    total_frames = 600
 
-    frame = 0
-    clock = pygame.time.Clock()
-    running = True
+def create_encoder(workers=ENCODER_WORKERS):
+    return EncoderPool(
+        workers=workers,
+        image_format=FRAME_FORMAT,
+        compress_level=PNG_COMPRESS_LEVEL,
+    )
 
-    # Make a folder for screenshots if you want
-    out_dir = "screenshots"
-    os.makedirs(out_dir, exist_ok=True)
-
-    while running:
-        for event in pygame.event.get():
-            if event.type == QUIT:
-                running = False
-            elif event.type == KEYDOWN and event.key == K_ESCAPE:
-                running = False
-        print(f"Frame {frame:03d} / {total_frames}")
-        
-
-        # compute interpolated parameters
-        x, y, cafe_size, axes_w = interpolate_keyframes(frame, total_frames, states)
-        print(
-            f"Frame {frame:03d}: x={x:.2f}, y={y:.2f}, size={cafe_size:.2f}, axes_w={axes_w:.2f}"
+
+# (TOTAL_FRAMES, 4) parameters of every frame, computed on first use
+frame_parameters = None
+
+
+def get_frame_parameters():
+    global frame_parameters
+    if frame_parameters is None:
+        timeline = Timeline(
+            STATES,
+            durations=KEYFRAME_DURATIONS,
+            easing=KEYFRAME_EASING,
+            interpolation=KEYFRAME_INTERPOLATION,
         )
+        frame_parameters = timeline.frames(TOTAL_FRAMES)
+    return frame_parameters
 
-        # draw
-        draw_scene(x, y, cafe_size, axes_w, grid, floors)
-        
 
-        # optionally save screenshot
-        fname = os.path.join(out_dir, f"frame_{frame:03d}.png")
-        save_screenshot((disp_w, disp_h), fname)
+def draw_frame(frame, grid):
+    # precomputed interpolated parameters
+    x, y, cafe_size, axes_w = get_frame_parameters()[frame].tolist()
+    if VERBOSE:
+        print(
+            f"Frame {frame:03d}: x={x:.2f}, y={y:.2f}, size={cafe_size:.2f}, axes_w={axes_w:.2f}"
+        )
 
-        pygame.display.flip()
+    # draw
+    draw_scene(x, y, cafe_size, axes_w, grid, FLOORS)
+
+
+def render_frame(frame, grid, encoder, on_done=None):
+    """Draws frame and queues its image, returns the encoder's future."""
+    draw_frame(frame, grid)
+    return save_screenshot(display_size(), frame_filename(frame), encoder, on_done)
+
+
+def export_sequential(manifest, frames):
+    """Renders frames in this process, returns (written, failed)."""
+    context = render_context.create_render_context(
+        RENDER_BACKEND, display_size(), caption="GenAI_render_Animation"
+    )
+    grid = setup_scene()
+    # frames are encoded on all cores while the next ones render
+    encoder = create_encoder()
+    for frame in frames:
+        if context.interactive and quit_requested():
+            break
+        render_frame(frame, grid, encoder, on_done=lambda filename, frame=frame: manifest.add([frame]))
+        context.swap()
+    encoder.close()
+    context.close()
+    return encoder.written_count, encoder.failed_count
+
+
+# state of an export worker process
+worker_context = None
+worker_grid = None
+worker_encoder = None
+# what init_export_worker() raised, export_chunk() reports it
+worker_error = None
+
+
+def init_export_worker():
+    global worker_context, worker_grid, worker_encoder, worker_error
+    # a Pool respawns workers whose initializer raises forever, so the
+    # error is kept and raised from the first chunk instead
+    try:
+        worker_context = render_context.create_render_context(RENDER_BACKEND, display_size())
+        worker_grid = setup_scene()
+        # one thread encodes while the process renders the next frame
+        worker_encoder = create_encoder(workers=1)
+    except Exception as e:
+        worker_error = e
+
+
+def export_chunk(frames):
+    """Renders frames in a worker process, returns the ones written."""
+    if worker_error is not None:
+        raise RuntimeError(f"export worker could not start ({RENDER_BACKEND}): {worker_error!r}")
+    futures = []
+    for frame in frames:
+        futures.append((frame, render_frame(frame, worker_grid, worker_encoder)))
+        worker_context.swap()
+    return [frame for frame, future in futures if future.exception() is None]
+
+
+def export_parallel(manifest, frames, processes):
+    """
+    Shards frames over worker processes in chunks of EXPORT_CHUNK_FRAMES,
+    returns (written, failed).
+    """
+    chunks = [frames[i:i + EXPORT_CHUNK_FRAMES] for i in range(0, len(frames), EXPORT_CHUNK_FRAMES)]
+    written = 0
+    # spawned workers start without any GL state of this process
+    pool_context = multiprocessing.get_context("spawn")
+    with pool_context.Pool(processes, initializer=init_export_worker) as pool:
+        for done in pool.imap_unordered(export_chunk, chunks):
+            manifest.add(done)
+            written += len(done)
+    return written, len(frames) - written
+
+
+def export_video():
+    """
+    Renders every frame in order into VIDEO_FILE, returns the frames written.
+    A stream can't be resumed, the manifest doesn't apply.
+    """
+    context = render_context.create_render_context(
+        RENDER_BACKEND, display_size(), caption="GenAI_render_Animation"
+    )
+    grid = setup_scene()
+    filename = os.path.join(OUT_DIR, VIDEO_FILE)
+    video = open_video_writer(filename, display_size(), fps=VIDEO_FPS, crf=VIDEO_CRF)
+    try:
+        for frame in range(TOTAL_FRAMES):
+            if context.interactive and quit_requested():
+                break
+            draw_frame(frame, grid)
+            # the video encodes while the next frame renders
+            video.write(read_pixels(display_size()))
+            context.swap()
+    finally:
+        video.close()
+        context.close()
+    if hasattr(video, "ffmpeg_command"):
+        print(f"Convert with: {video.ffmpeg_command()}")
+    return video.written_count
 
-        frame += 1
-        if frame == total_frames:
-            # loop forever or just exit?
-            running = False
-            # Let's just loop around.
-            # frame = 0
 
-    pygame.quit()
+def main():
+    global RENDER_BACKEND
+    # Make a folder for screenshots if you want
+    os.makedirs(OUT_DIR, exist_ok=True)
+    if FRAME_OUTPUT == "video":
+        if EXPORT_PROCESSES > 1:
+            print("WARNING: video frames have to arrive in order, rendering in one process")
+        start_time = time.perf_counter()
+        written = export_video()
+        elapsed = time.perf_counter() - start_time
+        print(f"{written} frames streamed to {VIDEO_FILE}, {written / elapsed:.1f} frames/s ({RENDER_BACKEND})")
+        return
+
+    manifest = ExportManifest(export_settings())
+    frames = manifest.pending(TOTAL_FRAMES)
+    if not frames:
+        print(f"All {TOTAL_FRAMES} frames are already in {OUT_DIR}")
+        return
+    if len(frames) < TOTAL_FRAMES:
+        print(f"Resuming export, {TOTAL_FRAMES - len(frames)} of {TOTAL_FRAMES} frames already in {OUT_DIR}")
+
+    processes = min(EXPORT_PROCESSES, len(frames))
+    start_time = time.perf_counter()
+    if processes > 1 and RENDER_BACKEND == "window":
+        # every worker process has its own context, no window for each;
+        # spawned workers import this module anew and read the variable
+        RENDER_BACKEND = "egl"
+        os.environ["IDL_RENDER_BACKEND"] = RENDER_BACKEND
+    try:
+        if processes > 1:
+            written, failed = export_parallel(manifest, frames, processes)
+        else:
+            written, failed = export_sequential(manifest, frames)
+    finally:
+        manifest.save()
+    elapsed = time.perf_counter() - start_time
+    print(
+        f"{written} frames written, {failed} failed, "
+        f"{written / elapsed:.1f} frames/s ({RENDER_BACKEND}, {processes} process(es))"
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,216 @@
+"""
+Render targets for the animation exporter.
+
+    window   visible pygame window, double buffered (default)
+    hidden   hidden pygame window, frames are drawn into a framebuffer object
+    egl      EGL pbuffer, no display server needed. Uses Mesa's surfaceless
+             platform unless EGL_PLATFORM is set: GPU render nodes when
+             present, llvmpipe otherwise
+    osmesa   Mesa's OSMesa software rasterizer into a memory buffer
+
+egl and osmesa switch PyOpenGL to another platform, so select_platform()
+has to run before anything imports OpenGL.GL:
+
+    import render_context
+    render_context.select_platform(backend)
+    from OpenGL.GL import *
+    ...
+    context = render_context.create_render_context(backend, (1920, 1200))
+
+Every backend has vsync off, swap() only waits for the display in the
+window backend.
+"""
+
+import ctypes
+import ctypes.util
+import os
+
+BACKENDS = ("window", "hidden", "egl", "osmesa")
+PLATFORMS = {"egl": "egl", "osmesa": "osmesa"}
+
+
+def select_platform(backend):
+    if backend not in BACKENDS:
+        raise ValueError("unknown render backend '%s', use one of %s"
+                         % (backend, ", ".join(BACKENDS)))
+    if backend == "osmesa" and ctypes.util.find_library("OSMesa") is None:
+        raise RuntimeError("render backend 'osmesa' needs libOSMesa "
+                           "(e.g. the libosmesa6 package)")
+    if backend in PLATFORMS:
+        os.environ.setdefault("PYOPENGL_PLATFORM", PLATFORMS[backend])
+    if backend == "egl":
+        os.environ.setdefault("EGL_PLATFORM", "surfaceless")
+
+
+class RenderContext:
+    """Current GL context of the given size"""
+
+    # True if there is a window with events to handle
+    interactive = False
+
+    def __init__(self, size):
+        self.size = tuple(size)
+
+    def swap(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class WindowContext(RenderContext):
+    interactive = True
+
+    def __init__(self, size, caption=None):
+        super().__init__(size)
+        import pygame
+        pygame.init()
+        if caption is not None:
+            pygame.display.set_caption(caption)
+        pygame.display.set_mode(self.size,
+                                pygame.DOUBLEBUF | pygame.OPENGL, vsync=0)
+
+    def swap(self):
+        import pygame
+        pygame.display.flip()
+
+    def close(self):
+        import pygame
+        pygame.quit()
+
+
+class FramebufferTarget:
+    """Color + depth renderbuffers, bound for drawing and reading"""
+
+    def __init__(self, size):
+        from OpenGL.GL import (
+            GL_COLOR_ATTACHMENT0, GL_DEPTH_ATTACHMENT, GL_DEPTH_COMPONENT24,
+            GL_FRAMEBUFFER, GL_FRAMEBUFFER_COMPLETE, GL_RENDERBUFFER, GL_RGBA8,
+            glBindFramebuffer, glBindRenderbuffer, glCheckFramebufferStatus,
+            glFramebufferRenderbuffer, glGenFramebuffers, glGenRenderbuffers,
+            glRenderbufferStorage, glViewport)
+        width, height = size
+        self.framebuffer_id = glGenFramebuffers(1)
+        self.renderbuffer_ids = glGenRenderbuffers(2)
+        glBindFramebuffer(GL_FRAMEBUFFER, self.framebuffer_id)
+        for renderbuffer_id, internal_format, attachment in (
+                (self.renderbuffer_ids[0], GL_RGBA8, GL_COLOR_ATTACHMENT0),
+                (self.renderbuffer_ids[1], GL_DEPTH_COMPONENT24,
+                 GL_DEPTH_ATTACHMENT)):
+            glBindRenderbuffer(GL_RENDERBUFFER, renderbuffer_id)
+            glRenderbufferStorage(GL_RENDERBUFFER, internal_format, width,
+                                  height)
+            glFramebufferRenderbuffer(GL_FRAMEBUFFER, attachment,
+                                      GL_RENDERBUFFER, renderbuffer_id)
+        status = glCheckFramebufferStatus(GL_FRAMEBUFFER)
+        if status != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("framebuffer incomplete: 0x%x" % status)
+        glViewport(0, 0, width, height)
+
+    def delete(self):
+        from OpenGL.GL import (GL_FRAMEBUFFER, glBindFramebuffer,
+                               glDeleteFramebuffers, glDeleteRenderbuffers)
+        glBindFramebuffer(GL_FRAMEBUFFER, 0)
+        glDeleteFramebuffers(1, [self.framebuffer_id])
+        glDeleteRenderbuffers(2, self.renderbuffer_ids)
+
+
+class HiddenWindowContext(RenderContext):
+    def __init__(self, size):
+        super().__init__(size)
+        import pygame
+        pygame.init()
+        pygame.display.set_mode(self.size, pygame.OPENGL | pygame.HIDDEN,
+                                vsync=0)
+        # a hidden window owns no pixels, draw into our own buffers
+        self.target = FramebufferTarget(self.size)
+
+    def close(self):
+        import pygame
+        self.target.delete()
+        pygame.quit()
+
+
+class EGLContext(RenderContext):
+    def __init__(self, size):
+        super().__init__(size)
+        from OpenGL import EGL
+        from OpenGL.GL import glViewport
+        self.EGL = EGL
+        width, height = self.size
+        self.display = EGL.eglGetDisplay(EGL.EGL_DEFAULT_DISPLAY)
+        major, minor = EGL.EGLint(), EGL.EGLint()
+        if not EGL.eglInitialize(self.display, ctypes.pointer(major),
+                                 ctypes.pointer(minor)):
+            raise RuntimeError("eglInitialize failed")
+        attributes = [
+            EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+            EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+            EGL.EGL_RED_SIZE, 8, EGL.EGL_GREEN_SIZE, 8,
+            EGL.EGL_BLUE_SIZE, 8, EGL.EGL_ALPHA_SIZE, 8,
+            EGL.EGL_DEPTH_SIZE, 24,
+            EGL.EGL_NONE,
+        ]
+        config = EGL.EGLConfig()
+        config_count = EGL.EGLint()
+        EGL.eglChooseConfig(self.display,
+                            (EGL.EGLint * len(attributes))(*attributes),
+                            ctypes.pointer(config), 1,
+                            ctypes.pointer(config_count))
+        if config_count.value == 0:
+            raise RuntimeError("no EGL config with an OpenGL pbuffer")
+        surface_attributes = [EGL.EGL_WIDTH, width, EGL.EGL_HEIGHT, height,
+                              EGL.EGL_NONE]
+        self.surface = EGL.eglCreatePbufferSurface(
+            self.display, config,
+            (EGL.EGLint * len(surface_attributes))(*surface_attributes))
+        EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+        self.context = EGL.eglCreateContext(self.display, config,
+                                            EGL.EGL_NO_CONTEXT, None)
+        if not EGL.eglMakeCurrent(self.display, self.surface, self.surface,
+                                  self.context):
+            raise RuntimeError("eglMakeCurrent failed")
+        glViewport(0, 0, width, height)
+
+    def close(self):
+        EGL = self.EGL
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE,
+                           EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroySurface(self.display, self.surface)
+        EGL.eglDestroyContext(self.display, self.context)
+        EGL.eglTerminate(self.display)
+
+
+class OSMesaContext(RenderContext):
+    def __init__(self, size):
+        super().__init__(size)
+        from OpenGL import arrays, osmesa
+        from OpenGL.GL import GL_UNSIGNED_BYTE, glViewport
+        self.osmesa = osmesa
+        width, height = self.size
+        self.context = osmesa.OSMesaCreateContextExt(osmesa.OSMESA_RGBA, 24,
+                                                     0, 0, None)
+        if not self.context:
+            raise RuntimeError("OSMesaCreateContextExt failed")
+        self.buffer = arrays.GLubyteArray.zeros((height, width, 4))
+        if not osmesa.OSMesaMakeCurrent(self.context, self.buffer,
+                                        GL_UNSIGNED_BYTE, width, height):
+            raise RuntimeError("OSMesaMakeCurrent failed")
+        glViewport(0, 0, width, height)
+
+    def close(self):
+        self.osmesa.OSMesaDestroyContext(self.context)
+
+
+def create_render_context(backend, size, caption=None):
+    """Creates the context and makes it current"""
+    if backend == "window":
+        return WindowContext(size, caption)
+    if backend == "hidden":
+        return HiddenWindowContext(size)
+    if backend == "egl":
+        return EGLContext(size)
+    if backend == "osmesa":
+        return OSMesaContext(size)
+    raise ValueError("unknown render backend '%s', use one of %s"
+                     % (backend, ", ".join(BACKENDS)))